@@ -0,0 +1,741 @@
+# ----------------------------
+# BENCHMARKS
+# ----------------------------
+# bot.py uchun oflayn benchmarklar: python bench.py NOMI [argumentlar]
+# Vaqtinchalik baza, soxta worksheet va soxta Bot API ishlatiladi; BOT_API_TOKEN shart emas.
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from aiohttp import web
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.contrib.fsm_storage.memory import MemoryStorage
+from aiogram.types import ReplyKeyboardMarkup
+
+import bot
+from tests.fakes import FakeWorksheet
+# Ishga tushganda qayta bog'lanadigan globallar (db_pool, storage, bot, dp, notifier) bot. orqali olinadi
+from bot import (
+    API_TOKEN, DB_WORKER_THREADS, HASH_WORKERS, MIGRATIONS, ORDERS_PAGE_SIZE, ORDER_SUMMARY_TEMPLATE,
+    PRICE_CONFIRM_TEMPLATE, PRODUCTS_WITH_FIXED_SIZE, PRODUCT_PRICES, QUANTITY_KEYBOARD, REGIONS,
+    SIZES, YES_NO_KEYBOARD, ConnectionPool, PasswordHasher, PriceMatrix, SQLiteStorage,
+    SheetsExporter, _percentile, apply_migrations, build_dispatcher, catalog, count_outbox, fts_query, get_admins,
+    get_orders_page, get_sales_stats, get_schema_version, get_user_by_login, get_user_by_telegram_id,
+    get_user_by_telegram_id_async, get_user_orders, init_db, insert_user, insert_users, logger,
+    parse_users_csv, render_order_items, render_order_totals, render_orders_page, save_order,
+    save_order_async, search_orders, throttling,
+)
+
+def _run_bench(label, fn, iterations):
+    """fn(i) ni iterations marta chaqiradi va natijani chop etadi."""
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<45} {iterations:>7} ta  {elapsed:8.3f} s  {iterations / elapsed:>10,.0f} op/s")
+    return iterations / elapsed
+
+@contextmanager
+def bench_database(sellers=100):
+    """Vaqtinchalik bazani ochib, db_pool ni unga yo'naltiradi va sotuvchilar bilan to'ldiradi."""
+    original_pool = bot.db_pool
+    original_level = logger.level
+    logger.setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_file = os.path.join(tmp_dir, "bench.db")
+        bot.db_pool = ConnectionPool(db_file)
+        try:
+            init_db()
+            for i in range(sellers):
+                insert_user(f"seller{i}", "Bench Sotuvchi", "900000000", "x", telegram_id=1000 + i)
+            yield db_file
+        finally:
+            bot.db_pool.close()
+            bot.db_pool = original_pool
+            logger.setLevel(original_level)
+
+BENCH_PRODUCTS = [{'name': 'PREMIUM', 'size': '200x90', 'quantity': 1, 'unit_price': 1620000, 'total_price': 1620000}]
+
+def bench_db_connections(iterations=5000):
+    """Har chaqiruvda ulanish ochish va ulanishlar pulini solishtiradi (python bench.py db)."""
+    with bench_database() as db_file:
+        writes = max(iterations // 5, 1)
+
+        def per_call_read(i):
+            conn = sqlite3.connect(db_file)
+            conn.execute("SELECT * FROM users WHERE login = ?", (f"seller{i % 100}",)).fetchone()
+            conn.close()
+
+        def pooled_read(i):
+            get_user_by_login(f"seller{i % 100}")
+
+        def cached_read(i):
+            get_user_by_telegram_id(1000 + i % 100)
+
+        def per_call_write(i):
+            conn = sqlite3.connect(db_file)
+            conn.execute("""
+                INSERT INTO orders (
+                    user_id, products, total_price, payment, remaining_payment,
+                    customer_name, customer_surname, phone_number,
+                    location, detailed_address, delivery_time, additional_comments, order_date
+                ) VALUES (?, 'PREMIUM (200x90)', 1620000, 0, 1620000, 'Ism', 'Familiya', '901234567',
+                          'Andijon', 'Manzil', 'Bugun', '', ?)
+            """, (1 + i % 100, datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')))
+            conn.commit()
+            conn.close()
+
+        def pooled_write(i):
+            save_order(1 + i % 100, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                       'Andijon', 'Manzil', 'Bugun', '')
+
+        print(f"SQLite {sqlite3.sqlite_version}, baza: {db_file}")
+        read_old = _run_bench("O'qish: har chaqiruvda sqlite3.connect", per_call_read, iterations)
+        read_new = _run_bench("O'qish: ConnectionPool", pooled_read, iterations)
+        _run_bench("O'qish: UserCache (telegram_id)", cached_read, iterations)
+        write_old = _run_bench("Yozish: har chaqiruvda sqlite3.connect", per_call_write, writes)
+        write_new = _run_bench("Yozish: ConnectionPool (save_order)", pooled_write, writes)
+        print(f"O'qish tezlashishi: x{read_new / read_old:.1f}, yozish tezlashishi: x{write_new / write_old:.1f}")
+
+async def _measure_loop_lag(workload, interval=0.001):
+    """workload() bajarilayotganda event loop kechikishlarini (soniyada) yig'adi."""
+    lags = []
+    stop = asyncio.Event()
+
+    async def monitor():
+        while not stop.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(interval)
+            lags.append(time.perf_counter() - started - interval)
+
+    monitor_task = asyncio.create_task(monitor())
+    await asyncio.sleep(interval * 2)
+    started = time.perf_counter()
+    await workload()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor_task
+    return elapsed, lags
+
+def bench_event_loop_lag(concurrent_orders=200, lock_hold=0.25):
+    """
+    Parallel buyurtma tasdiqlashlarda event loop kechikishini o'lchaydi (python bench.py loop_lag).
+
+    O'lchov vaqtida boshqa ulanish (masalan, eksport yoki boshqa jarayon) yozish lockini
+    lock_hold soniya ushlab turadi; shu payt kelgan buyurtmalar commitni kutadi.
+    """
+    with bench_database() as db_file:
+
+        def hold_write_lock():
+            conn = sqlite3.connect(db_file, isolation_level=None)
+            conn.execute("BEGIN IMMEDIATE")
+            time.sleep(lock_hold)
+            conn.execute("COMMIT")
+            conn.close()
+
+        async def confirm_blocking(i):
+            user = get_user_by_telegram_id(1000 + i % 100)
+            save_order(user.user_id, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                       'Andijon', 'Manzil', 'Bugun', '')
+
+        async def confirm_async(i):
+            user = await get_user_by_telegram_id_async(1000 + i % 100)
+            await save_order_async(user.user_id, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                                   'Andijon', 'Manzil', 'Bugun', '')
+
+        async def run():
+            # Oqimlar va ularning o'quvchi ulanishlarini oldindan ochib qo'yamiz
+            await asyncio.gather(*(get_user_by_telegram_id_async(1000) for _ in range(DB_WORKER_THREADS * 4)))
+            for label, confirm in (("Sinxron (event loop ichida)", confirm_blocking),
+                                   ("Asinxron (DB oqimlari)", confirm_async)):
+                async def arrive(i):
+                    await asyncio.sleep(i * 0.002)  # Buyurtmalar ketma-ket kelib turadi
+                    await confirm(i)
+
+                async def workload():
+                    locker = threading.Thread(target=hold_write_lock)
+                    locker.start()
+                    await asyncio.gather(*(arrive(i) for i in range(concurrent_orders)))
+                    locker.join()
+
+                elapsed, lags = await _measure_loop_lag(workload)
+                print(f"{label:<30} {concurrent_orders} ta buyurtma {elapsed:6.3f} s  "
+                      f"loop kechikishi p50={_percentile(lags, 50) * 1000:.2f} ms  "
+                      f"p99={_percentile(lags, 99) * 1000:.2f} ms  max={max(lags, default=0) * 1000:.2f} ms")
+
+        asyncio.run(run())
+
+def bench_sheets_export(orders=200, latency=0.5):
+    """Sekin va vaqti-vaqti bilan ishlamaydigan jadvalda buyurtma tasdiqlash kechikishini o'lchaydi (python bench.py sheets)."""
+    with bench_database():
+        worksheet = FakeWorksheet(latency=latency, failures=1)
+        exporter = SheetsExporter(worksheet_factory=lambda: worksheet, batch_size=50, flush_interval=0.2)
+
+        async def run():
+            exporter.start()
+            latencies = []
+            for i in range(orders):
+                started = time.perf_counter()
+                await save_order_async(1 + i % 100, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                                       'Andijon', 'Manzil', 'Bugun', '')
+                exporter.notify()
+                latencies.append(time.perf_counter() - started)
+            # Xatolikdan keyingi pauzani kutib o'tirmaslik uchun qayta urinish vaqtlarini nolga tushiramiz
+            deadline = time.perf_counter() + 30
+            while count_outbox() and time.perf_counter() < deadline:
+                with bot.db_pool.writer() as conn:
+                    conn.execute("UPDATE sheets_outbox SET next_attempt_at = 0")
+                await asyncio.sleep(exporter.flush_interval)
+            await exporter.stop()
+            print(f"Tasdiqlash kechikishi: p50={_percentile(latencies, 50) * 1000:.2f} ms  "
+                  f"p99={_percentile(latencies, 99) * 1000:.2f} ms (jadval kechikishi {latency * 1000:.0f} ms)")
+            print(f"Jadvalga yozildi: {len(worksheet.rows)}/{orders} qator, append_rows chaqiruvlari: {worksheet.calls}, "
+                  f"outbox da qoldi: {count_outbox()}")
+
+        asyncio.run(run())
+
+def bench_reconcile(orders=5000, new=200, lost=5):
+    """
+    Jadvalda orders ta qator bo'lganda reconcile narxini o'lchaydi: birinchi (to'liq) o'qish, so'ng
+    new ta yangi buyurtmadan lost tasi jadvalga yetmagan holat (python bench.py reconcile [buyurtmalar] [yangi]).
+    """
+    with bench_database():
+        worksheet = FakeWorksheet()
+        worksheet.rows.append(["login", "FIO", "..."])  # sarlavha qatori
+        exporter = SheetsExporter(worksheet_factory=lambda: worksheet, reconcile_interval=0)
+
+        def add_orders(count):
+            with bot.db_pool.writer() as conn:
+                conn.execute("UPDATE sheets_outbox SET next_attempt_at = 0")
+            for i in range(count):
+                save_order(1 + i % 100, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567', 'Andijon', 'Manzil', 'Bugun', '')
+
+        async def run(label):
+            cells, started = worksheet.cells_read, time.perf_counter()
+            result = await exporter.reconcile()
+            print(f"{label:<40} {(time.perf_counter() - started) * 1000:8.1f} ms  o'qilgan qatorlar: {worksheet.cells_read - cells:>6}  "
+                  f"tekshirildi: {result.checked:>5}  yo'q: {len(result.missing):>3}  takror: {len(result.duplicates)}")
+
+        async def scenario():
+            add_orders(orders)
+            await exporter.flush()
+            await run(f"Birinchi tekshiruv ({orders} qator)")
+            add_orders(new)
+            await exporter.flush()
+            del worksheet.rows[-lost:]  # oxirgi qatorlar jadvalga yetmagan
+            await run(f"+{new} buyurtma, {lost} tasi yo'qolgan")
+            await run("Takroriy tekshiruv")
+            await exporter.stop()
+            print(f"Jadvalda: {len(worksheet.rows) - 1} qator, bazada: {orders + new} buyurtma")
+
+        asyncio.run(scenario())
+
+def bench_fsm_storage(users=200, steps=20):
+    """MemoryStorage va SQLiteStorage ni buyurtma qadamlarida solishtiradi va qayta ishga tushishni tekshiradi (python bench.py fsm)."""
+    with bench_database(sellers=0):
+        def count_writes():
+            with bot.db_pool.reader() as conn:
+                return conn.execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0]
+
+        async def order_flow(fsm):
+            latencies = []
+            for step in range(steps):
+                for user in range(users):
+                    started = time.perf_counter()
+                    # Har bir buyurtma qadamida handler odatda holatni o'qiydi, ma'lumotni yangilaydi va holatni o'zgartiradi
+                    await fsm.get_state(chat=user, user=user)
+                    data = await fsm.get_data(chat=user, user=user)
+                    products = data.get('products', []) + [{'name': 'PREMIUM', 'size': '200x90', 'quantity': 1}]
+                    await fsm.update_data(chat=user, user=user, products=products)
+                    await fsm.update_data(chat=user, user=user, current_product={})
+                    await fsm.set_state(chat=user, user=user, state=f"OrderProcess:step{step}")
+                    latencies.append(time.perf_counter() - started)
+            return latencies
+
+        async def run():
+            for label, fsm in (("MemoryStorage", MemoryStorage()), ("SQLiteStorage", SQLiteStorage(flush_interval=0.05))):
+                latencies = await order_flow(fsm)
+                print(f"{label:<14} qadam: p50={_percentile(latencies, 50) * 1e6:.1f} us  "
+                      f"p99={_percentile(latencies, 99) * 1e6:.1f} us")
+                if isinstance(fsm, SQLiteStorage):
+                    await fsm.close()
+            # Qayta ishga tushish: yangi storage holatni bazadan tiklashi kerak
+            restored = SQLiteStorage()
+            state = await restored.get_state(chat=0, user=0)
+            data = await restored.get_data(chat=0, user=0)
+            print(f"Qayta ishga tushgandan keyin: holat={state}, mahsulotlar={len(data.get('products', []))}, "
+                  f"bazadagi yozuvlar={count_writes()}")
+            await restored.close()
+
+        asyncio.run(run())
+
+def bench_pricing(lines=200_000):
+    """Har qatorda o'lchamni qayta parse qilish va narxlar jadvalidan olishni solishtiradi (python bench.py pricing)."""
+    price_matrix = catalog.snapshot.price_matrix
+    products = [product for product in PRODUCT_PRICES if product not in PRODUCTS_WITH_FIXED_SIZE]
+    batch = [(products[i % len(products)], price_matrix.sizes[i % len(price_matrix.sizes)], 1 + i % 5)
+             for i in range(lines)]
+
+    def legacy_quote(i):
+        # handle_quantity ning oldingi hisobi
+        product, size, quantity = batch[i]
+        width_cm, length_cm = map(int, re.findall(r'\d+', size))
+        return PRODUCT_PRICES.get(product, 0) * ((width_cm * length_cm) / 10000) * quantity
+
+    legacy = _run_bench("re.findall + maydon (har qatorda)", legacy_quote, lines)
+    single = _run_bench("PriceMatrix.quote (har qatorda)", lambda i: price_matrix.quote(*batch[i]), lines)
+    _run_bench("PriceMatrix qayta qurish", lambda i: PriceMatrix(PRODUCT_PRICES, SIZES, PRODUCTS_WITH_FIXED_SIZE), 1000)
+    print(f"Tezlashish: quote x{single / legacy:.1f}")
+
+def bench_rendering(iterations=20000):
+    """Buyurtma qadamlarida klaviatura va xabar tayyorlash narxini o'lchaydi (python bench.py render)."""
+    from aiogram.utils.payload import prepare_arg
+    data = {
+        'products': [{'name': name, 'size': '200x90', 'quantity': 2, 'unit_price': 1620000.0, 'total_price': 3240000.0}
+                     for name in ('PREMIUM', 'KAPSULA', 'MILANO')],
+        'prepayment': 100000, 'customer_name': 'Ism', 'customer_surname': 'Familiya', 'phone_number': '901234567',
+        'location': 'Andijon', 'detailed_address': 'Manzil', 'delivery_time': 'Bugun', 'additional_comments': 'izoh',
+    }
+
+    def legacy_keyboards(i):
+        # Har bir handlerda yangi klaviatura yasalib, har safar JSON ga aylantirilardi
+        prepare_arg(ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(
+            "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"))
+        prepare_arg(ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(*REGIONS))
+        prepare_arg(ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("✅ Ha", "❌ Yo'q"))
+
+    def prebuilt_keyboards(i):
+        prepare_arg(QUANTITY_KEYBOARD)
+        prepare_arg(catalog.snapshot.region_keyboard)
+        prepare_arg(YES_NO_KEYBOARD)
+
+    def legacy_summary(i):
+        products = data['products']
+        total_price = sum([p['total_price'] for p in products])
+        products_formatted = "\n".join([f"{idx}. {p['name']} ({p['size']}) - {p['quantity']} ta - {p['unit_price']:,.0f} so'm"
+                                        for idx, p in enumerate(products, start=1)])
+        order_summary = (
+            f"📦 **Sizning buyurtmangiz:**\n\n"
+            f"**Mahsulotlar:**\n{products_formatted}\n\n"
+            f"💰 **Umumiy summa:** {total_price:,.0f} so'm\n"
+            f"💵 **Oldindan to'lov:** {data['prepayment']:,.0f} so'm\n"
+            f"💳 **Qoldiq to'lov:** {total_price - data['prepayment']:,.0f} so'm\n"
+            f"👤 **Mijoz:** {data['customer_name']} {data['customer_surname']}\n"
+            f"📱 **Telefon:** {data['phone_number']}\n"
+            f"🏠 **Manzil:** {data['location']} - {data['detailed_address']}\n"
+            f"⏰ **Yetkazib berish muddati:** {data['delivery_time']}\n"
+        )
+        order_summary += f"📝 **Qo'shimcha izohlar:** {data['additional_comments']}\n"
+        order_summary += "\n📜 **Ma'lumotlar to'g'rimi?**"
+        return order_summary
+
+    def template_summary(i):
+        return ORDER_SUMMARY_TEMPLATE.render(
+            products=render_order_items(data['products'], "\n", numbered=True), **render_order_totals(data))
+
+    def legacy_confirm(i):
+        product = data['products'][i % 3]
+        return (
+            f"💰 **Mahsulot:** {product['name']}\n"
+            f"📐 **O'lcham:** {product['size']}\n"
+            f"🔢 **Soni:** {product['quantity']}\n"
+            f"💰 **Umumiy summa:** {product['total_price']:,.0f} so'm\n\n"
+            f"✅ **Summa to'g'rimi?**"
+        )
+
+    def template_confirm(i):
+        product = data['products'][i % 3]
+        return PRICE_CONFIRM_TEMPLATE.render(product=product['name'], size=product['size'], quantity=product['quantity'],
+                                             total_label="Umumiy summa", total_price=product['total_price'])
+
+    rows = [('seller1', 'Bench Sotuvchi', '900000000', None, 'sotuvchi', i, 'PREMIUM (200x90) - 1 ta - 1,620,000 so\'m',
+             1620000.0, 0.0, 1620000.0, 'Ism', 'Familiya', '901234567', 'Andijon', 'Manzil', 'Bugun', '2024-01-01 10:00:00')
+            for i in range(ORDERS_PAGE_SIZE)]
+
+    for label, fn in (("Klaviaturalar: har safar yasash + JSON", legacy_keyboards),
+                      ("Klaviaturalar: oldindan tayyor JSON", prebuilt_keyboards),
+                      ("Buyurtma xulosasi: += (ekranlashsiz)", legacy_summary),
+                      ("Buyurtma xulosasi: shablon (ekranlash bilan)", template_summary),
+                      ("Summa tasdig'i: f-satr (ekranlashsiz)", legacy_confirm),
+                      ("Summa tasdig'i: shablon (ekranlash bilan)", template_confirm),
+                      ("/all_orders sahifasi: shablon", lambda i: render_orders_page(rows, {}))):
+        rate = _run_bench(label, fn, iterations)
+        print(f"{'':<45} {1e6 / rate:.1f} us/qadam")
+
+def bench_migrations(orders=1_000_000, sellers=1000):
+    """Sintetik bazada migratsiyalardan oldin va keyin asosiy so'rovlarni o'lchaydi (python bench.py migrations [buyurtmalar])."""
+    with bench_database(sellers=0) as db_file:
+        # bench_database migratsiyalarni qo'llagan; sxemani 0-versiyaga qaytarib, bazani qaytadan quramiz
+        bot.db_pool.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(db_file + suffix):
+                os.remove(db_file + suffix)
+        init_db(migrate=False)
+        print(f"📦 {orders:,} ta buyurtma va {sellers} ta sotuvchi yaratilmoqda...")
+        started = time.perf_counter()
+        with bot.db_pool.writer() as conn:
+            conn.executemany(
+                "INSERT INTO users (login, full_name, phone_number, password, role, telegram_id) VALUES (?, ?, ?, 'x', ?, ?)",
+                ((f"seller{i:05d}", "Bench Sotuvchi", "900000000", 'admin' if i % 100 == 0 else 'sotuvchi', 1000 + i)
+                 for i in range(sellers))
+            )
+            base = datetime(2024, 1, 1).timestamp()
+            conn.executemany("""
+                INSERT INTO orders (user_id, products, total_price, payment, remaining_payment, customer_name,
+                                    customer_surname, phone_number, location, detailed_address, delivery_time,
+                                    additional_comments, order_date)
+                VALUES (?, 'PREMIUM (200x90) - 1 ta - 1,620,000 so''m', 1620000, 0, 1620000, 'Ism', 'Familiya',
+                        '901234567', 'Andijon', 'Manzil', 'Bugun', '', ?)
+            """, ((1 + i % sellers, datetime.utcfromtimestamp(base + i * 30).strftime('%Y-%m-%d %H:%M:%S'))
+                  for i in range(orders)))
+        print(f"   {time.perf_counter() - started:.1f} s")
+
+        middle = datetime.utcfromtimestamp(datetime(2024, 1, 1).timestamp() + orders * 15)
+        day = middle.strftime('%Y-%m-%d')
+
+        def run_queries(label):
+            print(f"--- {label} (sxema versiyasi {get_schema_version()})")
+            _run_bench("get_user_orders", lambda i: get_user_orders(1 + i % sellers), 20)
+            _run_bench("get_admins", lambda i: get_admins(), 20)
+            _run_bench("get_orders_page (keyingi sahifa)", lambda i: get_orders_page(after_id=1 + i * 997), 20)
+            column = "order_ts" if get_schema_version() >= 2 else "order_date"
+            low, high = ((f"CAST(strftime('%s', '{day}') AS INTEGER)", f"CAST(strftime('%s', '{day}', '+1 day') AS INTEGER)")
+                         if column == "order_ts" else (f"'{day}'", f"date('{day}', '+1 day')"))
+
+            def day_range(i):
+                with bot.db_pool.reader() as conn:
+                    conn.execute(f"SELECT COUNT(*), SUM(total_price) FROM orders WHERE {column} >= {low} AND {column} < {high}").fetchone()
+
+            _run_bench(f"Bir kunlik buyurtmalar ({column})", day_range, 20)
+            if get_schema_version() >= 7:
+                _run_bench("search_orders (FTS5, keng so'z)", lambda i: search_orders(fts_query("Familiya")), 20)
+                _run_bench("search_orders (FTS5, telefon)", lambda i: search_orders(fts_query("90123")), 20)
+                _run_bench("search_orders (FTS5, sotuvchi doirasi)",
+                           lambda i: search_orders(fts_query("Familiya"), user_id=1 + i % sellers), 20)
+            if get_schema_version() >= 6:
+                _run_bench("get_sales_stats (bir kun, agregatlar)", lambda i: get_sales_stats(day, day), 20)
+                _run_bench("get_sales_stats (butun davr, agregatlar)", lambda i: get_sales_stats(), 20)
+
+        run_queries("Migratsiyalardan oldin")
+        for number, description, migrate in MIGRATIONS:
+            started = time.perf_counter()
+            apply_migrations(target=number)
+            print(f"🔧 {number}-migratsiya ({description}): {time.perf_counter() - started:.2f} s")
+        run_queries("Migratsiyalardan keyin")
+
+BENCH_BOT_TOKEN = "123456:bench"
+
+class FakeBotAPI:
+    """
+    Telegram Bot API ning oflayn o'rinbosari (getUpdates, sendMessage, sendDocument va boshqalar).
+
+    Alohida oqimda o'z event loop ida ishlaydi, shuning uchun uning ishi bot loopining
+    kechikishiga qo'shilmaydi. Botdan chiqqan xabarlar chat bo'yicha navbatlarga yig'iladi.
+    """
+
+    def __init__(self, host='127.0.0.1'):
+        self.host = host
+        self.url = None
+        self.loop = asyncio.new_event_loop()
+        self.requests = Counter()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="fake-bot-api", daemon=True)
+        self._runner = None
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._new_updates = None
+        self._replies = defaultdict(asyncio.Queue)
+
+    def start(self):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def run(self, coro):
+        """Korutinani server loopida bajaradi; chaqiruvchi loopda kutiladigan future qaytaradi."""
+        return asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
+
+    async def _start(self):
+        self._new_updates = asyncio.Event()
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.url = f"http://{self.host}:{self._runner.addresses[0][1]}"
+
+    def _message(self, chat_id, **fields):
+        self._message_id += 1
+        return {'message_id': self._message_id, 'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'}, **fields}
+
+    async def _handle(self, request):
+        method = request.match_info['method'].lower()
+        self.requests[method] += 1
+        data = {**request.query, **(await request.post())}
+        if method == 'getupdates':
+            result = await self._get_updates(int(data.get('offset') or 0), int(data.get('limit') or 100),
+                                             float(data.get('timeout') or 0))
+        elif method in ('sendmessage', 'editmessagetext', 'senddocument'):
+            chat_id = int(data['chat_id'])
+            text = data.get('text') or data.get('caption') or ''
+            self._replies[chat_id].put_nowait(text)
+            result = self._message(chat_id, text=text)
+        elif method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    async def _get_updates(self, offset, limit, timeout):
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    def send_update(self, user_id, text):
+        """Foydalanuvchidan kelgan matnli xabarni getUpdates navbatiga qo'yadi (server loopida chaqiriladi)."""
+        self._update_id += 1
+        message = self._message(user_id, text=text, **{'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'}})
+        self._updates.append({'update_id': self._update_id, 'message': message})
+        self._new_updates.set()
+
+    async def exchange(self, user_id, text, replies=1, timeout=30.0):
+        """Xabar yuborib, botdan replies ta javob kelguncha kutadi. (kechikish, javoblar) qaytaradi."""
+        started = time.perf_counter()
+        self.send_update(user_id, text)
+        answers = [await asyncio.wait_for(self._replies[user_id].get(), timeout) for _ in range(replies)]
+        return time.perf_counter() - started, answers
+
+# Sotuvchining to'liq buyurtma yo'li: (handler, xabar, kutiladigan javoblar soni)
+BENCH_ORDER_STEPS = (
+    ('start_order', "📦 Buyurtma Qo'shish", 1),
+    ('handle_product', "PREMIUM", 1),
+    ('handle_size', "200x90", 1),
+    ('handle_quantity', "2", 1),
+    ('confirm_sum', "✅ Ha", 1),
+    ('finalize_order_start', "✅ Buyurtmani Yakunlash", 1),
+    ('get_customer_name', "Ism", 1),
+    ('get_customer_surname', "Familiya", 1),
+    ('get_customer_phone_number', "901234567", 1),
+    ('get_location', "Andijon", 1),
+    ('get_detailed_address', "Manzil", 1),
+    ('get_delivery_time', "Bugun", 1),
+    ('get_prepayment', "500000", 1),
+    ('get_additional_comments', "Yo'q", 1),
+    ('confirm_order', "✅ Ha", 2),
+)
+
+def bench_end_to_end(sellers=200, orders=2, admins=2):
+    """
+    Soxta Bot API orqali sotuvchilarning to'liq buyurtma yo'lini o'lchaydi (python bench.py e2e [sotuvchilar] [buyurtmalar]).
+
+    Bot odatdagidek getUpdates bilan polling qiladi; har bir sotuvchi javobni kutib, keyingi
+    qadamni yuboradi. update/s, handlerlar bo'yicha p50/p95/p99 va event loop kechikishi chiqariladi.
+    """
+    with bench_database(sellers=sellers):
+        for i in range(admins):
+            insert_user(f"admin{i}", "Bench Admin", "900000000", "x", role='admin', telegram_id=1 + i)
+        catalog.load()
+        api = FakeBotAPI().start()
+        original_storage = bot.storage
+        bot.storage = SQLiteStorage()
+        # Soxta API istalgan tokenni qabul qiladi: BOT_API_TOKEN shart emas
+        build_dispatcher(API_TOKEN or BENCH_BOT_TOKEN)
+        bot.bot.server = TelegramAPIServer.from_base(api.url)
+        latencies = defaultdict(list)
+        errors = []
+        # LoggingMiddleware har bir yangilanishni yozadi; natijalar jadvali ko'rinib turishi uchun
+        aiogram_logger = logging.getLogger('aiogram')
+        original_level = aiogram_logger.level
+        aiogram_logger.setLevel(logging.WARNING)
+        # Sotuvchilar javobni olishi bilan keyingi qadamni yuboradi (odamdan tezroq): chat limiti o'lchovga aralashmasin
+        original_limits = throttling.chat_rate, throttling.chat_burst
+        throttling.chat_rate = throttling.chat_burst = 1e6
+
+        async def seller(i):
+            await asyncio.sleep(i * 0.005)  # sotuvchilar birin-ketin ulanadi
+            for _ in range(orders):
+                for handler, text, replies in BENCH_ORDER_STEPS:
+                    latency, answers = await api.exchange(1000 + i, text, replies)
+                    latencies[handler].append(latency)
+                    errors.extend(answer for answer in answers if answer.startswith("❌"))
+
+        async def sellers_done():
+            await asyncio.gather(*(seller(i) for i in range(sellers)))
+
+        async def run():
+            polling = asyncio.create_task(bot.dp.start_polling(timeout=1))
+
+            async def workload():
+                await api.run(sellers_done())
+
+            elapsed, lags = await _measure_loop_lag(workload)
+            bot.dp.stop_polling()
+            await bot.dp.wait_closed()
+            await polling
+            await bot.notifier.drain()
+            await bot.storage.close()
+            await (await bot.bot.get_session()).close()
+            return elapsed, lags
+
+        try:
+            elapsed, lags = asyncio.run(run())
+        finally:
+            bot.storage = original_storage
+            aiogram_logger.setLevel(original_level)
+            throttling.chat_rate, throttling.chat_burst = original_limits
+            api.stop()
+
+        updates = sellers * orders * len(BENCH_ORDER_STEPS)
+        print(f"{sellers} ta sotuvchi x {orders} ta buyurtma: {updates:,} ta yangilanish {elapsed:.2f} s, "
+              f"{updates / elapsed:,.0f} update/s, xato javoblar: {len(errors)}")
+        print(f"{'handler':<28} {'p50':>9} {'p95':>9} {'p99':>9}")
+        for handler, _, _ in BENCH_ORDER_STEPS:
+            values = latencies[handler]
+            print(f"{handler:<28} " + " ".join(f"{_percentile(values, percent) * 1000:7.1f}ms" for percent in (50, 95, 99)))
+        print(f"Event loop kechikishi: p50={_percentile(lags, 50) * 1000:.2f} ms  "
+              f"p99={_percentile(lags, 99) * 1000:.2f} ms  max={max(lags, default=0) * 1000:.2f} ms")
+        print("Bot API so'rovlari: " + ", ".join(f"{method}={count}" for method, count in api.requests.most_common()))
+        with bot.db_pool.reader() as conn:
+            print(f"Saqlangan buyurtmalar: {conn.execute('SELECT COUNT(*) FROM orders').fetchone()[0]}")
+
+BENCH_IMPORT_ROUNDS = 10  # bench tezroq tugashi uchun; nisbatlar BCRYPT_ROUNDS bilan bir xil
+
+def bench_import_users(rows=200):
+    """
+    CSV importini o'lchaydi: tekshirish, 1 va HASH_WORKERS jarayonda hashlash, har qatorga alohida
+    insert_user va bitta tranzaksiyali insert_users (python bench.py import [qatorlar]).
+    """
+    data = ("login,full_name,phone,role,password\n" + "".join(
+        f"user{i},Bench Sotuvchi {i},90{i:07d},sotuvchi,parol{i}\n" for i in range(rows))).encode('utf-8')
+    started = time.perf_counter()
+    parsed, errors = parse_users_csv(data)
+    print(f"CSV tekshirish: {len(parsed)} ta qator, {len(errors)} xato, {(time.perf_counter() - started) * 1000:.1f} ms")
+    hashes = []
+    for workers in sorted({1, HASH_WORKERS}):
+        hasher = PasswordHasher(workers=workers, rounds=BENCH_IMPORT_ROUNDS)
+        started = time.perf_counter()
+        hashes = asyncio.run(hasher.hash_many([row.password for row in parsed]))
+        elapsed = time.perf_counter() - started
+        hasher.shutdown()
+        print(f"bcrypt (narx {BENCH_IMPORT_ROUNDS}), {workers} jarayon: {elapsed:.2f} s, {len(parsed) / elapsed:,.0f} foydalanuvchi/s")
+    users = [(row.login, row.full_name, row.phone, hashed, row.role) for row, hashed in zip(parsed, hashes)]
+    with bench_database(sellers=0):
+        _run_bench("insert_user (har qatorga tranzaksiya)", lambda i: insert_user(*users[i][:4], role=users[i][4]), len(users))
+    with bench_database(sellers=0):
+        started = time.perf_counter()
+        inserted = insert_users(users)
+        elapsed = time.perf_counter() - started
+        print(f"{'insert_users (bitta tranzaksiya)':<45} {len(users):>7} ta  {elapsed:8.3f} s  {len(users) / elapsed:>10,.0f} op/s")
+        # Qayta import hech narsa qo'shmasligi kerak (loginlar band)
+        if not all(inserted) or any(insert_users(users[:10])):
+            print("❌ insert_users: barcha qatorlar qo'shilmadi yoki takroriy loginlar qabul qilindi")
+            sys.exit(1)
+
+# Import vaqtida yuklanmasligi kerak bo'lgan og'ir kutubxonalar (faqat kerakli yo'lda import qilinadi)
+LAZY_MODULES = ('gspread', 'google.auth', 'google.oauth2', 'bcrypt')
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "600"))
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$")
+
+def _import_profile(module, cwd, env):
+    """`python -X importtime -c "import module"` ni ishga tushiradi: (jarayon vaqti, modul yozuvi, bevosita importlar, barcha modullar)."""
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=cwd, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} xato bilan tugadi:\n{result.stderr[-2000:]}")
+    children, own, names = [], None, set()
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = int(match[1]), int(match[2]), len(match[3]) // 2, match[4]
+        names.add(name)
+        if indent == 1:
+            children.append((cumulative_us, name))
+        elif indent == 0:
+            if name == module:
+                own = (self_us, cumulative_us)
+                break
+            children = []
+    if own is None:
+        raise RuntimeError(f"importtime chiqishida {module} topilmadi")
+    return wall, own, children, names
+
+def bench_startup(runs=5):
+    """
+    Modul importi vaqtini `python -X importtime` orqali o'lchaydi (python bench.py startup [marta]).
+
+    Import bo'sh BOT_API_TOKEN bilan bajariladi (CLI buyruqlari tokensiz ishlashi kerak). Median
+    STARTUP_BUDGET_MS dan oshsa yoki LAZY_MODULES dan biri yuklansa, 1 kodi bilan chiqadi -
+    deploy oldidan regressiya tekshiruvi sifatida ishlatiladi.
+    """
+    module = bot.__name__
+    cwd = os.path.dirname(os.path.abspath(bot.__file__))
+    env = dict(os.environ, BOT_API_TOKEN='')  # bo'sh qiymatni load_dotenv .env dan almashtirmaydi
+    _import_profile(module, cwd, env)  # isitish: .pyc keshlari yoziladi
+    walls, totals = [], []
+    for _ in range(runs):
+        wall, (_, cumulative_us), children, names = _import_profile(module, cwd, env)
+        walls.append(wall)
+        totals.append(cumulative_us / 1000)
+    print(f"import {module}: median {_percentile(totals, 50):.0f} ms (min {min(totals):.0f} ms), "
+          f"jarayon bilan {_percentile(walls, 50) * 1000:.0f} ms, {runs} marta")
+    print(f"{'bevosita import':<40} {'ms':>8}")
+    for cumulative_us, name in sorted(children, reverse=True)[:10]:
+        print(f"{name:<40} {cumulative_us / 1000:8.1f}")
+    failures = []
+    loaded = [name for name in LAZY_MODULES if name in names]
+    if loaded:
+        failures.append(f"import vaqtida yuklangan og'ir modullar: {', '.join(loaded)}")
+    if _percentile(totals, 50) > STARTUP_BUDGET_MS:
+        failures.append(f"median import vaqti {_percentile(totals, 50):.0f} ms > {STARTUP_BUDGET_MS:.0f} ms (STARTUP_BUDGET_MS)")
+    for failure in failures:
+        print(f"❌ {failure}")
+    if failures:
+        sys.exit(1)
+    print("✅ Ishga tushish vaqti me'yorda.")
+
+BENCHMARKS = {
+    'db': bench_db_connections,
+    'loop_lag': bench_event_loop_lag,
+    'sheets': bench_sheets_export,
+    'reconcile': bench_reconcile,
+    'fsm': bench_fsm_storage,
+    'pricing': bench_pricing,
+    'render': bench_rendering,
+    'e2e': bench_end_to_end,
+    'import': bench_import_users,
+    'startup': bench_startup,
+    'migrations': bench_migrations,
+}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"❌ Foydalanish: python bench.py NOMI [argumentlar]. Benchmarklar: {', '.join(BENCHMARKS)}")
+        sys.exit(2)
+    BENCHMARKS[sys.argv[1]](*(int(arg) for arg in sys.argv[2:]))
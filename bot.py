@@ -1,26 +1,45 @@
 import sys
 import sqlite3
 import logging
-import bcrypt
-from datetime import datetime
-from functools import wraps
+from datetime import datetime, timezone
+from functools import wraps, cached_property
+from collections import OrderedDict, namedtuple, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from aiogram import Bot, Dispatcher, executor, types
 from aiogram.contrib.middlewares.logging import LoggingMiddleware
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
-from aiogram.contrib.fsm_storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove, ParseMode
-import gspread
-from google.oauth2.service_account import Credentials
-from gspread.exceptions import SpreadsheetNotFound, APIError, GSpreadException
+from aiogram.dispatcher.storage import BaseStorage
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.handler import current_handler, CancelHandler
+from aiogram.types import ReplyKeyboardMarkup, ReplyKeyboardRemove, ParseMode, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.utils.exceptions import RetryAfter
 from dotenv import load_dotenv
+import aiohttp
+from aiohttp import web
 import os
 import traceback
+import copy
 import csv
+import gzip
+import shutil
+import json
 import io
 import re
 import getpass
+import hmac
+import secrets
 import asyncio
+import threading
+import contextvars
+import bisect
+import multiprocessing
+import queue
+import signal
+import tempfile
+import time
+from contextlib import contextmanager, asynccontextmanager
 
 # ----------------------------
 # 1. LOG & BOT SETTINGS
@@ -38,14 +57,201 @@ GOOGLE_SHEETS_SPREADSHEET_NAME = os.getenv("GOOGLE_SHEETS_SPREADSHEET_NAME")
 
 GROUP_CHAT_ID = -4607325339  # Siz taqdim etgan GROUP_CHAT_ID
 
-if not API_TOKEN:
-    logger.error("❌ BOT_API_TOKEN o'zgaruvchisi topilmadi. Iltimos, .env faylini tekshiring.")
-    sys.exit(1)
+# ----------------------------
+# 1.1 METRICS
+# ----------------------------
+# Handlerlar, FSM holatlari, DB yordamchilari, Bot API va Sheets eksporti bo'yicha
+# gistogramma va hisoblagichlar. METRICS_PORT berilsa, /metrics da Prometheus
+# matn formatida beriladi (15 bo'limi).
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 - endpoint o'chirilgan
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+METRICS = []
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{str(value).translate(LABEL_ESCAPES)}"' for name, value in pairs) + "}"
+
+class Metric:
+    """Prometheus metrikasi asosi; qiymatlar yorliqlar kortejlari bo'yicha saqlanadi (oqimlar uchun xavfsiz)."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def render(self):
+        with self._lock:
+            items = [(labels, copy.copy(value)) for labels, value in self._values.items()]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in items:
+            lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels, value):
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"]
+
+class MetricCounter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+class MetricGauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+class MetricHistogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self, labels, value):
+        counts, total, count = value
+        samples, cumulative = [], 0
+        for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += bucket_count
+            samples.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', bound)])} {cumulative}")
+        samples.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+        samples.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return samples
+
+def render_metrics():
+    """Barcha metrikalarni Prometheus matn formatida qaytaradi."""
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+HANDLER_SECONDS = MetricHistogram("bot_handler_seconds", "Yangilanishni qayta ishlash vaqti, handler bo'yicha", ['handler'])
+STATE_SECONDS = MetricHistogram("bot_state_seconds", "Yangilanishni qayta ishlash vaqti, FSM holati bo'yicha", ['state'])
+DB_CALL_SECONDS = MetricHistogram("bot_db_call_seconds", "run_db orqali DB yordamchisi chaqiruvi vaqti", ['helper'])
+UPDATE_DB_CALLS = MetricHistogram("bot_update_db_calls", "Bitta yangilanishdagi DB chaqiruvlari soni",
+                                  buckets=(0, 1, 2, 3, 5, 8, 13, 21))
+UPDATE_DB_SECONDS = MetricHistogram("bot_update_db_seconds", "Bitta yangilanishdagi DB chaqiruvlari umumiy vaqti")
+TELEGRAM_API_SECONDS = MetricHistogram("bot_telegram_api_seconds", "Bot API so'rovi vaqti, metod bo'yicha", ['method'])
+TELEGRAM_API_ERRORS = MetricCounter("bot_telegram_api_errors_total", "Xato bilan tugagan Bot API so'rovlari", ['method'])
+SHEETS_EXPORT_LAG = MetricHistogram("bot_sheets_export_lag_seconds", "Buyurtma saqlangandan jadvalga yozilguncha o'tgan vaqt",
+                                    buckets=(1, 2.5, 5, 10, 30, 60, 300, 900, 3600))
+SHEETS_RECONCILE_MISSING = MetricCounter("bot_sheets_reconcile_missing_total",
+                                         "Reconcile jadvalda topmagan va outbox ga qayta qo'ygan buyurtmalar")
+SHEETS_RECONCILE_DUPLICATES = MetricCounter("bot_sheets_reconcile_duplicates_total",
+                                            "Reconcile jadvalda bir necha marta uchratgan buyurtma ID lari")
+SHEETS_OUTBOX_DEPTH = MetricGauge("bot_sheets_outbox_depth", "sheets_outbox da kutayotgan qatorlar")
+NOTIFICATIONS_PENDING = MetricGauge("bot_notifications_pending", "Yuborilishi kutilayotgan bildirishnomalar")
+
+class UpdateMetrics:
+    """Bitta yangilanish davomida yig'iladigan qiymatlar (update_metrics orqali)."""
+
+    __slots__ = ('started', 'handler', 'state', 'db_calls', 'db_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.handler = '-'
+        self.state = '-'
+        self.db_calls = 0
+        self.db_seconds = 0.0
+
+# Joriy yangilanish obyekti; run_db uni DB oqimiga uzatadi, shuning uchun DB vaqti shu yangilanishga yoziladi
+update_metrics = contextvars.ContextVar('update_metrics', default=None)
+
+class MetricsMiddleware(BaseMiddleware):
+    """Har bir yangilanish uchun handler, FSM holati va DB chaqiruvlari bo'yicha vaqtni yozadi."""
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        update_metrics.set(UpdateMetrics())
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        self._resolve(data)
+
+    async def on_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        self._resolve(data)
+
+    def _resolve(self, data):
+        metrics = update_metrics.get()
+        if metrics is not None:
+            metrics.handler = current_handler.get().__name__
+            metrics.state = data.get('raw_state') or '-'
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        metrics = update_metrics.get()
+        if metrics is None:
+            return
+        elapsed = time.perf_counter() - metrics.started
+        HANDLER_SECONDS.observe(elapsed, metrics.handler)
+        STATE_SECONDS.observe(elapsed, metrics.state)
+        UPDATE_DB_CALLS.observe(metrics.db_calls)
+        UPDATE_DB_SECONDS.observe(metrics.db_seconds)
+
+class MeteredBot(Bot):
+    """Bot API so'rovlari vaqtini metodlar bo'yicha yozib boradi."""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            TELEGRAM_API_ERRORS.inc(method)
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, method)
+
+class HandlerRegistry:
+    """
+    Handlerlarni import vaqtida yig'ib, Dispatcher qurilganda ro'yxatdan o'tkazadi.
+
+    Bot token talab qiladi, shuning uchun Bot va Dispatcher faqat ishga tushirish
+    buyruqlarida (build_dispatcher, 15 bo'limi) yaratiladi. Dekoratorlar aiogramniki bilan bir xil.
+    """
+
+    def __init__(self):
+        self._handlers = []
+
+    def _decorator(self, register, custom_filters, kwargs):
+        def decorator(callback):
+            self._handlers.append((register, callback, custom_filters, kwargs))
+            return callback
+        return decorator
 
-bot = Bot(token=API_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(bot, storage=storage)
-dp.middleware.setup(LoggingMiddleware())
+    def message_handler(self, *custom_filters, **kwargs):
+        return self._decorator('register_message_handler', custom_filters, kwargs)
+
+    def callback_query_handler(self, *custom_filters, **kwargs):
+        return self._decorator('register_callback_query_handler', custom_filters, kwargs)
+
+    def errors_handler(self, *custom_filters, **kwargs):
+        return self._decorator('register_errors_handler', custom_filters, kwargs)
+
+    def register(self, dispatcher):
+        for register, callback, custom_filters, kwargs in self._handlers:
+            getattr(dispatcher, register)(callback, *custom_filters, **kwargs)
+
+handlers = HandlerRegistry()
+bot = None  # build_dispatcher() yaratadi
+dp = None
 
 # ----------------------------
 # 2. DATABASE FUNCTIONS
@@ -53,6 +259,11 @@ dp.middleware.setup(LoggingMiddleware())
 
 DB_FILE = "bot_database.db"
 
+# bcrypt narxi (2^rounds iteratsiya). O'zgartirilsa, eski hashlar keyingi loginda qayta hashlanadi.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Katalogning boshlang'ich qiymatlari (5-migratsiya). Ishlayotgan bot ularni catalog_*
+# jadvallaridan o'qiydi va /catalog komandasi bilan tahrirlanadi.
 PRODUCT_PRICES = {
     "PREMIUM": 900000,
     "KAPSULA": 550000,
@@ -76,10 +287,17 @@ PRODUCT_PRICES = {
     "NM 2x0.5": 150000
 }
 
+CUSTOM_SIZE_BUTTON = "Nestandart razmer"
+
 SIZES = [
     "190x90", "200x90", "200x100", "200x120", "200x150",
     "200x160", "200x180", "200x200", "210x170", "210x180",
-    "Nestandart razmer"
+    CUSTOM_SIZE_BUTTON
+]
+
+REGIONS = [
+    "Toshkent shahri", "Toshkent viloyati", "Andijon", "Buxoro", "Jizzax", "Qashqadaryo",
+    "Navoiy", "Namangan", "Samarqand", "Surxondaryo", "Sirdaryo", "Farg'ona", "Xorazm", "Qoraqalpog'iston"
 ]
 
 # Mahsulotlar o'lchami oldindan belgilanganlar to'plami
@@ -92,167 +310,741 @@ PRODUCTS_WITH_FIXED_SIZE = {
     "Sovutadigan Yostiq",
 }
 
-def init_db():
-    """Ma'lumotlar bazasini va kerakli jadvallarni yaratadi yoki yangilaydi."""
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        # Foydalanuvchilar jadvali
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            login TEXT UNIQUE NOT NULL,
-            full_name TEXT NOT NULL,
-            phone_number TEXT NOT NULL,
-            password TEXT NOT NULL,
-            role TEXT DEFAULT 'sotuvchi',
-            telegram_id INTEGER UNIQUE,
-            telegram_username TEXT UNIQUE,
-            last_login TEXT
-        )
-        """)
-        # Buyurtmalar jadvali
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS orders (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            products TEXT NOT NULL,
-            total_price REAL NOT NULL,
-            payment REAL DEFAULT 0,
-            remaining_payment REAL DEFAULT 0,
-            customer_name TEXT NOT NULL,
-            customer_surname TEXT NOT NULL,
-            phone_number TEXT NOT NULL,
-            location TEXT NOT NULL,
-            detailed_address TEXT,
-            delivery_time TEXT NOT NULL,
-            additional_comments TEXT,
-            order_date TEXT NOT NULL,
-            FOREIGN KEY(user_id) REFERENCES users(user_id)
+# SQLite ulanishlari sozlamalari
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHED_STATEMENTS = 256  # Har bir ulanishda keshlanadigan tayyor so'rovlar soni
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # ~16 MB sahifa keshi
+    "PRAGMA mmap_size=134217728",  # 128 MB
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+)
+
+class ConnectionPool:
+    """
+    Uzoq yashovchi SQLite ulanishlari.
+
+    Yozish uchun bitta umumiy ulanish (lock bilan), o'qish uchun esa har bir
+    oqimga alohida ulanish ochiladi. WAL rejimida o'quvchilar yozuvchining
+    commitini kutmaydi.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+    def _connect(self, read_only=False):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+            cached_statements=DB_CACHED_STATEMENTS,
         )
-        """)
-        conn.commit()
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        if read_only:
+            conn.execute("PRAGMA query_only=1")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """Yozuvchi ulanishni beradi; blok muvaffaqiyatli tugasa commit, aks holda rollback qiladi."""
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect()
+            conn = self._writer
+            try:
+                yield conn
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        """Joriy oqimning o'quvchi ulanishini beradi."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        yield conn
+
+    def close(self):
+        """Barcha ochiq ulanishlarni yopadi."""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self._local = threading.local()
+
+db_pool = ConnectionPool(DB_FILE)
+
+def init_db(migrate=True):
+    """Ma'lumotlar bazasini va kerakli jadvallarni yaratadi, so'ng migratsiyalarni qo'llaydi."""
+    try:
+        with db_pool.writer() as conn:
+            cursor = conn.cursor()
+            # Foydalanuvchilar jadvali
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                login TEXT UNIQUE NOT NULL,
+                full_name TEXT NOT NULL,
+                phone_number TEXT NOT NULL,
+                password TEXT NOT NULL,
+                role TEXT DEFAULT 'sotuvchi',
+                telegram_id INTEGER UNIQUE,
+                telegram_username TEXT UNIQUE,
+                last_login TEXT
+            )
+            """)
+            # Buyurtmalar jadvali
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                products TEXT NOT NULL,
+                total_price REAL NOT NULL,
+                payment REAL DEFAULT 0,
+                remaining_payment REAL DEFAULT 0,
+                customer_name TEXT NOT NULL,
+                customer_surname TEXT NOT NULL,
+                phone_number TEXT NOT NULL,
+                location TEXT NOT NULL,
+                detailed_address TEXT,
+                delivery_time TEXT NOT NULL,
+                additional_comments TEXT,
+                order_date TEXT NOT NULL,
+                FOREIGN KEY(user_id) REFERENCES users(user_id)
+            )
+            """)
+            # Google Sheets ga yuborilishi kutilayotgan qatorlar
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sheets_outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                order_id INTEGER NOT NULL,
+                row_json TEXT NOT NULL,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL
+            )
+            """)
+        if migrate:
+            apply_migrations()
         logger.info("✅ Ma'lumotlar bazasi muvaffaqiyatli yaratildi yoki yangilandi.")
     except sqlite3.Error as e:
         logger.error(f"❌ Ma'lumotlar bazasini yaratishda xatolik: {e}")
-    finally:
-        conn.close()
 
-def hash_password(password):
+# ----------------------------
+# Sxema migratsiyalari
+# ----------------------------
+# Joriy sxema versiyasi PRAGMA user_version da saqlanadi. Har bir migratsiya
+# alohida tranzaksiyada bajariladi va MIGRATIONS ro'yxatiga oxiridan qo'shiladi.
+
+def _migration_add_indexes(conn):
+    # get_user_orders: WHERE user_id = ? ORDER BY id; get_orders_page: login bo'yicha har bir sotuvchining buyurtmalari
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id, id)")
+    # get_admins / get_admins_by_telegram_id
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role, telegram_id)")
+
+def _migration_add_order_ts(conn):
+    # order_date erkin TEXT; sana oralig'i bo'yicha so'rovlar uchun butun sonli UTC epoch ustuni
+    conn.execute("ALTER TABLE orders ADD COLUMN order_ts INTEGER")
+    conn.execute("UPDATE orders SET order_ts = CAST(strftime('%s', order_date) AS INTEGER)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_order_ts ON orders(order_ts)")
+
+PRODUCT_ITEM_RE = re.compile(r"^(?P<name>.+) \((?P<size>.*)\) - (?P<quantity>\d+) ta - (?P<unit_price>[\d,]+) so'm$")
+
+def parse_size_cm(size):
+    """'200x90' ko'rinishidagi o'lchamdan (eni, bo'yi) ni sm da oladi; aniqlab bo'lmasa (None, None)."""
+    numbers = re.findall(r'\d+', size or '')
+    if len(numbers) != 2:
+        return None, None
+    return int(numbers[0]), int(numbers[1])
+
+def parse_products_str(products_str):
+    """orders.products matnini (nomi, o'lchami, soni, narxi) ro'yxatiga ajratadi; tushunarsiz qismlar tashlab ketiladi."""
+    items = []
+    for part in products_str.split("; "):
+        match = PRODUCT_ITEM_RE.match(part.strip())
+        if match:
+            items.append((match['name'], match['size'], int(match['quantity']), float(match['unit_price'].replace(',', ''))))
+    return items
+
+def _migration_add_order_items(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product TEXT NOT NULL,
+        size TEXT,
+        width_cm INTEGER,
+        length_cm INTEGER,
+        quantity INTEGER NOT NULL,
+        unit_price REAL NOT NULL,
+        line_total REAL NOT NULL,
+        FOREIGN KEY(order_id) REFERENCES orders(id)
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items(product, size)")
+    # Mavjud buyurtmalarning products matnini bo'laklarga ajratib ko'chiramiz
+    skipped = 0
+    rows = conn.execute("SELECT id, products FROM orders ORDER BY id")
+    while True:
+        batch = rows.fetchmany(10000)
+        if not batch:
+            break
+        items = []
+        for order_id, products_str in batch:
+            parsed = parse_products_str(products_str)
+            skipped += not parsed
+            for name, size, quantity, unit_price in parsed:
+                items.append((order_id, name, size, *parse_size_cm(size), quantity, unit_price, unit_price * quantity))
+        conn.executemany("""
+            INSERT INTO order_items (order_id, product, size, width_cm, length_cm, quantity, unit_price, line_total)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, items)
+    if skipped:
+        logger.warning(f"⚠️ {skipped} ta buyurtmaning mahsulotlar matnini ajratib bo'lmadi.")
+
+def _migration_add_fsm_states(conn):
+    # SQLiteStorage: har bir (chat, user) uchun FSM holati; updated_at bo'yicha eskirganlari o'chiriladi
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        chat_id TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        state TEXT,
+        data TEXT NOT NULL DEFAULT '{}',
+        bucket TEXT NOT NULL DEFAULT '{}',
+        updated_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, user_id)
+    ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)")
+
+def _migration_add_catalog(conn):
+    # Mahsulotlar katalogi; boshlang'ich qiymatlar PRODUCT_PRICES, SIZES va REGIONS doimiylaridan olinadi
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS catalog_products (
+        name TEXT PRIMARY KEY,
+        price INTEGER NOT NULL,
+        fixed_size INTEGER NOT NULL DEFAULT 0,
+        position INTEGER NOT NULL
+    )
+    """)
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_sizes (name TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_regions (name TEXT PRIMARY KEY, position INTEGER NOT NULL)")
+    # Har bir tahrir versiyani oshiradi; jarayonlar snapshotni shu bo'yicha yangilaydi
+    conn.execute("CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.executemany(
+        "INSERT OR IGNORE INTO catalog_products (name, price, fixed_size, position) VALUES (?, ?, ?, ?)",
+        [(name, price, int(name in PRODUCTS_WITH_FIXED_SIZE), position)
+         for position, (name, price) in enumerate(PRODUCT_PRICES.items())]
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO catalog_sizes (name, position) VALUES (?, ?)",
+        [(name, position) for position, name in enumerate(size for size in SIZES if size != CUSTOM_SIZE_BUTTON)]
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO catalog_regions (name, position) VALUES (?, ?)",
+        [(name, position) for position, name in enumerate(REGIONS)]
+    )
+    conn.execute("INSERT OR IGNORE INTO catalog_meta (key, value) VALUES ('version', 1)")
+
+def _migration_add_sales_stats(conn):
+    # Kunlik savdo agregatlari (2.8 bo'limi); save_order ularni buyurtma bilan bir tranzaksiyada yangilaydi.
+    # dimension: 'day' (key ''), 'seller' (users.user_id), 'region' (orders.location), 'product' (order_items.product)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sales_stats (
+        dimension TEXT NOT NULL,
+        day TEXT NOT NULL,
+        key TEXT NOT NULL,
+        orders INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        revenue REAL NOT NULL DEFAULT 0,
+        prepayment REAL NOT NULL DEFAULT 0,
+        outstanding REAL NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, day, key)
+    ) WITHOUT ROWID
+    """)
+    # Mavjud buyurtmalardan to'ldirish (order_date UTC, 'YYYY-MM-DD HH:MM:SS')
+    for dimension, key in (('day', "''"), ('seller', "CAST(orders.user_id AS TEXT)"), ('region', "orders.location")):
+        conn.execute(f"""
+            INSERT INTO sales_stats (dimension, day, key, orders, quantity, revenue, prepayment, outstanding)
+            SELECT '{dimension}', substr(orders.order_date, 1, 10), {key}, COUNT(*), COALESCE(SUM(items.quantity), 0),
+                   SUM(orders.total_price), SUM(orders.payment), SUM(orders.remaining_payment)
+            FROM orders
+            LEFT JOIN (SELECT order_id, SUM(quantity) AS quantity FROM order_items GROUP BY order_id) items
+                ON items.order_id = orders.id
+            GROUP BY 2, 3
+        """)
+    conn.execute("""
+        INSERT INTO sales_stats (dimension, day, key, orders, quantity, revenue, prepayment, outstanding)
+        SELECT 'product', substr(orders.order_date, 1, 10), order_items.product, COUNT(DISTINCT orders.id),
+               SUM(order_items.quantity), SUM(order_items.line_total), 0, 0
+        FROM order_items
+        JOIN orders ON orders.id = order_items.order_id
+        GROUP BY 2, 3
+    """)
+
+ORDERS_FTS_COLUMNS = "customer_name, customer_surname, phone_number, location, detailed_address, additional_comments, products"
+# user_id ham indekslanadi: sotuvchi doirasi MATCH ichida, indeks ro'yxatlarini kesishtirib qo'llanadi
+ORDERS_FTS_INDEXED = ORDERS_FTS_COLUMNS + ", user_id"
+
+def _migration_add_orders_fts(conn):
+    # /find: orders ustidagi tashqi kontentli FTS5 indeksi; triggerlar uni orders bilan sinxron saqlaydi
+    conn.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+        {ORDERS_FTS_INDEXED},
+        content='orders', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """)
+    new_values = ", ".join(f"new.{column}" for column in ORDERS_FTS_INDEXED.split(", "))
+    old_values = ", ".join(f"old.{column}" for column in ORDERS_FTS_INDEXED.split(", "))
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_insert AFTER INSERT ON orders BEGIN
+        INSERT INTO orders_fts (rowid, {ORDERS_FTS_INDEXED}) VALUES (new.id, {new_values});
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_delete AFTER DELETE ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, {ORDERS_FTS_INDEXED}) VALUES ('delete', old.id, {old_values});
+    END
+    """)
+    # Faqat indekslangan ustunlar o'zgarganda (masalan order_ts emas)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS orders_fts_update AFTER UPDATE OF {ORDERS_FTS_INDEXED} ON orders BEGIN
+        INSERT INTO orders_fts (orders_fts, rowid, {ORDERS_FTS_INDEXED}) VALUES ('delete', old.id, {old_values});
+        INSERT INTO orders_fts (rowid, {ORDERS_FTS_INDEXED}) VALUES (new.id, {new_values});
+    END
+    """)
+    conn.execute("INSERT INTO orders_fts (orders_fts) VALUES ('rebuild')")
+
+def _migration_add_sheets_reconcile(conn):
+    # Jadval qatorlari oxiriga buyurtma ID si yoziladi. Eski qatorlarda ID yo'q, shuning uchun
+    # solishtirish hozirgi oxirgi buyurtmadan keyingilardan boshlanadi
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sheets_reconcile (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        order_cursor INTEGER NOT NULL,
+        row_cursor INTEGER NOT NULL,
+        checked_at TEXT
+    )
+    """)
+    conn.execute("INSERT OR IGNORE INTO sheets_reconcile (id, order_cursor, row_cursor) SELECT 1, COALESCE(MAX(id), 0), 0 FROM orders")
+    # Yuborilishini kutayotgan qatorlarga ham ID qo'shiladi
+    conn.execute(f"""
+        UPDATE sheets_outbox SET row_json = json_insert(row_json, '$[#]', order_id)
+        WHERE json_array_length(row_json) = {SHEET_ROW_LENGTH - 1}
+    """)
+
+def _migration_add_users_version(conn):
+    # Har bir jarayonning UserCache i shu hisoblagich orqali boshqa jarayonlardagi o'zgarishlarni sezadi.
+    # Parol va last_login o'zgarishi keshlangan yozuvga ta'sir qilmaydi, shuning uchun hisobga olinmaydi
+    conn.execute("CREATE TABLE IF NOT EXISTS users_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT OR IGNORE INTO users_meta (key, value) VALUES ('version', 1)")
+    bump = "UPDATE users_meta SET value = value + 1 WHERE key = 'version';"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS users_version_insert AFTER INSERT ON users BEGIN {bump} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS users_version_delete AFTER DELETE ON users BEGIN {bump} END")
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS users_version_update
+    AFTER UPDATE OF login, full_name, phone_number, role, telegram_id, telegram_username ON users BEGIN {bump} END
+    """)
+
+def _migration_add_login_attempts(conn):
+    # LoginGuard holati: shard workerlar orasida umumiy bo'lishi uchun xotirada emas, bazada
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS login_attempts (
+        key TEXT PRIMARY KEY,
+        failures INTEGER NOT NULL DEFAULT 0,
+        locked_until REAL NOT NULL DEFAULT 0,
+        tokens REAL,
+        tokens_at REAL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """)
+
+def _migration_add_reconcile_requests(conn):
+    # Sharded rejimda /reconcile worker jarayonda qabul qilinadi, eksport esa front jarayonda:
+    # so'rov va oxirgi natija shu qatorda almashiladi
+    conn.execute("ALTER TABLE sheets_reconcile ADD COLUMN requested_at REAL")
+    conn.execute("ALTER TABLE sheets_reconcile ADD COLUMN started_at REAL")
+    conn.execute("ALTER TABLE sheets_reconcile ADD COLUMN result_json TEXT")
+
+MIGRATIONS = [
+    (1, "orders.user_id va users.role indekslari", _migration_add_indexes),
+    (2, "orders.order_ts (epoch) ustuni va indeksi", _migration_add_order_ts),
+    (3, "order_items jadvali va products matnidan to'ldirish", _migration_add_order_items),
+    (4, "fsm_states jadvali (FSM holatlari)", _migration_add_fsm_states),
+    (5, "catalog_* jadvallari (mahsulotlar, o'lchamlar, viloyatlar)", _migration_add_catalog),
+    (6, "sales_stats agregatlari va mavjud buyurtmalardan to'ldirish", _migration_add_sales_stats),
+    (7, "orders_fts (FTS5) qidiruv indeksi va triggerlari", _migration_add_orders_fts),
+    (8, "sheets_reconcile kursori va outbox qatorlariga buyurtma ID si", _migration_add_sheets_reconcile),
+    (9, "users_meta versiyasi va users triggerlari (jarayonlararo kesh invalidatsiyasi)", _migration_add_users_version),
+    (10, "login_attempts jadvali (shardlar uchun umumiy login bloklashi)", _migration_add_login_attempts),
+    (11, "sheets_reconcile so'rovi va natijasi (sharded /reconcile)", _migration_add_reconcile_requests),
+]
+
+def get_schema_version():
+    """Bazaning joriy sxema versiyasi."""
+    with db_pool.reader() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def apply_migrations(target=None):
+    """Hali qo'llanmagan migratsiyalarni tartib bilan qo'llaydi. Qo'llanganlar sonini qaytaradi."""
+    applied = 0
+    with db_pool.writer() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, description, migrate in MIGRATIONS:
+            if number <= version or (target is not None and number > target):
+                continue
+            started = time.perf_counter()
+            conn.execute("BEGIN")
+            try:
+                migrate(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                logger.error(f"❌ {number}-migratsiya ({description}) bajarilmadi.")
+                raise
+            applied += 1
+            logger.info(f"✅ {number}-migratsiya qo'llandi: {description} ({time.perf_counter() - started:.2f} s)")
+    return applied
+
+def hash_password(password, rounds=None):
     """Parolni bcrypt yordamida hashing qiladi."""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    import bcrypt
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds or BCRYPT_ROUNDS)).decode('utf-8')
 
 def verify_password(password, hashed):
     """Parolni hashing qilingan parol bilan solishtiradi."""
+    import bcrypt
     try:
         return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
     except ValueError:
         logger.error("❌ Noto'g'ri tuzilgan hash formatida parol tekshirildi.")
         return False
 
+# Keshlanadigan foydalanuvchi yozuvi (parol hashisiz)
+UserRecord = namedtuple('UserRecord', 'user_id login full_name phone_number role telegram_id telegram_username')
+USER_RECORD_COLUMNS = "user_id, login, full_name, phone_number, role, telegram_id, telegram_username"
+
+USER_CACHE_SIZE = 2048
+USER_CACHE_TTL = 300.0  # soniya
+USERS_VERSION_POLL_INTERVAL = 1.0  # boshqa jarayonlardagi (shard worker, CLI) o'zgarishlarni tekshirish oralig'i
+
+class UserCache:
+    """
+    telegram_id va login bo'yicha foydalanuvchi yozuvlarining TTL/LRU keshi.
+
+    Yo'q foydalanuvchilar ham (None) keshlanadi. Foydalanuvchini o'zgartiruvchi
+    funksiyalar commitdan keyin invalidate() ni chaqiradi; generation hisoblagichi
+    invalidatsiyadan oldin o'qilgan eskirgan yozuv keshga qaytib tushishining oldini oladi.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (expires_at, record)
+        self._keys_by_user = {}  # user_id -> {key, ...}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """(topildi, yozuv) juftligini qaytaradi."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, record, generation):
+        """Yozuvni keshga qo'yadi; o'qish boshlangandan beri invalidatsiya bo'lgan bo'lsa, qo'ymaydi."""
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, record)
+            if record is not None:
+                self._keys_by_user.setdefault(record.user_id, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, *keys, user_id=None):
+        """Berilgan kalitlarni va user_id ga tegishli barcha kalitlarni o'chiradi."""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] is not None:
+                    for user_key in list(self._keys_by_user.get(entry[1].user_id, ())):
+                        self._drop(user_key)
+                self._drop(key)
+            if user_id is not None:
+                for user_key in list(self._keys_by_user.get(user_id, ())):
+                    self._drop(user_key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None and entry[1] is not None:
+            user_keys = self._keys_by_user.get(entry[1].user_id)
+            if user_keys is not None:
+                user_keys.discard(key)
+                if not user_keys:
+                    del self._keys_by_user[entry[1].user_id]
+
+user_cache = UserCache()
+
+def get_users_version():
+    """users jadvali o'zgarishlari hisoblagichi (users_meta triggerlari oshiradi)."""
+    with db_pool.reader() as conn:
+        row = conn.execute("SELECT value FROM users_meta WHERE key = 'version'").fetchone()
+    return row[0] if row else 0
+
+class UserCacheSync:
+    """
+    Boshqa jarayonlardagi foydalanuvchi o'zgarishlarini kuzatadi.
+
+    Har bir shard worker o'z UserCache iga ega: bir workerda chiqarilgan (kick) foydalanuvchi
+    boshqasida TTL tugaguncha o'tib qolmasligi uchun users_meta.version o'zgarsa kesh tozalanadi.
+    """
+
+    def __init__(self, cache, poll_interval=USERS_VERSION_POLL_INTERVAL):
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self.version = None
+        self._task = None
+
+    async def refresh(self):
+        version = await run_db(get_users_version)
+        if self.version is not None and version != self.version:
+            self.cache.clear()
+        self.version = version
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"❌ Foydalanuvchilar versiyasini tekshirishda xatolik: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+user_cache_sync = UserCacheSync(user_cache)
+
+def _load_user_record(column, value):
+    """users jadvalidan bitta ustun bo'yicha UserRecord ni o'qib, keshga qo'yadi."""
+    generation = user_cache.generation
+    with db_pool.reader() as conn:
+        row = conn.execute(f"SELECT {USER_RECORD_COLUMNS} FROM users WHERE {column} = ?", (value,)).fetchone()
+    record = UserRecord(*row) if row else None
+    user_cache.put((column, value), record, generation)
+    return record
+
+def _find_user_record(column, value):
+    """UserRecord ni keshdan, topilmasa bazadan oladi."""
+    found, record = user_cache.get((column, value))
+    return record if found else _load_user_record(column, value)
+
 def insert_user(login, full_name, phone_number, password, role='sotuvchi', telegram_id=None, telegram_username=None):
     """Yangi foydalanuvchini ro'yxatdan o'tkazadi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO users (login, full_name, phone_number, password, role, telegram_id, telegram_username, last_login)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (login, full_name, phone_number, password, role, telegram_id, telegram_username, datetime.utcnow().isoformat()))
-        conn.commit()
+        with db_pool.writer() as conn:
+            conn.execute("""
+                INSERT INTO users (login, full_name, phone_number, password, role, telegram_id, telegram_username, last_login)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (login, full_name, phone_number, password, role, telegram_id, telegram_username, datetime.utcnow().isoformat()))
+        user_cache.invalidate(('login', login), ('telegram_id', telegram_id))
         return True
     except sqlite3.IntegrityError as e:
         logger.error(f"❌ Foydalanuvchini qo'shishda xatolik: {e}")
         return False
-    finally:
-        conn.close()
+
+def insert_users(users):
+    """
+    (login, full_name, phone_number, password_hash, role) yozuvlarini bitta tranzaksiyada qo'shadi.
+    Har bir yozuv uchun qo'shilganini (login band bo'lsa False) qaytaradi.
+    """
+    now = datetime.utcnow().isoformat()
+    inserted = []
+    with db_pool.writer() as conn:
+        for login, full_name, phone_number, password, role in users:
+            cursor = conn.execute("""
+                INSERT INTO users (login, full_name, phone_number, password, role, last_login)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(login) DO NOTHING
+            """, (login, full_name, phone_number, password, role, now))
+            inserted.append(cursor.rowcount == 1)
+    user_cache.invalidate(*(('login', user[0]) for user in users))
+    return inserted
+
+def get_existing_logins(logins, chunk_size=500):
+    """Berilgan loginlardan bazada mavjudlarini qaytaradi."""
+    existing = set()
+    with db_pool.reader() as conn:
+        for start in range(0, len(logins), chunk_size):
+            chunk = logins[start:start + chunk_size]
+            existing.update(row[0] for row in conn.execute(
+                f"SELECT login FROM users WHERE login IN ({', '.join('?' * len(chunk))})", chunk))
+    return existing
 
 def get_user_by_login(login):
-    """Login bo'yicha foydalanuvchini oladi."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE login = ?", (login,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    """Login bo'yicha foydalanuvchini (parol hashi bilan, keshsiz) oladi. Faqat autentifikatsiya uchun."""
+    with db_pool.reader() as conn:
+        return conn.execute("SELECT * FROM users WHERE login = ?", (login,)).fetchone()
 
-def get_user_by_telegram_id(telegram_id):
-    """Telegram ID bo'yicha foydalanuvchini oladi."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE telegram_id = ?", (telegram_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+def get_user_record_by_login(login):
+    """Login bo'yicha foydalanuvchini UserRecord sifatida (keshdan) oladi."""
+    return _find_user_record('login', login)
 
-def authenticate_user_admin(login, password):
-    """Admin foydalanuvchini autentifikatsiya qiladi."""
-    user = get_user_by_login(login)
-    if user and verify_password(password, user[4]):  # user[4] - password maydoni
-        if user[5].lower() == 'admin':  # user[5] - role
-            return user
-    return None
+def get_user_by_telegram_id(telegram_id):
+    """Telegram ID bo'yicha foydalanuvchini UserRecord sifatida (keshdan) oladi."""
+    return _find_user_record('telegram_id', telegram_id)
 
-def authenticate_user_regular(username, password):
-    """Oddiy foydalanuvchini autentifikatsiya qiladi."""
-    user = get_user_by_login(username)
-    if user and verify_password(password, user[4]):
-        return user
-    return None
+def update_user_password(user_id, hashed_password):
+    """Foydalanuvchining parol hashini yangilaydi."""
+    try:
+        with db_pool.writer() as conn:
+            conn.execute("UPDATE users SET password = ? WHERE user_id = ?", (hashed_password, user_id))
+    except sqlite3.Error as e:
+        logger.error(f"❌ Parolni yangilashda xatolik: {e}")
 
 def update_user_telegram_id(user_id, telegram_id, telegram_username):
     """Foydalanuvchining Telegram ID va username sini yangilaydi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET telegram_id = ?, telegram_username = ?, last_login = ? WHERE user_id = ?",
-                       (telegram_id, telegram_username, datetime.utcnow().isoformat(), user_id))
-        conn.commit()
+        with db_pool.writer() as conn:
+            conn.execute("UPDATE users SET telegram_id = ?, telegram_username = ?, last_login = ? WHERE user_id = ?",
+                         (telegram_id, telegram_username, datetime.utcnow().isoformat(), user_id))
+        user_cache.invalidate(('telegram_id', telegram_id), user_id=user_id)
     except sqlite3.Error as e:
         logger.error(f"❌ Telegram ID va username ni yangilashda xatolik: {e}")
-    finally:
-        conn.close()
+
+# Google Sheets qatori: sotuvchi (login, FIO, telefon), buyurtma maydonlari, sana va oxirida buyurtma ID si
+SHEET_ROW_SELECT = """
+    SELECT COALESCE(u.login, ''), COALESCE(u.full_name, ''), COALESCE(u.phone_number, ''),
+           o.products, o.total_price, o.payment, o.remaining_payment,
+           o.customer_name, o.customer_surname, o.phone_number,
+           o.location, o.detailed_address, o.delivery_time, o.additional_comments,
+           o.order_date, o.id
+    FROM orders o
+    LEFT JOIN users u ON u.user_id = o.user_id
+"""
+SHEET_ORDER_DATE_INDEX = 14
+SHEET_ROW_LENGTH = 16
+
+def sheet_rows(conn, order_ids, chunk_size=500):
+    """Buyurtmalarning Google Sheets qatorlarini ID tartibida qaytaradi."""
+    rows = []
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        rows.extend(list(row) for row in conn.execute(
+            f"{SHEET_ROW_SELECT} WHERE o.id IN ({', '.join('?' * len(chunk))}) ORDER BY o.id", chunk))
+    return rows
 
 def save_order(user_id, products, total_price, payment, customer_name, customer_surname, phone_number, location, detailed_address, delivery_time, additional_comments):
-    """Buyurtmani ma'lumotlar bazasiga saqlaydi."""
+    """
+    Buyurtmani ma'lumotlar bazasiga saqlaydi.
+
+    Mahsulotlar order_items jadvaliga, Google Sheets uchun qator esa sheets_outbox
+    jadvaliga xuddi shu tranzaksiyada yoziladi (qatorni SheetsExporter fonda yuboradi).
+    sales_stats agregatlari ham shu tranzaksiyada yangilanadi.
+    Muvaffaqiyatli bo'lsa buyurtma ID sini, aks holda False qaytaradi.
+    """
     remaining_payment = total_price - payment
-    order_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    now = datetime.utcnow().replace(microsecond=0)
+    order_date = now.strftime('%Y-%m-%d %H:%M:%S')
+    order_ts = int(now.replace(tzinfo=timezone.utc).timestamp())
     products_str = "; ".join([f"{p['name']} ({p['size']}) - {p['quantity']} ta - {p['unit_price']:,.0f} so'm" for p in products])
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO orders (
-                user_id, products, total_price, payment, remaining_payment,
-                customer_name, customer_surname, phone_number,
-                location, detailed_address, delivery_time, additional_comments, order_date
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user_id,
-            products_str,
-            total_price,
-            payment,
-            remaining_payment,
-            customer_name,
-            customer_surname,
-            phone_number,
-            location,
-            detailed_address,
-            delivery_time,
-            additional_comments,
-            order_date
-        ))
-        conn.commit()
+        with db_pool.writer() as conn:
+            cursor = conn.execute("""
+                INSERT INTO orders (
+                    user_id, products, total_price, payment, remaining_payment,
+                    customer_name, customer_surname, phone_number,
+                    location, detailed_address, delivery_time, additional_comments, order_date, order_ts
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                user_id,
+                products_str,
+                total_price,
+                payment,
+                remaining_payment,
+                customer_name,
+                customer_surname,
+                phone_number,
+                location,
+                detailed_address,
+                delivery_time,
+                additional_comments,
+                order_date,
+                order_ts
+            ))
+            order_id = cursor.lastrowid
+            conn.executemany("""
+                INSERT INTO order_items (order_id, product, size, width_cm, length_cm, quantity, unit_price, line_total)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (order_id, p['name'], p['size'], *parse_size_cm(p['size']), p['quantity'], p['unit_price'],
+                 p.get('total_price', p['unit_price'] * p['quantity']))
+                for p in products
+            ])
+            record_sales_stats(conn, order_date[:10], user_id, location, products, total_price, payment, remaining_payment)
+            row, = sheet_rows(conn, [order_id])
+            conn.execute(
+                "INSERT INTO sheets_outbox (order_id, row_json, created_at) VALUES (?, ?, ?)",
+                (order_id, json.dumps(row, ensure_ascii=False), order_date)
+            )
         logger.info("✅ Buyurtma muvaffaqiyatli saqlandi!")
-        return True
+        return order_id
     except sqlite3.Error as e:
         logger.error(f"❌ Buyurtmani saqlashda xatolik: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_google_sheets_client():
     """Google Sheets mijozini yaratadi."""
+    # gspread va google-auth importi ~0.2 s: faqat eksport kerak bo'lganda yuklanadi
+    import gspread
+    from google.oauth2.service_account import Credentials
     scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
     creds = Credentials.from_service_account_file(GOOGLE_SHEETS_CREDENTIALS_JSON, scopes=scope)
     client = gspread.authorize(creds)
@@ -261,87 +1053,164 @@ def get_google_sheets_client():
 def get_user_orders(user_id):
     """Foydalanuvchining barcha buyurtmalarini oladi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, products, total_price, payment, remaining_payment,
-                   customer_name, customer_surname, phone_number,
-                   location, detailed_address, delivery_time, order_date
-            FROM orders
-            WHERE user_id = ?
-            ORDER BY id ASC
-        """, (user_id,))
-        orders = cursor.fetchall()
-        return orders
+        with db_pool.reader() as conn:
+            return conn.execute("""
+                SELECT id, products, total_price, payment, remaining_payment,
+                       customer_name, customer_surname, phone_number,
+                       location, detailed_address, delivery_time, order_date
+                FROM orders
+                WHERE user_id = ?
+                ORDER BY id ASC
+            """, (user_id,)).fetchall()
     except sqlite3.Error as e:
         logger.error(f"❌ Buyurtmalarni olishda xatolik: {e}")
         return []
-    finally:
-        conn.close()
 
-def get_all_orders():
-    """Barcha buyurtmalarni oladi (admin uchun)."""
+ORDERS_PAGE_SIZE = 5
+
+def order_filter_conditions(filters):
+    """
+    Buyurtma filtrlaridan SQL shartlari va parametrlarini yasaydi.
+
+    filters: {'seller': login, 'date_from': 'YYYY-MM-DD', 'date_to': 'YYYY-MM-DD', 'location': viloyat}.
+    """
+    filters = filters or {}
+    conditions, params = [], []
+    if filters.get('seller'):
+        conditions.append("users.login = ?")
+        params.append(filters['seller'])
+    if filters.get('date_from'):
+        conditions.append("orders.order_ts >= CAST(strftime('%s', ?) AS INTEGER)")
+        params.append(filters['date_from'])
+    if filters.get('date_to'):
+        conditions.append("orders.order_ts < CAST(strftime('%s', ?, '+1 day') AS INTEGER)")
+        params.append(filters['date_to'])
+    if filters.get('location'):
+        conditions.append("orders.location = ?")
+        params.append(filters['location'])
+    return conditions, params
+
+def get_orders_page(filters=None, after_id=None, before_id=None, limit=ORDERS_PAGE_SIZE):
+    """
+    Barcha buyurtmalardan (users.login, orders.id) tartibida bitta sahifani oladi (admin uchun).
+
+    Keyset pagination: after_id/before_id - oldingi sahifa chegarasidagi buyurtma ID si.
+    filters - order_filter_conditions() ga qarang.
+    (qatorlar, yana_bormi) juftligini qaytaradi; yana_bormi - shu yo'nalishda keyingi sahifa bor-yo'qligi.
+    """
+    conditions, params = order_filter_conditions(filters)
+    order = "ASC"
+    cursor_id = after_id if after_id is not None else before_id
+    if cursor_id is not None:
+        comparison = ">" if after_id is not None else "<"
+        order = "ASC" if after_id is not None else "DESC"
+        conditions.append(f"""(users.login, orders.id) {comparison} (
+            (SELECT u.login FROM orders o JOIN users u ON o.user_id = u.user_id WHERE o.id = ?), ?)""")
+        params.extend([cursor_id, cursor_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT users.login, users.full_name, users.phone_number, users.telegram_username, users.role,
-                   orders.id, orders.products, orders.total_price, orders.payment, orders.remaining_payment,
-                   orders.customer_name, orders.customer_surname, orders.phone_number,
-                   orders.location, orders.detailed_address, orders.delivery_time, orders.order_date
-            FROM orders
-            JOIN users ON orders.user_id = users.user_id
-            ORDER BY users.login ASC, orders.id ASC
-        """)
-        orders = cursor.fetchall()
-        return orders
+        with db_pool.reader() as conn:
+            rows = conn.execute(f"""
+                SELECT users.login, users.full_name, users.phone_number, users.telegram_username, users.role,
+                       orders.id, orders.products, orders.total_price, orders.payment, orders.remaining_payment,
+                       orders.customer_name, orders.customer_surname, orders.phone_number,
+                       orders.location, orders.detailed_address, orders.delivery_time, orders.order_date
+                FROM orders
+                JOIN users ON orders.user_id = users.user_id
+                {where}
+                ORDER BY users.login {order}, orders.id {order}
+                LIMIT ?
+            """, (*params, limit + 1)).fetchall()
     except sqlite3.Error as e:
-        logger.error(f"❌ Barcha buyurtmalarni olishda xatolik: {e}")
-        return []
-    finally:
-        conn.close()
+        logger.error(f"❌ Buyurtmalar sahifasini olishda xatolik: {e}")
+        return [], False
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "DESC":
+        rows.reverse()
+    return rows, has_more
+
+FTS_MAX_TERMS = 8
+FTS_TERM_RE = re.compile(r"\w+")
+SEARCH_CANDIDATES = 1000  # bm25 bo'yicha tartiblanadigan eng yangi mosliklar soni
+
+def fts_query(text):
+    """Foydalanuvchi matnini FTS5 so'roviga aylantiradi: har bir so'z prefiks sifatida, barchasi AND bilan."""
+    terms = FTS_TERM_RE.findall(text)[:FTS_MAX_TERMS]
+    if not terms:
+        return ""
+    # Faqat matn ustunlarida qidiriladi ({...} : ...), user_id ustuni doira uchun ajratilgan
+    columns = ORDERS_FTS_COLUMNS.replace(',', '')
+    phrases = " ".join(f'"{term}"*' for term in terms)
+    return f"{{{columns}}} : ({phrases})"
+
+def search_orders(query, user_id=None, offset=0, limit=ORDERS_PAGE_SIZE):
+    """
+    orders_fts bo'yicha moslik darajasi (bm25) tartibida bitta sahifa buyurtmalarni oladi.
+
+    query - fts_query() natijasi; user_id berilsa, faqat shu sotuvchining buyurtmalari.
+    Keng so'zlar millionlab qatorga mos kelishi mumkin, shuning uchun faqat eng yangi
+    SEARCH_CANDIDATES ta moslik (rowid bo'yicha, indeksdan to'g'ridan-to'g'ri) tartiblanadi.
+    (qatorlar, yana_bormi, cheklandimi) qaytaradi: oxirgisi mosliklar SEARCH_CANDIDATES dan ko'p
+    bo'lganda True (eskiroqlari ko'rinmaydi, foydalanuvchiga so'rovni aniqlashtirish aytiladi).
+    Qator: login, full_name, role va ORDER_ROW_FIELDS.
+    """
+    if user_id is not None:
+        query = f'{query} AND user_id : "{int(user_id)}"'
+    try:
+        with db_pool.reader() as conn:
+            # CROSS JOIN: so'rovni FTS natijalaridan boshlashga majburlaydi
+            rows = conn.execute("""
+                SELECT users.login, users.full_name, users.role,
+                       orders.id, orders.products, orders.total_price, orders.payment, orders.remaining_payment,
+                       orders.customer_name, orders.customer_surname, orders.phone_number,
+                       orders.location, orders.detailed_address, orders.delivery_time, orders.order_date
+                FROM (
+                    SELECT rowid, rank FROM orders_fts WHERE orders_fts MATCH ? ORDER BY rowid DESC LIMIT ?
+                ) AS hits
+                CROSS JOIN orders ON orders.id = hits.rowid
+                CROSS JOIN users ON users.user_id = orders.user_id
+                ORDER BY hits.rank, orders.id DESC
+                LIMIT ? OFFSET ?
+            """, (query, SEARCH_CANDIDATES, limit + 1, offset)).fetchall()
+            capped = conn.execute(
+                "SELECT 1 FROM orders_fts WHERE orders_fts MATCH ? ORDER BY rowid DESC LIMIT 1 OFFSET ?",
+                (query, SEARCH_CANDIDATES)
+            ).fetchone() is not None
+    except sqlite3.Error as e:
+        logger.error(f"❌ Buyurtmalarni qidirishda xatolik: {e}")
+        return [], False, False
+    return rows[:limit], len(rows) > limit, capped
 
 def kick_user_by_telegram_id(telegram_id):
     """Foydalanuvchini Telegram ID orqali tizimdan chiqaradi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET telegram_id = NULL, telegram_username = NULL, last_login = NULL WHERE telegram_id = ?", (telegram_id,))
-        conn.commit()
+        with db_pool.writer() as conn:
+            kicked = conn.execute("SELECT user_id FROM users WHERE telegram_id = ?", (telegram_id,)).fetchone()
+            conn.execute("UPDATE users SET telegram_id = NULL, telegram_username = NULL, last_login = NULL WHERE telegram_id = ?", (telegram_id,))
+        user_cache.invalidate(('telegram_id', telegram_id), user_id=kicked[0] if kicked else None)
         return True
     except sqlite3.Error as e:
         logger.error(f"❌ Foydalanuvchini chiqarishda xatolik: {e}")
         return False
-    finally:
-        conn.close()
 
 def get_admins():
     """Barcha admin foydalanuvchilarni oladi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE role = 'admin'")
-        admins = cursor.fetchall()
-        return admins
+        with db_pool.reader() as conn:
+            return conn.execute("SELECT * FROM users WHERE role = 'admin'").fetchall()
     except sqlite3.Error as e:
         logger.error(f"❌ Adminlarni olishda xatolik: {e}")
         return []
-    finally:
-        conn.close()
 
 def get_admins_by_telegram_id(telegram_id):
     """Berilgan Telegram ID ga ega bo'lgan adminlarni oladi."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE role = 'admin' AND telegram_id = ?", (telegram_id,))
-        admins = cursor.fetchall()
-        return admins
+        with db_pool.reader() as conn:
+            return conn.execute("SELECT * FROM users WHERE role = 'admin' AND telegram_id = ?", (telegram_id,)).fetchall()
     except sqlite3.Error as e:
         logger.error(f"❌ Adminlarni olishda xatolik: {e}")
         return []
-    finally:
-        conn.close()
 
 def create_admin():
     """Komanda satri orqali admin foydalanuvchi yaratadi (faqat Login va Parol so'raydi)."""
@@ -374,6 +1243,1156 @@ def create_admin():
     else:
         print("❌ Admin foydalanuvchini qo'shishda xatolik yuz berdi. Ehtimol, login allaqachon mavjud.")
 
+# ----------------------------
+# 2.1 ASYNC DATABASE API
+# ----------------------------
+
+# Sinxron sqlite3 chaqiruvlari event loop ni to'xtatmasligi uchun alohida oqimlarda bajariladi.
+# Executor ichidagi navbat so'rovlar navbati vazifasini bajaradi; yozuvlar ConnectionPool
+# lock'i orqali ketma-ket, o'qishlar esa har bir oqimning o'z ulanishida parallel bajariladi.
+DB_WORKER_THREADS = 4
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKER_THREADS, thread_name_prefix="db-worker")
+
+def _timed_db_call(metrics, func, args, kwargs):
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - started
+        DB_CALL_SECONDS.observe(elapsed, func.__name__)
+        if metrics is not None:
+            metrics.db_calls += 1
+            metrics.db_seconds += elapsed
+
+async def run_db(func, *args, **kwargs):
+    """Sinxron DB funksiyasini DB oqimida bajaradi va natijasini qaytaradi (vaqti metrikalarga yoziladi)."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(db_executor, _timed_db_call, update_metrics.get(), func, args, kwargs)
+
+async def insert_user_async(*args, **kwargs):
+    return await run_db(insert_user, *args, **kwargs)
+
+async def get_user_by_login_async(login):
+    return await run_db(get_user_by_login, login)
+
+async def get_user_record_by_login_async(login):
+    found, record = user_cache.get(('login', login))
+    return record if found else await run_db(_load_user_record, 'login', login)
+
+async def get_user_by_telegram_id_async(telegram_id):
+    # Kesh topsa, DB oqimiga umuman murojaat qilinmaydi
+    found, record = user_cache.get(('telegram_id', telegram_id))
+    return record if found else await run_db(_load_user_record, 'telegram_id', telegram_id)
+
+async def update_user_password_async(user_id, hashed_password):
+    return await run_db(update_user_password, user_id, hashed_password)
+
+async def update_user_telegram_id_async(user_id, telegram_id, telegram_username):
+    return await run_db(update_user_telegram_id, user_id, telegram_id, telegram_username)
+
+async def save_order_async(*args, **kwargs):
+    return await run_db(save_order, *args, **kwargs)
+
+async def get_user_orders_async(user_id):
+    return await run_db(get_user_orders, user_id)
+
+async def get_orders_page_async(*args, **kwargs):
+    return await run_db(get_orders_page, *args, **kwargs)
+
+async def search_orders_async(*args, **kwargs):
+    return await run_db(search_orders, *args, **kwargs)
+
+async def kick_user_by_telegram_id_async(telegram_id):
+    return await run_db(kick_user_by_telegram_id, telegram_id)
+
+async def get_admins_async():
+    return await run_db(get_admins)
+
+async def get_admins_by_telegram_id_async(telegram_id):
+    return await run_db(get_admins_by_telegram_id, telegram_id)
+
+# ----------------------------
+# 2.2 PASSWORD HASHING
+# ----------------------------
+
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_MAX_PENDING = HASH_WORKERS * 4  # Bir vaqtda pulga yuborilgan vazifalar chegarasi
+
+def bcrypt_rounds_of(hashed):
+    """Hash ichidagi bcrypt narxini qaytaradi ('$2b$12$...' -> 12)."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+class PasswordHasher:
+    """
+    bcrypt hisob-kitoblarini jarayonlar puliga chiqaradi.
+
+    Har bir chaqiruv ~100-300 ms CPU oladi, shuning uchun u event loop oqimida
+    bajarilmaydi. Pulga bir vaqtda HASH_MAX_PENDING tadan ortiq vazifa
+    yuborilmaydi; qolganlari navbatda kutadi.
+    """
+
+    def __init__(self, workers=HASH_WORKERS, max_pending=HASH_MAX_PENDING, rounds=BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self._executor = None
+        self._slots = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            # fork emas: pul birinchi loginda, DB/Sheets oqimlari ishlab turganida yaratiladi va
+            # fork qilingan bola ushlab turilgan lock (logging, import) ni meros olib qotib qolishi mumkin
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    async def _submit(self, func, *args):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_pending)
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+
+    async def hash(self, password):
+        """Parolni joriy narx bilan hashlaydi."""
+        return await self._submit(hash_password, password, self.rounds)
+
+    async def hash_many(self, passwords):
+        """Parollarni pul ishchilarida parallel hashlaydi; natijalar tartibi saqlanadi."""
+        return await asyncio.gather(*(self.hash(password) for password in passwords))
+
+    async def verify(self, password, hashed):
+        """Parolni hash bilan solishtiradi."""
+        return await self._submit(verify_password, password, hashed)
+
+    def needs_rehash(self, hashed):
+        """Hash joriy narxdan boshqa narx bilan yaratilgan bo'lsa True qaytaradi."""
+        return bcrypt_rounds_of(hashed) != self.rounds
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+password_hasher = PasswordHasher()
+
+async def authenticate_user(login, password):
+    """Login va parolni tekshiradi; narx o'zgargan bo'lsa parolni qayta hashlaydi."""
+    user = await get_user_by_login_async(login)
+    if not user or not await password_hasher.verify(password, user[4]):  # user[4] - password maydoni
+        return None
+    if password_hasher.needs_rehash(user[4]):
+        new_hash = await password_hasher.hash(password)
+        await update_user_password_async(user[0], new_hash)
+        logger.info(f"🔁 @{user[1]} paroli yangi bcrypt narxi ({password_hasher.rounds}) bilan qayta hashlandi.")
+    return user
+
+async def authenticate_user_admin_async(login, password):
+    """Admin foydalanuvchini autentifikatsiya qiladi."""
+    user = await authenticate_user(login, password)
+    if user and user[5].lower() == 'admin':  # user[5] - role
+        return user
+    return None
+
+async def authenticate_user_regular_async(username, password):
+    """Oddiy foydalanuvchini autentifikatsiya qiladi."""
+    return await authenticate_user(username, password)
+
+# ----------------------------
+# 2.3 GOOGLE SHEETS EXPORT
+# ----------------------------
+
+SHEETS_BATCH_SIZE = 50  # Bitta append_rows so'rovidagi maksimal qatorlar soni
+SHEETS_FLUSH_INTERVAL = 5.0  # Navbat shuncha soniyada kamida bir marta yuboriladi
+SHEETS_MAX_BACKOFF = 300.0  # Qayta urinishlar orasidagi eng uzun pauza (soniya)
+SHEETS_ID_COLUMN = 'P'  # 16-ustun: buyurtma ID si (SHEET_ROW_SELECT oxirgi maydoni)
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "3600"))  # 0 - faqat /reconcile orqali
+RECONCILE_WAIT_TIMEOUT = 60.0  # Sharded rejimda /reconcile front jarayon natijasini shuncha kutadi
+RECONCILE_POLL_INTERVAL = 1.0
+RECONCILE_OVERLAP = 100  # Kursordan oldingi qatorlar ham o'qiladi: bir nechta qator qo'lda o'chirilsa ham yangilari o'tkazib yuborilmaydi
+ReconcileResult = namedtuple('ReconcileResult', 'checked rows_read missing duplicates')
+
+def fetch_outbox_batch(limit):
+    """Yuborish vaqti kelgan outbox qatorlarini (id, row) ko'rinishida oladi."""
+    with db_pool.reader() as conn:
+        rows = conn.execute("""
+            SELECT id, row_json FROM sheets_outbox
+            WHERE next_attempt_at <= ?
+            ORDER BY id ASC
+            LIMIT ?
+        """, (time.time(), limit)).fetchall()
+    return [(outbox_id, json.loads(row_json)) for outbox_id, row_json in rows]
+
+def delete_outbox_rows(outbox_ids):
+    """Jadvalga yozilgan qatorlarni outbox dan o'chiradi."""
+    with db_pool.writer() as conn:
+        conn.executemany("DELETE FROM sheets_outbox WHERE id = ?", [(outbox_id,) for outbox_id in outbox_ids])
+
+def mark_outbox_failed(outbox_ids, error):
+    """Yuborilmagan qatorlarning urinishlar sonini oshiradi va keyingi urinish vaqtini belgilaydi."""
+    now = time.time()
+    with db_pool.writer() as conn:
+        for outbox_id in outbox_ids:
+            attempts = conn.execute("SELECT attempts FROM sheets_outbox WHERE id = ?", (outbox_id,)).fetchone()
+            attempts = (attempts[0] if attempts else 0) + 1
+            delay = min(SHEETS_MAX_BACKOFF, 2 ** attempts)
+            conn.execute(
+                "UPDATE sheets_outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, now + delay, str(error)[:500], outbox_id)
+            )
+
+def get_reconcile_cursor():
+    """(order_cursor, row_cursor): shu ID gacha buyurtmalar va shu qatorgacha jadval tekshirilgan."""
+    with db_pool.reader() as conn:
+        return conn.execute("SELECT order_cursor, row_cursor FROM sheets_reconcile WHERE id = 1").fetchone()
+
+def fetch_reconcile_candidates(order_cursor):
+    """
+    Kursordan keyingi, jadvalga yozilgan bo'lishi kerak bo'lgan buyurtma ID lari.
+
+    Kursor outbox da kutayotgan eng kichik buyurtmadan oldin to'xtaydi: undan keyingilar
+    yuborilgach keyingi tekshiruvda ko'riladi, aks holda ular hech qachon tekshirilmasdi.
+    (yangi kursor, [ID, ...]) qaytaradi.
+    """
+    with db_pool.reader() as conn:
+        max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM orders").fetchone()[0]
+        pending = conn.execute(
+            "SELECT MIN(order_id) FROM sheets_outbox WHERE order_id > ?", (order_cursor,)
+        ).fetchone()[0]
+        if pending is not None:
+            max_id = min(max_id, pending - 1)
+        order_ids = [row[0] for row in conn.execute(
+            "SELECT id FROM orders WHERE id > ? AND id <= ? ORDER BY id", (order_cursor, max_id)
+        )]
+    return max_id, order_ids
+
+def requeue_missing_orders(order_ids, order_cursor, row_cursor, started_at, result):
+    """
+    Jadvalda topilmagan buyurtmalarni outbox ga qayta qo'yadi; kursor va natija (ReconcileResult)
+    shu tranzaksiyada saqlanadi.
+    """
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    with db_pool.writer() as conn:
+        conn.executemany(
+            "INSERT INTO sheets_outbox (order_id, row_json, created_at) VALUES (?, ?, ?)",
+            [(row[-1], json.dumps(row, ensure_ascii=False), now) for row in sheet_rows(conn, order_ids)]
+        )
+        conn.execute(
+            "UPDATE sheets_reconcile SET order_cursor = ?, row_cursor = ?, checked_at = ?, started_at = ?, result_json = ? "
+            "WHERE id = 1",
+            (order_cursor, row_cursor, now, started_at, json.dumps(result))
+        )
+
+def request_reconcile():
+    """Eksport ishlayotgan jarayondan navbatdan tashqari reconcile so'raydi. So'rov vaqtini qaytaradi."""
+    requested_at = time.time()
+    with db_pool.writer() as conn:
+        conn.execute("UPDATE sheets_reconcile SET requested_at = ? WHERE id = 1", (requested_at,))
+    return requested_at
+
+def reconcile_requested():
+    """Oxirgi reconcile boshlanganidan keyin yangi so'rov kelganmi."""
+    with db_pool.reader() as conn:
+        row = conn.execute("SELECT requested_at, started_at FROM sheets_reconcile WHERE id = 1").fetchone()
+    return bool(row and row[0] is not None and (row[1] is None or row[0] > row[1]))
+
+def get_reconcile_result(since):
+    """since dan keyin boshlangan reconcile natijasi (ReconcileResult) yoki None."""
+    with db_pool.reader() as conn:
+        row = conn.execute("SELECT started_at, result_json FROM sheets_reconcile WHERE id = 1").fetchone()
+    if not row or row[0] is None or row[0] < since or row[1] is None:
+        return None
+    return ReconcileResult(*json.loads(row[1]))
+
+def count_outbox():
+    """Outbox da kutayotgan qatorlar soni."""
+    with db_pool.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM sheets_outbox").fetchone()[0]
+
+def open_default_worksheet():
+    """.env dagi sozlamalar bo'yicha jadvalning birinchi varag'ini ochadi."""
+    client = get_google_sheets_client()
+    return client.open(GOOGLE_SHEETS_SPREADSHEET_NAME).sheet1
+
+class SheetsExporter:
+    """
+    sheets_outbox jadvalidagi qatorlarni fonda Google Sheets ga yuboradi.
+
+    Bitta avtorizatsiyalangan worksheet qayta ishlatiladi, qatorlar append_rows
+    bilan to'plab yuboriladi (hajm yoki vaqt oynasi bo'yicha), xatolikda esa
+    eksponensial pauza bilan qayta uriniladi. worksheet_factory o'rniga
+    append_rows (reconcile uchun get ham) metodiga ega istalgan obyekt (masalan, soxta worksheet) berilishi mumkin.
+    Yuborish va reconcile bitta lock ostida bajariladi, shuning uchun reconcile o'qish paytida
+    qator yozilib, "yo'qolgan" deb takror yuborilmaydi.
+    """
+
+    def __init__(self, worksheet_factory=open_default_worksheet, batch_size=SHEETS_BATCH_SIZE,
+                 flush_interval=SHEETS_FLUSH_INTERVAL, reconcile_interval=RECONCILE_INTERVAL):
+        self.worksheet_factory = worksheet_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self._worksheet = None
+        self._lock = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets")
+        self._wakeup = None
+        self._task = None
+        self._stopping = False
+        self._pending = 0
+
+    def notify(self):
+        """Yangi buyurtma outbox ga yozilganini bildiradi; to'plam to'lsa darhol yuboradi."""
+        self._pending += 1
+        if self._wakeup is not None and self._pending >= self.batch_size:
+            self._wakeup.set()
+
+    def _append(self, rows):
+        if self._worksheet is None:
+            self._worksheet = self.worksheet_factory()
+        self._worksheet.append_rows(rows, value_input_option='USER_ENTERED')
+
+    def _read_ids(self, start_row):
+        if self._worksheet is None:
+            self._worksheet = self.worksheet_factory()
+        return self._worksheet.get(f"{SHEETS_ID_COLUMN}{start_row}:{SHEETS_ID_COLUMN}")
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def running(self):
+        """Fon vazifasi shu jarayonda ishlayaptimi."""
+        return self._task is not None
+
+    async def flush(self):
+        """Vaqti kelgan barcha qatorlarni to'plamlab yuboradi. Yuborilgan qatorlar sonini qaytaradi."""
+        async with self._get_lock():
+            return await self._flush()
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        sent = 0
+        while True:
+            batch = await run_db(fetch_outbox_batch, self.batch_size)
+            if not batch:
+                break
+            outbox_ids = [outbox_id for outbox_id, _ in batch]
+            try:
+                await loop.run_in_executor(self._executor, self._append, [row for _, row in batch])
+            except Exception as e:
+                self._worksheet = None  # Keyingi urinishda qayta ulanamiz
+                from gspread.exceptions import SpreadsheetNotFound, APIError
+                if isinstance(e, APIError):
+                    logger.error(f"❌ Google Sheets API xatosi: {e}")
+                elif isinstance(e, FileNotFoundError):
+                    logger.error("❌ JSON kalit fayli topilmadi. Iltimos, fayl yo'lini tekshiring.")
+                elif isinstance(e, SpreadsheetNotFound):
+                    logger.error("❌ Google Sheets fayli topilmadi. Fayl nomini tekshiring.")
+                else:
+                    logger.error(f"❌ Google Sheets ga yuborishda noma'lum xatolik: {e}")
+                await run_db(mark_outbox_failed, outbox_ids, e)
+                break
+            await run_db(delete_outbox_rows, outbox_ids)
+            sent += len(batch)
+            now = datetime.utcnow()
+            for _, row in batch:
+                try:
+                    SHEETS_EXPORT_LAG.observe((now - datetime.strptime(row[SHEET_ORDER_DATE_INDEX], '%Y-%m-%d %H:%M:%S')).total_seconds())
+                except (ValueError, TypeError):
+                    pass
+        if sent:
+            logger.info(f"✅ Google Sheets ga {sent} ta buyurtma yuborildi.")
+        return sent
+
+    async def _read_ids_async(self, start_row):
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, self._read_ids, start_row)
+        except Exception:
+            self._worksheet = None
+            raise
+
+    async def reconcile(self):
+        """
+        Kursordan keyingi buyurtmalarni jadvaldagi ID ustuni bilan solishtiradi.
+
+        ID ustuni bitta so'rov bilan faqat oldingi tekshiruvda o'qilgan qatordan (RECONCILE_OVERLAP
+        zaxirasi bilan) boshlab o'qiladi, shuning uchun narx jadval hajmiga emas, yangi qatorlar soniga
+        bog'liq. Jadvalda yo'q buyurtmalar outbox ga qayta qo'yilib darhol yuboriladi; takrorlangan
+        ID lar faqat hisobotda ko'rsatiladi. ReconcileResult qaytaradi.
+        """
+        async with self._get_lock():
+            started_at = time.time()
+            order_cursor, row_cursor = await run_db(get_reconcile_cursor)
+            next_cursor, candidates = await run_db(fetch_reconcile_candidates, order_cursor)
+            start_row = max(1, row_cursor + 1 - RECONCILE_OVERLAP)
+            values = await self._read_ids_async(start_row)
+            if start_row > 1 and start_row + len(values) - 1 < row_cursor:
+                # Jadval kursordan qisqargan (qatorlar o'chirilgan): ID ustuni to'liq o'qiladi
+                start_row = 1
+                values = await self._read_ids_async(start_row)
+            seen = Counter(int(row[0]) for row in values if row and str(row[0]).strip().isdigit())
+            missing = [order_id for order_id in candidates if order_id not in seen]
+            duplicates = sorted(order_id for order_id, count in seen.items() if count > 1)
+            result = ReconcileResult(len(candidates), len(values), missing, duplicates)
+            await run_db(requeue_missing_orders, missing, next_cursor, start_row + len(values) - 1, started_at, result)
+            SHEETS_RECONCILE_MISSING.inc(amount=len(missing))
+            SHEETS_RECONCILE_DUPLICATES.inc(amount=len(duplicates))
+            if missing:
+                logger.warning(f"⚠️ Reconcile: {len(missing)} ta buyurtma jadvalda topilmadi, qayta yuborilmoqda.")
+                await self._flush()
+            if duplicates:
+                logger.warning(f"⚠️ Reconcile: jadvalda takrorlangan buyurtma ID lari: {duplicates[:20]}")
+            logger.info(f"✅ Reconcile: {len(candidates)} ta buyurtma, {len(values)} ta qator o'qildi.")
+            return result
+
+    async def request_reconcile(self, timeout=RECONCILE_WAIT_TIMEOUT):
+        """
+        Eksport boshqa jarayonda (sharded rejimdagi front) ishlayotganda reconcile ni baza orqali so'raydi.
+
+        Front jarayon so'rovni keyingi flush_interval oynasida ko'radi. So'rovdan keyin boshlangan
+        tekshiruv natijasi (ReconcileResult) qaytariladi; timeout ichida tugamasa None.
+        """
+        since = await run_db(request_reconcile)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(RECONCILE_POLL_INTERVAL)
+            result = await run_db(get_reconcile_result, since)
+            if result is not None:
+                return result
+        return None
+
+    async def _run(self):
+        next_reconcile = time.monotonic() + self.reconcile_interval
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            self._pending = 0
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Sheets eksportida xatolik: {e}")
+            if self._stopping:
+                continue
+            try:
+                due = self.reconcile_interval and time.monotonic() >= next_reconcile
+                if due or await run_db(reconcile_requested):
+                    next_reconcile = time.monotonic() + self.reconcile_interval
+                    await self.reconcile()
+            except Exception as e:
+                logger.error(f"❌ Jadvalni solishtirishda xatolik: {e}")
+
+    def start(self):
+        """Fon vazifasini joriy event loop da ishga tushiradi."""
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Navbatni oxirgi marta yuborib, fon vazifasini to'xtatadi."""
+        if self._task is not None:
+            # Yuborilayotgan to'plamni bekor qilmaymiz: aks holda yozilgan qatorlar outbox da qolib, takrorlanardi
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+sheets_exporter = SheetsExporter()
+
+# ----------------------------
+# 2.4 CSV EXPORT
+# ----------------------------
+
+TELEGRAM_DOCUMENT_LIMIT = 50 * 1024 * 1024  # Bot API orqali yuklanadigan fayl chegarasi
+EXPORT_PART_LIMIT = TELEGRAM_DOCUMENT_LIMIT - 1024 * 1024  # gzip buferi uchun zaxira
+# Uzoq eksportlar db_executor oqimi va o'quvchi ulanishini band qilmasligi uchun alohida bitta oqim:
+# bir vaqtdagi eksportlar navbatda kutadi, buyurtma oqimi esa DB oqimlarining hammasidan foydalanadi
+export_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+EXPORT_FETCH_SIZE = 1000
+
+USER_EXPORT_HEADER = [
+    "Buyurtma ID", "Mahsulotlar", "Umumiy summa", "To'langan",
+    "Qoldiq", "Mijoz Ismi", "Mijoz Familiyasi",
+    "Telefon", "Manzil", "Yetkazib berish muddati", "Buyurtma sana"
+]
+ADMIN_EXPORT_HEADER = ["Sotuvchi login", "Sotuvchi FIO"] + USER_EXPORT_HEADER
+
+def iter_export_rows(user_id=None, filters=None):
+    """Buyurtmalarni fetchmany bilan bo'laklab, xotiraga to'liq yuklamasdan qaytaradi."""
+    if user_id is not None:
+        query = """
+            SELECT id, products, total_price, payment, remaining_payment,
+                   customer_name, customer_surname, phone_number,
+                   location, detailed_address, delivery_time, order_date
+            FROM orders
+            WHERE user_id = ?
+            ORDER BY id ASC
+        """
+        params = (user_id,)
+    else:
+        conditions, params = order_filter_conditions(filters)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"""
+            SELECT users.login, users.full_name,
+                   orders.id, orders.products, orders.total_price, orders.payment, orders.remaining_payment,
+                   orders.customer_name, orders.customer_surname, orders.phone_number,
+                   orders.location, orders.detailed_address, orders.delivery_time, orders.order_date
+            FROM orders
+            JOIN users ON orders.user_id = users.user_id
+            {where}
+            ORDER BY orders.id ASC
+        """
+    with db_pool.reader() as conn:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                return
+            yield rows
+
+def export_orders_csv(directory, basename, header, row_chunks, compress=False, part_limit=EXPORT_PART_LIMIT):
+    """
+    CSV ni bo'laklab kodlaydi va directory ga yozadi; fayl part_limit dan oshsa keyingi qismga o'tadi.
+
+    Har bir qism sarlavha bilan boshlanadi. (fayl yo'llari ro'yxati, qatorlar soni) ni qaytaradi.
+    """
+    paths, total_rows = [], 0
+    raw = out = None
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows=None):
+        buffer.seek(0)
+        buffer.truncate()
+        if rows is None:
+            writer.writerow(header)
+        else:
+            writer.writerows(rows)
+        return buffer.getvalue().encode('utf-8')
+
+    def close_part():
+        if out is not raw:
+            out.close()
+        raw.close()
+
+    try:
+        for rows in row_chunks:
+            data = encode(rows)
+            if raw is not None and raw.tell() + len(data) > part_limit:
+                close_part()
+                raw = None
+            if raw is None:
+                extension = "csv.gz" if compress else "csv"
+                path = os.path.join(directory, f"{basename}_{len(paths) + 1}.{extension}")
+                raw = open(path, 'wb')
+                out = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+                out.write(encode())
+                paths.append(path)
+            out.write(data)
+            total_rows += len(rows)
+    finally:
+        if raw is not None:
+            close_part()
+    if len(paths) == 1:
+        # Bitta qism bo'lsa, fayl nomidan "_1" ni olib tashlaymiz
+        single = paths[0].replace(f"{basename}_1.", f"{basename}.")
+        os.replace(paths[0], single)
+        paths = [single]
+    return paths, total_rows
+
+def export_user_orders(directory, user_id, compress=False):
+    """Sotuvchining barcha buyurtmalarini CSV qismlariga yozadi."""
+    return export_orders_csv(directory, "buyurtmalar", USER_EXPORT_HEADER,
+                             iter_export_rows(user_id=user_id), compress)
+
+def export_all_orders(directory, filters=None, compress=False):
+    """Barcha buyurtmalarni (filtrlar bilan) CSV qismlariga yozadi (admin uchun)."""
+    return export_orders_csv(directory, "barcha_buyurtmalar", ADMIN_EXPORT_HEADER,
+                             iter_export_rows(filters=filters), compress)
+
+async def send_export(message, export, caption, *args, **kwargs):
+    """Eksportni eksport oqimida vaqtinchalik papkaga yozib, qismlarini hujjat sifatida yuboradi."""
+    directory = tempfile.mkdtemp(prefix="export_")
+    loop = asyncio.get_running_loop()
+    try:
+        paths, total_rows = await loop.run_in_executor(
+            export_executor, _timed_db_call, update_metrics.get(), export, (directory, *args), kwargs)
+        for index, path in enumerate(paths, start=1):
+            part_caption = caption if len(paths) == 1 else f"{caption} ({index}/{len(paths)})"
+            await bot.send_document(chat_id=message.chat.id, document=types.InputFile(path), caption=part_caption)
+        return total_rows
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+# ----------------------------
+# 2.5 FSM STORAGE
+# ----------------------------
+
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", str(24 * 3600)))  # tashlab ketilgan qoralamalar shuncha soniyadan keyin o'chiriladi
+FSM_FLUSH_INTERVAL = 1.0  # o'zgarishlar bazaga shuncha soniyada bir marta yoziladi
+FSM_CACHE_IDLE = 900  # shuncha soniya tegilmagan (saqlangan) yozuvlar xotiradan chiqariladi
+FSM_SWEEP_INTERVAL = 600
+
+def load_fsm_state(chat, user, cutoff):
+    """Saqlangan FSM yozuvini qaytaradi; cutoff dan eski yoki mavjud bo'lmasa None."""
+    with db_pool.reader() as conn:
+        row = conn.execute(
+            "SELECT state, data, bucket FROM fsm_states WHERE chat_id = ? AND user_id = ? AND updated_at >= ?",
+            (chat, user, cutoff)
+        ).fetchone()
+    if row is None:
+        return None
+    return {'state': row[0], 'data': json.loads(row[1]), 'bucket': json.loads(row[2])}
+
+def load_fsm_keys(cutoff):
+    """cutoff dan keyin yangilangan FSM yozuvlarining (chat, user) manzillari."""
+    with db_pool.reader() as conn:
+        return {(chat, user) for chat, user in conn.execute(
+            "SELECT chat_id, user_id FROM fsm_states WHERE updated_at >= ?", (cutoff,)
+        )}
+
+def save_fsm_states(upserts, deletes):
+    """O'zgargan FSM yozuvlarini bitta tranzaksiyada yozadi va bo'shaganlarini o'chiradi."""
+    with db_pool.writer() as conn:
+        if upserts:
+            conn.executemany("""
+                INSERT INTO fsm_states (chat_id, user_id, state, data, bucket, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(chat_id, user_id) DO UPDATE SET
+                    state = excluded.state, data = excluded.data,
+                    bucket = excluded.bucket, updated_at = excluded.updated_at
+            """, upserts)
+        if deletes:
+            conn.executemany("DELETE FROM fsm_states WHERE chat_id = ? AND user_id = ?", deletes)
+
+def delete_expired_fsm_states(cutoff):
+    """cutoff dan beri yangilanmagan FSM yozuvlarini o'chiradi. O'chirilganlar sonini qaytaradi."""
+    with db_pool.writer() as conn:
+        return conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,)).rowcount
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM holatlarini (state, data, bucket) fsm_states jadvalida saqlaydi.
+
+    O'qish va yozish xotiradagi keshda bajariladi. O'zgargan yozuvlar flush_interval da
+    bir marta bitta tranzaksiyada yoziladi (write-behind): bir qadamdagi bir nechta
+    update_data bitta yozuvga birlashadi. Bazada saqlangan manzillar ro'yxati birinchi
+    murojaatda bir marta o'qiladi: bot qayta ishga tushganda faqat shu manzillarning
+    yozuvi birinchi murojaatda bazadan olinadi, yangi chatlar esa bazaga umuman bormaydi.
+    ttl dan uzoq tegilmagan yozuvlar o'chiriladi.
+    """
+
+    def __init__(self, ttl=FSM_STATE_TTL, flush_interval=FSM_FLUSH_INTERVAL, idle_timeout=FSM_CACHE_IDLE):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+        self._entries = {}  # (chat, user) -> {'state', 'data', 'bucket', 'touched'}
+        self._dirty = set()
+        self._loading = {}
+        self._stored = None  # bazada yozuvi bor manzillar (birinchi murojaatda o'qiladi)
+        self._stored_loader = None
+        self._task = None
+        self._wakeup = None
+        self._closing = False
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def _is_empty(entry):
+        return entry['state'] is None and not entry['data'] and not entry['bucket']
+
+    async def _load_stored(self):
+        if self._stored_loader is None:
+            self._stored_loader = asyncio.ensure_future(run_db(load_fsm_keys, time.time() - self.ttl))
+        try:
+            stored = await asyncio.shield(self._stored_loader)
+        except Exception:
+            self._stored_loader = None  # keyingi murojaatda qayta uriniladi
+            raise
+        if self._stored is None:
+            self._stored = stored
+
+    async def _entry(self, chat, user):
+        """Manzil yozuvini keshdan yoki (birinchi murojaatda) bazadan oladi."""
+        key = tuple(map(str, self.check_address(chat=chat, user=user)))
+        entry = self._entries.get(key)
+        if entry is None and self._stored is None:
+            await self._load_stored()
+            entry = self._entries.get(key)
+        if entry is None and key not in self._stored:
+            entry = self._entries[key] = {'state': None, 'data': {}, 'bucket': {}}
+        elif entry is None:
+            loader = self._loading.get(key)
+            if loader is None:
+                loader = asyncio.ensure_future(run_db(load_fsm_state, key[0], key[1], time.time() - self.ttl))
+                loader.add_done_callback(lambda _: self._loading.pop(key, None))
+                self._loading[key] = loader
+            row = await asyncio.shield(loader)
+            if row is None:
+                self._stored.discard(key)  # muddati o'tgan
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = row or {'state': None, 'data': {}, 'bucket': {}}
+        entry['touched'] = time.time()
+        return key, entry
+
+    def _mark_dirty(self, key):
+        self._dirty.add(key)
+        if self._task is None and not self._closing:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if time.time() - self._last_sweep >= FSM_SWEEP_INTERVAL:
+                await self.sweep()
+
+    async def flush(self):
+        """O'zgargan yozuvlarni bazaga yozadi. Yozilgan yozuvlar sonini qaytaradi."""
+        if not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None or self._is_empty(entry):
+                deletes.append(key)
+                continue
+            try:
+                upserts.append((key[0], key[1], entry['state'],
+                                json.dumps(entry['data'], ensure_ascii=False),
+                                json.dumps(entry['bucket'], ensure_ascii=False),
+                                entry['touched']))
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ FSM ma'lumotlarini saqlab bo'lmadi ({key[0]}:{key[1]}): {e}")
+        try:
+            await run_db(save_fsm_states, upserts, deletes)
+        except Exception as e:
+            logger.error(f"❌ FSM holatlarini bazaga yozishda xatolik: {e}")
+            self._dirty |= keys
+            return 0
+        if self._stored is not None:
+            self._stored.update(upsert[:2] for upsert in upserts)
+            self._stored.difference_update(deletes)
+        for key in deletes:
+            entry = self._entries.get(key)
+            if entry is not None and key not in self._dirty and self._is_empty(entry):
+                del self._entries[key]
+        return len(keys)
+
+    async def sweep(self):
+        """Muddati o'tgan qoralamalarni o'chiradi va uzoq tegilmagan yozuvlarni xotiradan chiqaradi."""
+        now = self._last_sweep = time.time()
+        for key, entry in list(self._entries.items()):
+            if key not in self._dirty and now - entry['touched'] > min(self.idle_timeout, self.ttl):
+                del self._entries[key]
+        try:
+            expired = await run_db(delete_expired_fsm_states, now - self.ttl)
+        except Exception as e:
+            logger.error(f"❌ Eskirgan FSM holatlarini o'chirishda xatolik: {e}")
+            return
+        if expired:
+            logger.info(f"🧹 {expired} ta tashlab ketilgan FSM holati o'chirildi.")
+
+    async def close(self):
+        """Fon vazifasini to'xtatadi va qolgan o'zgarishlarni yozadi. Qayta chaqirish xavfsiz."""
+        self._closing = True
+        if self._task is not None:
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        self._entries.clear()
+
+    async def wait_closed(self):
+        pass
+
+    async def get_state(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        return entry['state'] if entry['state'] is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        return copy.deepcopy(entry['data'])
+
+    async def update_data(self, *, chat=None, user=None, data=None, **kwargs):
+        key, entry = await self._entry(chat, user)
+        entry['data'].update(data or {}, **kwargs)
+        self._mark_dirty(key)
+
+    async def set_state(self, *, chat=None, user=None, state=None):
+        key, entry = await self._entry(chat, user)
+        entry['state'] = self.resolve_state(state)
+        self._mark_dirty(key)
+
+    async def set_data(self, *, chat=None, user=None, data=None):
+        key, entry = await self._entry(chat, user)
+        entry['data'] = copy.deepcopy(data or {})
+        self._mark_dirty(key)
+
+    async def reset_state(self, *, chat=None, user=None, with_data=True):
+        key, entry = await self._entry(chat, user)
+        entry['state'] = None
+        if with_data:
+            entry['data'] = {}
+        self._mark_dirty(key)
+
+    def has_bucket(self):
+        return True
+
+    async def get_bucket(self, *, chat=None, user=None, default=None):
+        _, entry = await self._entry(chat, user)
+        return copy.deepcopy(entry['bucket'])
+
+    async def set_bucket(self, *, chat=None, user=None, bucket=None):
+        key, entry = await self._entry(chat, user)
+        entry['bucket'] = copy.deepcopy(bucket or {})
+        self._mark_dirty(key)
+
+    async def update_bucket(self, *, chat=None, user=None, bucket=None, **kwargs):
+        key, entry = await self._entry(chat, user)
+        entry['bucket'].update(bucket or {}, **kwargs)
+        self._mark_dirty(key)
+
+storage = SQLiteStorage()
+
+# ----------------------------
+# 2.6 PRICING
+# ----------------------------
+
+MAX_SIZE_CM = 1000  # nestandart o'lchamning har bir tomoni uchun yuqori chegara
+PRICE_LIST_CHUNK = 4000  # Telegram xabari 4096 belgidan oshmasligi uchun
+
+Quote = namedtuple('Quote', 'product size quantity unit_price total_price')
+
+def normalize_size(size):
+    """Nestandart o'lchamni tekshiradi va '200x500' ko'rinishiga keltiradi; noto'g'ri bo'lsa None."""
+    width_cm, length_cm = parse_size_cm(size)
+    if width_cm is None or not (0 < width_cm <= MAX_SIZE_CM and 0 < length_cm <= MAX_SIZE_CM):
+        return None
+    return f"{width_cm}x{length_cm}"
+
+class PriceMatrix:
+    """
+    Mahsulot × standart o'lcham narxlari jadvali.
+
+    Jadval katalogdan bir marta, bitta o'tishda hisoblanadi; handlerlar narxni
+    tayyor lug'atdan oladi. O'lchamli mahsulotlarda narx 1 m² uchun beriladi va
+    eni × bo'yi (sm) / 10000 ga ko'paytiriladi, o'lchami belgilangan mahsulotlarda
+    esa bir dona narxi o'zi ('N/A' o'lcham).
+    """
+
+    def __init__(self, prices, sizes, fixed_size_products):
+        self.prices = dict(prices)
+        self.fixed_size_products = frozenset(fixed_size_products)
+        # Standart o'lchamlar ("Nestandart razmer" tugmasidan tashqari)
+        self.sizes = [size for size in sizes if parse_size_cm(size)[0] is not None]
+        self._areas = {size: self._area(size) for size in self.sizes}
+        self._table = {}
+        for product, price in self.prices.items():
+            if product in self.fixed_size_products:
+                self._table[(product, 'N/A')] = price
+            else:
+                for size, area in self._areas.items():
+                    self._table[(product, size)] = price * area
+
+    @staticmethod
+    def _area(size):
+        width_cm, length_cm = parse_size_cm(size)
+        return (width_cm * length_cm) / 10000  # sm² ni m² ga aylantirish
+
+    def has_fixed_size(self, product):
+        return product in self.fixed_size_products
+
+    def unit_price(self, product, size):
+        """Bir dona narxi. Noma'lum mahsulot yoki noto'g'ri o'lcham uchun ValueError."""
+        price = self._table.get((product, size))
+        if price is not None:
+            return price
+        if product not in self.prices:
+            raise ValueError(f"Noma'lum mahsulot: {product}")
+        if product in self.fixed_size_products:
+            return self.prices[product]
+        normalized = normalize_size(size)
+        if normalized is None:
+            raise ValueError(f"Noto'g'ri o'lcham: {size}")
+        return self.prices[product] * self._area(normalized)
+
+    def quote(self, product, size, quantity):
+        unit_price = self.unit_price(product, size)
+        return Quote(product, size, quantity, unit_price, unit_price * quantity)
+
+    def render(self):
+        """Narxlar jadvalini xabar bo'laklari ro'yxati sifatida qaytaradi."""
+        blocks = []
+        for product, price in self.prices.items():
+            if product in self.fixed_size_products:
+                blocks.append(f"▫️ {product}: {price:,.0f} so'm")
+                continue
+            lines = [f"▫️ {product} ({price:,.0f} so'm/m²):"]
+            lines.extend(f"    {size} — {self._table[(product, size)]:,.0f} so'm" for size in self.sizes)
+            blocks.append("\n".join(lines))
+        chunks, current = [], "💰 Narxlar jadvali:"
+        for block in blocks:
+            if len(current) + len(block) + 2 > PRICE_LIST_CHUNK:
+                chunks.append(current)
+                current = block
+            else:
+                current += "\n\n" + block
+        chunks.append(current)
+        return chunks
+
+# ----------------------------
+# 2.7 PRODUCT CATALOG
+# ----------------------------
+# Katalog (mahsulotlar, o'lchamlar, viloyatlar) catalog_* jadvallarida saqlanadi.
+# Handlerlar faqat xotiradagi o'zgarmas snapshotdan o'qiydi; tahrirdan keyin yangi
+# snapshot quriladi va bitta o'zlashtirish bilan almashtiriladi.
+
+CATALOG_POLL_INTERVAL = 10.0  # boshqa jarayonlardagi tahrirlarni tekshirish oralig'i
+CATALOG_LISTS = {'size': 'catalog_sizes', 'region': 'catalog_regions'}
+
+class CatalogSnapshot:
+    """
+    Katalogning o'zgarmas nusxasi va undan hosil qilinadigan narxlar jadvali, klaviaturalar.
+
+    Hosilalar har bir snapshot uchun bir marta quriladi, ya'ni faqat versiya o'zgarganda.
+    """
+
+    def __init__(self, version, products, sizes, regions):
+        self.version = version
+        self.products = tuple(name for name, _, _ in products)
+        self.sizes = tuple(sizes)
+        self.regions = tuple(regions)
+        self.region_set = frozenset(self.regions)
+        self.size_buttons = frozenset(self.sizes + (CUSTOM_SIZE_BUTTON,))
+        self.price_matrix = PriceMatrix(
+            {name: price for name, price, _ in products},
+            self.sizes,
+            {name for name, _, fixed_size in products if fixed_size},
+        )
+
+    @classmethod
+    def from_constants(cls):
+        """Baza hali o'qilmagan holat uchun kod ichidagi doimiylardan qurilgan snapshot."""
+        products = [(name, price, name in PRODUCTS_WITH_FIXED_SIZE) for name, price in PRODUCT_PRICES.items()]
+        return cls(0, products, [size for size in SIZES if size != CUSTOM_SIZE_BUTTON], REGIONS)
+
+    @cached_property
+    def product_keyboard(self):
+        return reply_keyboard(*self.products, row_width=4)
+
+    @cached_property
+    def size_keyboard(self):
+        return reply_keyboard(*self.sizes, CUSTOM_SIZE_BUTTON)
+
+    @cached_property
+    def region_keyboard(self):
+        return reply_keyboard(*self.regions)
+
+    @cached_property
+    def price_list(self):
+        return self.price_matrix.render()
+
+def get_catalog_version():
+    with db_pool.reader() as conn:
+        row = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()
+    return row[0] if row else 0
+
+def read_catalog_snapshot():
+    """Katalogni bitta o'qish tranzaksiyasida o'qib, snapshot quradi."""
+    with db_pool.reader() as conn:
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT value FROM catalog_meta WHERE key = 'version'").fetchone()[0]
+            products = conn.execute(
+                "SELECT name, price, fixed_size FROM catalog_products ORDER BY position, name"
+            ).fetchall()
+            sizes = [row[0] for row in conn.execute("SELECT name FROM catalog_sizes ORDER BY position, name")]
+            regions = [row[0] for row in conn.execute("SELECT name FROM catalog_regions ORDER BY position, name")]
+        finally:
+            conn.rollback()
+    return CatalogSnapshot(version, products, sizes, regions)
+
+def _bump_catalog_version(conn):
+    conn.execute("UPDATE catalog_meta SET value = value + 1 WHERE key = 'version'")
+
+def upsert_catalog_product(name, price, fixed_size):
+    """Mahsulotni qo'shadi yoki narxini/turini yangilaydi."""
+    with db_pool.writer() as conn:
+        conn.execute("""
+            INSERT INTO catalog_products (name, price, fixed_size, position)
+            VALUES (?, ?, ?, (SELECT COALESCE(MAX(position), -1) + 1 FROM catalog_products))
+            ON CONFLICT(name) DO UPDATE SET price = excluded.price, fixed_size = excluded.fixed_size
+        """, (name, price, int(fixed_size)))
+        _bump_catalog_version(conn)
+
+def delete_catalog_product(name):
+    """Mahsulotni katalogdan olib tashlaydi. Topilmasa False."""
+    with db_pool.writer() as conn:
+        if not conn.execute("DELETE FROM catalog_products WHERE name = ?", (name,)).rowcount:
+            return False
+        _bump_catalog_version(conn)
+    return True
+
+def add_catalog_item(kind, name):
+    """O'lcham yoki viloyatni ro'yxat oxiriga qo'shadi. Allaqachon bo'lsa False."""
+    table = CATALOG_LISTS[kind]
+    with db_pool.writer() as conn:
+        cursor = conn.execute(
+            f"INSERT OR IGNORE INTO {table} (name, position) VALUES (?, (SELECT COALESCE(MAX(position), -1) + 1 FROM {table}))",
+            (name,)
+        )
+        if not cursor.rowcount:
+            return False
+        _bump_catalog_version(conn)
+    return True
+
+def delete_catalog_item(kind, name):
+    """O'lcham yoki viloyatni olib tashlaydi. Topilmasa False."""
+    table = CATALOG_LISTS[kind]
+    with db_pool.writer() as conn:
+        if not conn.execute(f"DELETE FROM {table} WHERE name = ?", (name,)).rowcount:
+            return False
+        _bump_catalog_version(conn)
+    return True
+
+class Catalog:
+    """Joriy katalog snapshotini saqlaydi va boshqa jarayonlardagi tahrirlarni kuzatadi."""
+
+    def __init__(self, poll_interval=CATALOG_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.snapshot = CatalogSnapshot.from_constants()
+        self._task = None
+
+    def load(self):
+        """Snapshotni bazadan sinxron o'qiydi (ishga tushishda)."""
+        self.snapshot = read_catalog_snapshot()
+        return self.snapshot
+
+    async def refresh(self):
+        """Bazadagi versiya o'zgargan bo'lsa, yangi snapshot quradi va almashtiradi."""
+        version = await run_db(get_catalog_version)
+        if version != self.snapshot.version:
+            self.snapshot = await run_db(read_catalog_snapshot)
+            logger.info(f"🔄 Katalog yangilandi: {self.snapshot.version}-versiya.")
+        return self.snapshot
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"❌ Katalogni yangilashda xatolik: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+catalog = Catalog()
+
+# ----------------------------
+# 2.8 SALES STATS
+# ----------------------------
+# sales_stats jadvalida har bir (o'lchov, kun, kalit) uchun bitta qator bor. save_order
+# buyurtmani shu qatorlarga UPSERT bilan qo'shadi, /stats esa orders jadvalini emas,
+# faqat oraliqdagi agregat qatorlarini o'qiydi.
+
+STATS_TOP = 10  # sotuvchi/mahsulot/viloyat bo'yicha eng katta tushumli guruhlar soni
+STATS_DAYS = 14  # kunlar bo'yicha ko'rsatiladigan oxirgi kunlar soni
+STATS_DIMENSIONS = ('seller', 'product', 'region')
+
+SALES_STATS_UPSERT = """
+    INSERT INTO sales_stats (dimension, day, key, orders, quantity, revenue, prepayment, outstanding)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (dimension, day, key) DO UPDATE SET
+        orders = orders + excluded.orders,
+        quantity = quantity + excluded.quantity,
+        revenue = revenue + excluded.revenue,
+        prepayment = prepayment + excluded.prepayment,
+        outstanding = outstanding + excluded.outstanding
+"""
+
+SalesStatsRow = namedtuple('SalesStatsRow', 'key orders quantity revenue prepayment outstanding')
+
+def record_sales_stats(conn, day, user_id, location, products, total_price, payment, remaining_payment):
+    """Buyurtmani sales_stats agregatlariga qo'shadi (save_order tranzaksiyasi ichida chaqiriladi)."""
+    totals = (1, sum(p['quantity'] for p in products), total_price, payment, remaining_payment)
+    rows = [('day', day, '', *totals), ('seller', day, str(user_id), *totals), ('region', day, location, *totals)]
+    # Mahsulotlar bo'yicha faqat soni va tushumi; oldindan to'lov buyurtmaning o'ziga tegishli
+    by_product = {}
+    for p in products:
+        quantity, revenue = by_product.get(p['name'], (0, 0))
+        by_product[p['name']] = (quantity + p['quantity'], revenue + p.get('total_price', p['unit_price'] * p['quantity']))
+    rows.extend(('product', day, name, 1, quantity, revenue, 0, 0) for name, (quantity, revenue) in by_product.items())
+    conn.executemany(SALES_STATS_UPSERT, rows)
+
+def get_sales_stats(date_from=None, date_to=None, top=STATS_TOP, days=STATS_DAYS):
+    """
+    Oraliq ('YYYY-MM-DD', ikkala chegara ham kiradi) bo'yicha savdo ko'rsatkichlarini oladi.
+
+    {'total': SalesStatsRow, 'day': [...], 'seller': [...], 'product': [...], 'region': [...]}
+    qaytaradi. So'rovlar faqat agregat qatorlarini o'qiydi va bitta o'qish tranzaksiyasida bajariladi.
+    """
+    conditions, params = ["dimension = ?"], []
+    if date_from:
+        conditions.append("day >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append("day <= ?")
+        params.append(date_to)
+    where = " AND ".join(conditions)
+    sums = ("SUM(orders) AS orders, SUM(quantity) AS quantity, SUM(revenue) AS revenue, "
+            "SUM(prepayment) AS prepayment, SUM(outstanding) AS outstanding")
+    with db_pool.reader() as conn:
+        conn.execute("BEGIN")
+        try:
+            total = conn.execute(f"SELECT {sums} FROM sales_stats WHERE {where}", ('day', *params)).fetchone()
+            stats = {'total': SalesStatsRow('', *(value or 0 for value in total))}
+            stats['day'] = [SalesStatsRow._make(row) for row in conn.execute(f"""
+                SELECT day, orders, quantity, revenue, prepayment, outstanding
+                FROM sales_stats WHERE {where} ORDER BY day DESC LIMIT ?
+            """, ('day', *params, days))]
+            for dimension in STATS_DIMENSIONS:
+                stats[dimension] = [SalesStatsRow._make(row) for row in conn.execute(f"""
+                    SELECT key, {sums} FROM sales_stats WHERE {where}
+                    GROUP BY key ORDER BY revenue DESC, key LIMIT ?
+                """, (dimension, *params, top))]
+            # Sotuvchilar user_id bo'yicha saqlanadi; login o'zgarsa ham agregat saqlanib qoladi
+            user_ids = [int(row.key) for row in stats['seller']]
+            logins = dict(conn.execute(
+                f"SELECT user_id, login FROM users WHERE user_id IN ({', '.join('?' * len(user_ids))})", user_ids
+            )) if user_ids else {}
+        finally:
+            conn.rollback()
+    stats['seller'] = [row._replace(key=logins.get(int(row.key), f"#{row.key}")) for row in stats['seller']]
+    return stats
+
 # ----------------------------
 # 3. STATE GROUPS
 # ----------------------------
@@ -397,6 +2416,9 @@ class AdminAddUserState(StatesGroup):
     password = State()
     confirmation = State()
 
+class AdminImportUsersState(StatesGroup):
+    file = State()
+
 class HelpProcess(StatesGroup):
     waiting_for_message = State()
 
@@ -421,78 +2443,674 @@ class OrderProcess(StatesGroup):
     confirm_order = State()
 
 # ----------------------------
-# 4. DECORATORS
+# 4. DECORATORS
+# ----------------------------
+
+def admin_only(handler):
+    """Decorator: Faqat admin foydalanuvchilarga ruxsat beradi."""
+    @wraps(handler)
+    async def wrapper(message: types.Message, *args, **kwargs):
+        user = await get_user_by_telegram_id_async(message.from_user.id)
+        if not user:
+            logger.info(f"Foydalanuvchi topilmadi: Telegram ID {message.from_user.id}")
+            await message.reply("❌ Siz admin emas ekansiz.")
+            return
+        logger.info(f"Foydalanuvchi roli: {user.role}")
+        if user.role.lower() != 'admin':
+            await message.reply("❌ Siz admin emas ekansiz.")
+            return
+        return await handler(message, *args, **kwargs)
+    return wrapper
+
+def restricted_commands_only(commands):
+    """Decorator: Faqat belgilangan komandalarni qabul qiladi."""
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(message: types.Message, *args, **kwargs):
+            command = message.text.split()[0]
+            if command not in commands:
+                await message.reply("❌ Bu komanda ruxsat etilmagan yoki mavjud emas.")
+                return
+            return await handler(message, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# ----------------------------
+# 4.1 NOTIFICATION DISPATCHER
+# ----------------------------
+
+TELEGRAM_GLOBAL_RATE = 30.0  # Bot bo'yicha sekundiga xabarlar
+TELEGRAM_CHAT_RATE = 1.0  # Bitta shaxsiy chatga sekundiga xabarlar
+TELEGRAM_GROUP_RATE = 20 / 60  # Bitta guruhga sekundiga xabarlar
+NOTIFY_MAX_RETRIES = 3
+NOTIFY_MAX_CHAT_BUCKETS = 10000
+
+class TokenBucket:
+    """
+    Token bucket. reserve() tokenni darhol band qiladi va uni ishlatishdan oldin
+    necha soniya kutish kerakligini qaytaradi, shuning uchun kutayotganlar navbat tartibida o'tadi.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount=1):
+        self._refill()
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_consume(self, amount=1):
+        """Token yetarli bo'lsa oladi va True qaytaradi, aks holda hech narsa olmaydi."""
+        self._refill()
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+class NotificationDispatcher:
+    """
+    Xabarlarni handlerdan ajratilgan holda, parallel yuboradi.
+
+    Telegram cheklovlari global va har bir chat uchun alohida token bucketlar bilan
+    hurmat qilinadi; RetryAfter (flood control) kelsa ko'rsatilgan vaqt kutilib, qayta yuboriladi.
+    """
+
+    def __init__(self, global_rate=TELEGRAM_GLOBAL_RATE, chat_rate=TELEGRAM_CHAT_RATE,
+                 group_rate=TELEGRAM_GROUP_RATE, max_chat_buckets=NOTIFY_MAX_CHAT_BUCKETS):
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.max_chat_buckets = max_chat_buckets
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = OrderedDict()
+        self._tasks = set()
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, 1)
+            while len(self._chat_buckets) > self.max_chat_buckets:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _deliver(self, chat_id, text, error_text, kwargs):
+        for _ in range(NOTIFY_MAX_RETRIES + 1):
+            # Avval chat navbati, keyin global navbat: global token faqat yuborish oldidan band qilinadi
+            delay = self._chat_bucket(chat_id).reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            delay = self._global.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"⏳ Flood control: {chat_id} ga {e.timeout} s dan keyin qayta yuboriladi.")
+                await asyncio.sleep(e.timeout)
+            except Exception as e:
+                logger.error(f"{error_text}: {e}")
+                return False
+        logger.error(f"{error_text}: {chat_id} ga {NOTIFY_MAX_RETRIES} marta qayta urinishdan keyin ham yuborilmadi.")
+        return False
+
+    def send(self, chat_id, text, error_text="❌ Xabar yuborishda xatolik", **kwargs):
+        """Xabarni fonda yuborishni rejalashtiradi va asyncio.Task ni qaytaradi."""
+        task = asyncio.create_task(self._deliver(int(chat_id), text, error_text, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def broadcast(self, chat_ids, text, error_text="❌ Xabar yuborishda xatolik", **kwargs):
+        """Bir xil xabarni bir nechta chatga (takrorlarsiz, bo'sh ID larsiz) yuboradi."""
+        return [self.send(chat_id, text, error_text, **kwargs) for chat_id in dict.fromkeys(chat_ids) if chat_id]
+
+    @property
+    def pending(self):
+        return len(self._tasks)
+
+    async def drain(self, timeout=10.0):
+        """Yuborilayotgan xabarlar tugashini (ko'pi bilan timeout soniya) kutadi."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+notifier = NotificationDispatcher()
+
+# ----------------------------
+# 4.2 KEYBOARDS & TEMPLATES
+# ----------------------------
+# Statik klaviaturalar bir marta JSON ga aylantiriladi: aiogram tayyor satrni
+# reply_markup sifatida o'zgartirmasdan yuboradi. Markdown xabarlar oldindan
+# tayyorlangan shablonlar bilan, foydalanuvchi qiymatlarini ekranlab yig'iladi.
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+MARKDOWN_ESCAPES = str.maketrans({char: '\\' + char for char in '_*`['})
+
+def reply_keyboard(*buttons, row_width=3):
+    """Bir martalik (one_time) klaviaturani yasab, JSON satr sifatida qaytaradi."""
+    markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, row_width=row_width).add(*buttons)
+    return json.dumps(markup.to_python())
+
+KEYBOARD_REMOVE = json.dumps(ReplyKeyboardRemove().to_python())
+MAIN_MENU_KEYBOARD = reply_keyboard("📦 Buyurtma Qo'shish", "📄 Buyurtmalarni Ko'rish")
+LOGIN_TYPE_KEYBOARD = reply_keyboard("👑 Admin Login", "🔑 User Login")
+ROLE_KEYBOARD = reply_keyboard("admin", "sotuvchi")
+YES_NO_KEYBOARD = reply_keyboard("✅ Ha", "❌ Yo'q")
+QUANTITY_KEYBOARD = reply_keyboard(*(str(quantity) for quantity in range(1, 11)))
+ADD_MORE_KEYBOARD = reply_keyboard("📦 Buyurtma Qo'shish", "✅ Buyurtmani Yakunlash")
+DELIVERY_TIME_KEYBOARD = reply_keyboard("Bugun", "Ertaga", "Boshqa sana kiritmoqchiman")
+
+class Markdown(str):
+    """Allaqachon ekranlangan Markdown matni (qayta ekranlanmaydi)."""
+
+def escape_md(value):
+    """Telegram Markdown uchun maxsus belgilarni (_ * ` [) ekranlaydi."""
+    if isinstance(value, Markdown):
+        return value
+    return str(value).translate(MARKDOWN_ESCAPES)
+
+class MarkdownTemplate:
+    """
+    Oldindan tayyorlangan Markdown shablon.
+
+    Qatorlar oddiy satr yoki (maydon, satr) juftligi: ikkinchisi maydon qiymati
+    bo'sh bo'lsa tashlab ketiladi. render() satr qiymatlarini ekranlaydi va
+    qatorlarni bitta join bilan yig'adi.
+    """
+
+    def __init__(self, *lines):
+        # Ketma-ket majburiy qatorlar bitta format satriga birlashtiriladi
+        parts = []
+        for line in lines:
+            field, text = (None, line) if isinstance(line, str) else line
+            if field is None and parts and parts[-1][0] is None:
+                parts[-1] = (None, parts[-1][1] + text)
+            else:
+                parts.append((field, text))
+        self._lines = tuple((field, text.format_map) for field, text in parts)
+
+    def render(self, **values):
+        escaped = {key: value if type(value) is not str else value.translate(MARKDOWN_ESCAPES)
+                   for key, value in values.items()}
+        return Markdown("".join(render(escaped) for field, render in self._lines if field is None or values.get(field)))
+
+def join_within_limit(header, blocks, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Bloklarni xabar chegarasiga sig'guncha qo'shadi; sig'maganlari o'rniga '...' qo'yiladi."""
+    parts, size = [header], len(header)
+    for block in blocks:
+        if size + len(block) > limit - 4:
+            parts.append("...")
+            break
+        parts.append(block)
+        size += len(block)
+    return Markdown("".join(parts))
+
+ORDER_ITEM_TEMPLATE = MarkdownTemplate("{name} ({size}) - {quantity} ta - {unit_price:,.0f} so'm")
+
+ORDER_SUMMARY_TEMPLATE = MarkdownTemplate(
+    "📦 *Sizning buyurtmangiz:*\n\n",
+    "*Mahsulotlar:*\n{products}\n\n",
+    "💰 *Umumiy summa:* {total_price:,.0f} so'm\n",
+    "💵 *Oldindan to'lov:* {prepayment:,.0f} so'm\n",
+    "💳 *Qoldiq to'lov:* {remaining_payment:,.0f} so'm\n",
+    "👤 *Mijoz:* {customer_name} {customer_surname}\n",
+    "📱 *Telefon:* {phone_number}\n",
+    "🏠 *Manzil:* {location} - {detailed_address}\n",
+    "⏰ *Yetkazib berish muddati:* {delivery_time}\n",
+    ('additional_comments', "📝 *Qo'shimcha izohlar:* {additional_comments}\n"),
+    "\n📜 *Ma'lumotlar to'g'rimi?*",
+)
+
+NEW_ORDER_TEMPLATE = MarkdownTemplate(
+    "📦 *Yangi buyurtma keldi:*\n\n",
+    "*Foydalanuvchi:* @{login} (ID: {user_id})\n",
+    "*Mahsulotlar:*\n{products}\n",
+    "💰 *Umumiy summa:* {total_price:,.0f} so'm\n",
+    "💵 *Oldindan to'lov:* {prepayment:,.0f} so'm\n",
+    "💳 *Qoldiq to'lov:* {remaining_payment:,.0f} so'm\n",
+    "👤 *Mijoz:* {customer_name} {customer_surname}\n",
+    "📱 *Telefon:* {phone_number}\n",
+    "🏠 *Manzil:* {location} - {detailed_address}\n",
+    "⏰ *Yetkazib berish muddati:* {delivery_time}\n",
+    ('additional_comments', "📝 *Qo'shimcha izohlar:* {additional_comments}\n"),
+    "📅 *Buyurtma qilingan sana:* {order_date}",
+)
+
+ORDER_ROW_FIELDS = (
+    'order_id', 'products', 'total_price', 'payment', 'remaining_payment', 'customer_name',
+    'customer_surname', 'phone_number', 'location', 'detailed_address', 'delivery_time', 'order_date'
+)
+
+def _order_row_template(indent):
+    return MarkdownTemplate(*(indent + line for line in (
+        "*Buyurtma ID:* {order_id}\n",
+        "*Mahsulotlar:* {products}\n",
+        "*Umumiy summa:* {total_price:,.0f} so'm\n",
+        "*To'langan:* {payment:,.0f} so'm\n",
+        "*Qoldiq:* {remaining_payment:,.0f} so'm\n",
+        "*Mijoz:* {customer_name} {customer_surname}\n",
+        "*Telefon:* {phone_number}\n",
+        "*Manzil:* {location} - {detailed_address}\n",
+        "*Yetkazib berish muddati:* {delivery_time}\n",
+        "*Buyurtma qilingan sana:* {order_date}\n",
+    )), "———————————\n")
+
+USER_ORDER_TEMPLATE = _order_row_template("")
+ADMIN_ORDER_TEMPLATE = _order_row_template("  ")
+SELLER_HEADER_TEMPLATE = MarkdownTemplate("*Foydalanuvchi:* @{login} (*FIO:* {full_name}, *Rol:* {role})\n")
+
+NEW_USER_CONFIRM_TEMPLATE = MarkdownTemplate(
+    "*Login:* {login}\n",
+    "*FIO:* {full_name}\n",
+    "*Telefon:* {phone_number}\n",
+    "*Rol:* {role}\n\n",
+    "📜 *Ma'lumotlar to'g'rimi?*",
+)
+
+PRICE_CONFIRM_TEMPLATE = MarkdownTemplate(
+    "💰 *Mahsulot:* {product}\n",
+    "📐 *O'lcham:* {size}\n",
+    "🔢 *Soni:* {quantity}\n",
+    "💰 *{total_label}:* {total_price:,.0f} so'm\n\n",
+    "✅ *Summa to'g'rimi?*",
+)
+
+LOGIN_NOTICE_TEMPLATE = MarkdownTemplate(
+    "🔔 *Diqqat!* {account} @{login} tizimga yangi Telegram ID bilan kirildi: {telegram_id}"
+)
+
+NEW_LOGIN_TEMPLATE = MarkdownTemplate(
+    "📢 *YANGI LOGIN:*\n\n",
+    "*AKKAUNT:* {account_type}\n",
+    "*Telegram ID:* {telegram_id}\n",
+    "*Telegram Username:* {telegram_username}",
+)
+
+HELP_REQUEST_TEMPLATE = MarkdownTemplate(
+    "📣 *Foydalanuvchi Yordam So‘radi*\n\n",
+    "*Login:* @{login}\n",
+    "*FIO:* {full_name}\n",
+    "*Xabar:* {message}",
+)
+
+# O'zgarmas so'rov matnlari (ParseMode.MARKDOWN bilan yuboriladi)
+ADMIN_LOGIN_PROMPT = Markdown("👑 *Admin login*\nIltimos, admin login ni kiriting:")
+NEW_USER_LOGIN_PROMPT = Markdown(
+    "🆕 *Yangi foydalanuvchini qo'shish uchun login ni kiriting* "
+    "(Loginga uning Telegram usernamesini kiritishingiz tavsiya etiladi):"
+)
+NEW_USER_FULL_NAME_PROMPT = Markdown("👤 *FIO* ni kiriting:")
+NEW_USER_PHONE_PROMPT = Markdown("📱 *Telefon raqamini kiriting (9 raqam):*")
+NEW_USER_ROLE_PROMPT = Markdown("👑 *Rolni tanlang:*")
+NEW_USER_PASSWORD_PROMPT = Markdown("🔒 *Parolni kiriting:*")
+PRODUCT_PROMPT = Markdown("📦 *Mahsulotni tanlang:*")
+SIZE_PROMPT = Markdown("📐 *O'lchamni tanlang:*")
+QUANTITY_PROMPT = Markdown("🔢 *Nechta dona buyurtma bermoqchisiz?*")
+CUSTOMER_NAME_PROMPT = Markdown("📛 *Mijozning ismini kiriting:*")
+CUSTOMER_SURNAME_PROMPT = Markdown("📛 *Mijozning familiyasini kiriting:*")
+CUSTOMER_PHONE_PROMPT = Markdown("📱 *Mijozning telefon raqamini kiriting (misol uchun 123456789 yoki 987654321):*")
+LOCATION_PROMPT = Markdown("🏠 *Mijoz qaysi viloyat yoki shahardan buyurtma qildi?*")
+ADDRESS_PROMPT = Markdown("🏡 *Manzilni batafsil kiriting:*")
+DELIVERY_TIME_PROMPT = Markdown(
+    "⏰ *Yetkazib berish muddati qachon?* Tanlang yoki kiriting.\n"
+    "\\[Bugun] \\[Ertaga] \\[Boshqa sana kiritmoqchiman]"
+)
+DELIVERY_DATE_PROMPT = Markdown("📅 *Yetkazib berish sanasini kiriting (har qanday matn):*")
+PREPAYMENT_PROMPT = Markdown("💵 *Mijoz qancha oldindan to'lov qildi? (so'mda kiriting):*")
+COMMENTS_PROMPT = Markdown(
+    "📝 *Qo'shimcha izohlaringiz bo'lsa, yozib qoldiring. Agar izoh yo'q bo'lsa, 'Yo'q' deb yozing:*"
+)
+ADD_MORE_PROMPT = Markdown("📦 *Yana buyurtma qo'shish yoki buyurtmalarni ko'rishni tanlang:*")
+
+SALES_TOTAL_TEMPLATE = MarkdownTemplate(
+    "📊 *Savdo statistikasi*\n",
+    ('period', "🔎 {period}\n"),
+    "\n📦 *Buyurtmalar:* {orders} ta ({quantity} dona)\n",
+    "💰 *Tushum:* {revenue:,.0f} so'm\n",
+    "💵 *Oldindan to'lov:* {prepayment:,.0f} so'm\n",
+    "💳 *Qoldiq:* {outstanding:,.0f} so'm\n",
+)
+SALES_ROW_TEMPLATE = MarkdownTemplate("• {key}: {orders} ta, {revenue:,.0f} so'm (qoldiq {outstanding:,.0f})\n")
+SALES_PRODUCT_ROW_TEMPLATE = MarkdownTemplate("• {key}: {quantity} dona, {orders} ta buyurtma, {revenue:,.0f} so'm\n")
+
+def render_order_items(products, separator, numbered=False):
+    """Savatchadagi mahsulotlar ro'yxati."""
+    return Markdown(separator.join(
+        (f"{index}. " if numbered else "") + ORDER_ITEM_TEMPLATE.render(
+            name=p['name'], size=p['size'], quantity=p['quantity'], unit_price=p['unit_price'])
+        for index, p in enumerate(products, start=1)
+    ))
+
+def render_order_totals(data):
+    """FSM ma'lumotlaridan buyurtma shablonlari uchun umumiy qiymatlar."""
+    products = data.get('products', [])
+    total_price = sum(p['total_price'] for p in products)
+    prepayment = data.get('prepayment', 0)
+    return dict(
+        total_price=total_price,
+        prepayment=prepayment,
+        remaining_payment=total_price - prepayment,
+        customer_name=data.get('customer_name', ''),
+        customer_surname=data.get('customer_surname', ''),
+        phone_number=data.get('phone_number', ''),
+        location=data.get('location', ''),
+        detailed_address=data.get('detailed_address', ''),
+        delivery_time=data.get('delivery_time', ''),
+        additional_comments=data.get('additional_comments', ''),
+    )
+
+# ----------------------------
+# 4.3 SAMPLING PROFILER
 # ----------------------------
+# /profile so'ralganda alohida oqim sys._current_frames() orqali barcha oqimlar
+# steklarini (event loop, db-worker, sheets) davriy yig'adi. Profil olinmayotganda
+# hech qanday oqim yoki hook ishlamaydi. bcrypt jarayonlar pulida bajariladi va bu
+# yerda ko'rinmaydi; event loop tomonida faqat natijani kutish ko'rinadi.
+
+PROFILE_INTERVAL = 0.005  # 200 Hz
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+PROFILE_TOP = 25
+# Oqim ishsiz kutayotganini bildiruvchi eng yuqori kadrlar: (fayl, funksiya)
+PROFILE_IDLE_FRAMES = {('selectors.py', 'select'), ('thread.py', '_worker'), ('threading.py', 'wait'), ('queue.py', 'get')}
+
+class SamplingProfiler:
+    """
+    Oqimlar steklarini namunalab yig'uvchi profiler.
 
-def admin_only(handler):
-    """Decorator: Faqat admin foydalanuvchilarga ruxsat beradi."""
-    @wraps(handler)
-    async def wrapper(message: types.Message, *args, **kwargs):
-        user = get_user_by_telegram_id(message.from_user.id)
-        if not user:
-            logger.info(f"Foydalanuvchi topilmadi: Telegram ID {message.from_user.id}")
-            await message.reply("❌ Siz admin emas ekansiz.")
-            return
-        logger.info(f"Foydalanuvchi roli: {user[5]}")
-        if user[5].lower() != 'admin':  # user[5] - role field
-            await message.reply("❌ Siz admin emas ekansiz.")
+    collapsed() natijasi flamegraph.pl / speedscope uchun tayyor ("oqim;f1;f2 son"),
+    summary() esa oqimlar bandligi va eng issiq funksiyalar ro'yxati.
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = Counter()  # oqim -> namunalar soni
+        self.idle = Counter()  # oqim -> ishsiz namunalar soni
+        self.seconds = 0.0
+
+    def run(self, seconds, loop_thread_id=None):
+        """seconds davomida namunalar yig'adi (alohida oqimda chaqiriladi)."""
+        me = threading.get_ident()
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                name = "event-loop" if thread_id == loop_thread_id else names.get(thread_id, str(thread_id))
+                self.samples[name] += 1
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in PROFILE_IDLE_FRAMES:
+                    self.idle[name] += 1
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(name)
+                stack.reverse()
+                self.stacks[";".join(stack)] += 1
+            time.sleep(self.interval)
+        self.seconds = time.perf_counter() - started
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top=PROFILE_TOP):
+        own, inclusive = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        busy = sum(self.stacks.values()) or 1
+        lines = [f"Profil: {self.seconds:.1f} s, interval {self.interval * 1000:.1f} ms, band namunalar: {sum(self.stacks.values())}", "",
+                 "Oqimlar (namunalar, band %):"]
+        for name, count in self.samples.most_common():
+            lines.append(f"  {name:<24} {count:>7}  {(count - self.idle[name]) / count * 100:5.1f}%")
+        for title, counts in (("Eng issiq funksiyalar (o'zi):", own), ("Eng issiq funksiyalar (chaqirganlari bilan):", inclusive)):
+            lines += ["", title]
+            lines += [f"  {count / busy * 100:5.1f}%  {count:>7}  {frame}" for frame, count in counts.most_common(top)]
+        return "\n".join(lines) + "\n"
+
+active_profiler = None  # bir vaqtda faqat bitta profil
+
+# ----------------------------
+# 4.4 FLOOD CONTROL
+# ----------------------------
+# Har bir chat uchun token bucket: limitdan oshgan xabarlar filtrlar, DB va bcrypt ga
+# yetmasdan tashlab yuboriladi. Parol holatlarida chat va login bo'yicha qattiqroq
+# limitlar, ketma-ket noto'g'ri urinishlardan keyin esa eksponensial bloklash bor.
+# Chat limitlari LRU bo'yicha cheklangan xotirada (chat doim bitta shardga tushadi);
+# login limiti va bloklash esa login_attempts jadvalida - barcha shard workerlar uchun umumiy.
+
+THROTTLE_CHAT_RATE = 2.0  # xabar/soniya
+THROTTLE_CHAT_BURST = 10
+THROTTLE_PASSWORD_RATE = 1 / 10  # parol holatida chat uchun: 10 soniyada bitta urinish
+THROTTLE_PASSWORD_BURST = 3
+THROTTLE_LOGIN_RATE = 1 / 30  # bitta login uchun barcha chatlardan birgalikda
+THROTTLE_LOGIN_BURST = 5
+THROTTLE_WARN_INTERVAL = 10.0  # ogohlantirish bir chatga shuncha soniyada ko'pi bilan bir marta
+THROTTLE_MAX_ENTRIES = 10000
+LOGIN_LOCKOUT_THRESHOLD = 3  # shuncha noto'g'ri urinishdan keyin bloklanadi
+LOGIN_LOCKOUT_BASE = 30.0  # birinchi bloklash (soniya), har keyingi xatoda ikki barobar
+LOGIN_LOCKOUT_MAX = 3600.0
+LOGIN_ATTEMPTS_RETENTION = 86400.0  # shuncha vaqt o'zgarmagan login_attempts yozuvlari o'chiriladi
+PASSWORD_STATES = {AdminLoginState.password.state, UserLoginState.password.state}
+
+class LRUTable:
+    """Eng uzoq ishlatilmagan yozuvlari chiqarib yuboriladigan, hajmi cheklangan lug'at."""
+
+    def __init__(self, factory, maxsize=THROTTLE_MAX_ENTRIES):
+        self.factory = factory
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """Yozuvni qaytaradi; yo'q bo'lsa factory() bilan yaratadi."""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = self.factory()
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry
+
+    def peek(self, key):
+        return self._entries.get(key)
+
+    def pop(self, key):
+        return self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+def login_keys(chat_id, login=None):
+    """LoginGuard kalitlari: chat va (ma'lum bo'lsa) login."""
+    return [f"chat:{chat_id}"] + ([f"login:{login}"] if login else [])
+
+class LoginGuard:
+    """
+    Noto'g'ri login urinishlarini sanaydi, eksponensial bloklashni va login bo'yicha urinishlar
+    limitini boshqaradi. Holat login_attempts jadvalida (vaqt - epoch soniya), shuning uchun
+    turli shardlardagi chatlardan urinish bloklashni chetlab o'tmaydi. Sinxron metodlar DB oqimida
+    bajariladi; handlerlar async o'ramlarini chaqiradi.
+    """
+
+    def __init__(self, threshold=LOGIN_LOCKOUT_THRESHOLD, base=LOGIN_LOCKOUT_BASE, maximum=LOGIN_LOCKOUT_MAX,
+                 login_rate=THROTTLE_LOGIN_RATE, login_burst=THROTTLE_LOGIN_BURST):
+        self.threshold = threshold
+        self.base = base
+        self.maximum = maximum
+        self.login_rate = login_rate
+        self.login_burst = login_burst
+
+    def _locked_for(self, keys):
+        with db_pool.reader() as conn:
+            row = conn.execute(
+                f"SELECT MAX(locked_until) FROM login_attempts WHERE key IN ({', '.join('?' * len(keys))})", keys
+            ).fetchone()
+        return max(0.0, (row[0] or 0.0) - time.time())
+
+    def _consume_login(self, login):
+        """Login uchun umumiy token bucket dan bitta urinish oladi (barcha chat va shardlardan birgalikda)."""
+        key, now = f"login:{login}", time.time()
+        with db_pool.writer() as conn:
+            row = conn.execute("SELECT tokens, tokens_at FROM login_attempts WHERE key = ?", (key,)).fetchone()
+            tokens = self.login_burst if row is None or row[1] is None else min(
+                self.login_burst, row[0] + (now - row[1]) * self.login_rate)
+            allowed = tokens >= 1
+            conn.execute("""
+                INSERT INTO login_attempts (key, tokens, tokens_at, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, tokens_at = excluded.tokens_at,
+                                               updated_at = excluded.updated_at
+            """, (key, tokens - 1 if allowed else tokens, now, now))
+        return allowed
+
+    def _failure(self, keys):
+        now = time.time()
+        with db_pool.writer() as conn:
+            conn.execute("DELETE FROM login_attempts WHERE updated_at < ?", (now - LOGIN_ATTEMPTS_RETENTION,))
+            for key in keys:
+                conn.execute("""
+                    INSERT INTO login_attempts (key, failures, updated_at) VALUES (?, 1, ?)
+                    ON CONFLICT(key) DO UPDATE SET failures = failures + 1, updated_at = excluded.updated_at
+                """, (key, now))
+                failures = conn.execute("SELECT failures FROM login_attempts WHERE key = ?", (key,)).fetchone()[0]
+                if failures >= self.threshold:
+                    conn.execute("UPDATE login_attempts SET locked_until = ? WHERE key = ?",
+                                 (now + min(self.maximum, self.base * 2 ** (failures - self.threshold)), key))
+
+    def _success(self, keys):
+        with db_pool.writer() as conn:
+            # Login token bucket saqlanadi: to'g'ri parol urinishlar limitini tiklamaydi
+            conn.execute(f"UPDATE login_attempts SET failures = 0, locked_until = 0 "
+                         f"WHERE key IN ({', '.join('?' * len(keys))})", keys)
+
+    async def locked_for(self, keys):
+        """Kalitlardan biri bloklangan bo'lsa, qolgan soniyalarni, aks holda 0 ni qaytaradi."""
+        return await run_db(self._locked_for, keys) if keys else 0.0
+
+    async def consume_login(self, login):
+        return await run_db(self._consume_login, login)
+
+    async def failure(self, keys):
+        await run_db(self._failure, keys)
+
+    async def success(self, keys):
+        await run_db(self._success, keys)
+
+login_guard = LoginGuard()
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Chat va login bo'yicha token bucket limitlari va login bloklashini qo'llaydi."""
+
+    def __init__(self, guard, chat_rate=THROTTLE_CHAT_RATE, chat_burst=THROTTLE_CHAT_BURST):
+        super().__init__()
+        self.guard = guard
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._chats = LRUTable(lambda: [TokenBucket(self.chat_rate, self.chat_burst), 0.0])
+        self._password_chats = LRUTable(lambda: TokenBucket(THROTTLE_PASSWORD_RATE, THROTTLE_PASSWORD_BURST))
+
+    def _should_warn(self, chat_id):
+        entry = self._chats.get(chat_id)
+        now = time.monotonic()
+        if now - entry[1] < THROTTLE_WARN_INTERVAL:
+            return False
+        entry[1] = now
+        return True
+
+    def _cancel(self):
+        metrics = update_metrics.get()
+        if metrics is not None:
+            metrics.handler = 'throttled'
+        raise CancelHandler()
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        if not self._chats.get(message.chat.id)[0].try_consume():
+            if self._should_warn(message.chat.id):
+                await message.reply("⏳ Juda ko'p xabar yuborildi. Iltimos, biroz kuting.")
+            self._cancel()
+
+    async def on_pre_process_callback_query(self, call: types.CallbackQuery, data: dict):
+        chat_id = call.message.chat.id if call.message else call.from_user.id
+        if not self._chats.get(chat_id)[0].try_consume():
+            if self._should_warn(chat_id):
+                await call.answer("⏳ Juda tez bosilmoqda. Iltimos, biroz kuting.")
+            self._cancel()
+
+    async def on_process_message(self, message: types.Message, data: dict):
+        if data.get('raw_state') not in PASSWORD_STATES:
             return
-        return await handler(message, *args, **kwargs)
-    return wrapper
+        state = data['state']
+        state_data = await state.get_data()
+        login = state_data.get('login') or state_data.get('username')
+        locked = await self.guard.locked_for(login_keys(message.chat.id, login))
+        if locked > 0:
+            await message.reply(f"🔒 Juda ko'p noto'g'ri urinish. {int(locked) + 1} soniyadan keyin /start orqali qayta urinib ko'ring.")
+            await state.finish()
+            self._cancel()
+        if not self._password_chats.get(message.chat.id).try_consume() or (
+                login and not await self.guard.consume_login(login)):
+            await message.reply("⏳ Parol juda tez-tez kiritilmoqda. Iltimos, birozdan keyin /start orqali qayta urinib ko'ring.")
+            await state.finish()
+            self._cancel()
 
-def restricted_commands_only(commands):
-    """Decorator: Faqat belgilangan komandalarni qabul qiladi."""
-    def decorator(handler):
-        @wraps(handler)
-        async def wrapper(message: types.Message, *args, **kwargs):
-            command = message.text.split()[0]
-            if command not in commands:
-                await message.reply("❌ Bu komanda ruxsat etilmagan yoki mavjud emas.")
-                return
-            return await handler(message, *args, **kwargs)
-        return wrapper
-    return decorator
+throttling = ThrottlingMiddleware(login_guard)
 
 # ----------------------------
 # 5. BOT COMMAND HANDLERS
 # ----------------------------
 
-@dp.message_handler(commands=['start'])
+@handlers.message_handler(commands=['start'])
 async def start_command(message: types.Message, state: FSMContext):
     """Botni boshlash va foydalanuvchini ro'yxatdan o'tkazish yoki kirishni taklif qilish."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if user:
-        if user[5].lower() == 'admin':
+        if user.role.lower() == 'admin':
             await message.reply("✅ Siz admin sifatida tizimga kirdingiz.\n📦 Barcha buyurtmalarni ko'rish uchun /all_orders, yangi foydalanuvchi qo'shish uchun /add_user buyrug'ini yuboring.")
         else:
             # Foydalanuvchi allaqachon tizimga kirgan bo'lsa, faqat tugmalarni ko'rsatish
-            user_buttons = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("📦 Buyurtma Qo'shish", "📄 Buyurtmalarni Ko'rish")
-            await message.reply("✅ Siz allaqachon tizimga kirdingiz.\n📦 Buyurtmalarni ko'rish yoki yangi buyurtma qo'shish uchun quyidagi tugmalardan birini tanlang:", reply_markup=user_buttons)
+            await message.reply("✅ Siz allaqachon tizimga kirdingiz.\n📦 Buyurtmalarni ko'rish yoki yangi buyurtma qo'shish uchun quyidagi tugmalardan birini tanlang:", reply_markup=MAIN_MENU_KEYBOARD)
     else:
         # Foydalanuvchi ro'yxatdan o'tmagan, login turini tanlash
-        login_type_markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("👑 Admin Login", "🔑 User Login")
-        await message.reply("👋 Assalomu alaykum! Iltimos, tizimga kirish turini tanlang:", reply_markup=login_type_markup)
+        await message.reply("👋 Assalomu alaykum! Iltimos, tizimga kirish turini tanlang:", reply_markup=LOGIN_TYPE_KEYBOARD)
         await LoginTypeState.choosing.set()
 
-@dp.message_handler(state=LoginTypeState.choosing)
+@handlers.message_handler(state=LoginTypeState.choosing)
 async def choose_login_type(message: types.Message, state: FSMContext):
     """Login turini tanlash (Admin yoki User)."""
     choice = message.text.strip()
     if choice == "👑 Admin Login":
-        await message.reply("🔑 Iltimos, admin loginini kiriting:", reply_markup=ReplyKeyboardRemove())
+        await message.reply("🔑 Iltimos, admin loginini kiriting:", reply_markup=KEYBOARD_REMOVE)
         await AdminLoginState.login.set()
     elif choice == "🔑 User Login":
-        await message.reply("👤 Iltimos, username ni kiriting:", reply_markup=ReplyKeyboardRemove())
+        await message.reply("👤 Iltimos, username ni kiriting:", reply_markup=KEYBOARD_REMOVE)
         await UserLoginState.username.set()
     else:
         await message.reply("❌ Iltimos, faqat berilgan variantlardan birini tanlang.")
         return
 
-@dp.message_handler(state=AdminLoginState.login)
+@handlers.message_handler(state=AdminLoginState.login)
 async def admin_login_get_login(message: types.Message, state: FSMContext):
     """Admin loginini qabul qilish."""
     login = message.text.strip()
-    user = get_user_by_login(login)
+    user = await get_user_record_by_login_async(login)
     if not user:
         await message.reply("❌ Bu login mavjud emas. Iltimos, to'g'ri login kiriting.")
         await state.finish()
@@ -501,37 +3119,34 @@ async def admin_login_get_login(message: types.Message, state: FSMContext):
         await message.reply("🔒 Parolingizni kiriting:")
         await AdminLoginState.next()
 
-@dp.message_handler(state=AdminLoginState.password)
+@handlers.message_handler(state=AdminLoginState.password)
 async def admin_login_get_password(message: types.Message, state: FSMContext):
     """Admin parolini qabul qilish va autentifikatsiya."""
     password = message.text.strip()
     data = await state.get_data()
-    user = authenticate_user_admin(data['login'], password)
+    user = await authenticate_user_admin_async(data['login'], password)
+    keys = login_keys(message.chat.id, data['login'])
     if user:
+        await login_guard.success(keys)
         # Eski adminlarni olish (agar adminning oldingi telegram_id'si mavjud bo'lsa)
         old_admins = []
         if user[6] and user[6] != message.from_user.id:
-            old_admins = get_admins_by_telegram_id(user[6])
+            old_admins = await get_admins_by_telegram_id_async(user[6])
 
         # Telegram ID va username ni yangilash
-        update_user_telegram_id(user[0], message.from_user.id, message.from_user.username)
+        await update_user_telegram_id_async(user[0], message.from_user.id, message.from_user.username)
 
         # Yangi login haqida adminlarga xabar yuborish
-        updated_user = get_user_by_telegram_id(message.from_user.id)
+        updated_user = await get_user_by_telegram_id_async(message.from_user.id)
         if updated_user:
             await notify_admins_of_login(updated_user)
 
         # Agar eski adminlar mavjud bo'lsa, ularga xabar yuborish
-        for admin in old_admins:
-            admin_telegram_id = admin[6]
-            if admin_telegram_id:
-                try:
-                    await bot.send_message(
-                        admin_telegram_id,
-                        f"🔔 **Diqqat!** Admin @{user[1]} tizimga yangi Telegram ID bilan kirildi: {message.from_user.id}"
-                    )
-                except Exception as e:
-                    logger.error(f"❌ Eski adminga xabar yuborishda xatolik: {e}")
+        notifier.broadcast(
+            [admin[6] for admin in old_admins],
+            LOGIN_NOTICE_TEMPLATE.render(account="Admin", login=user[1], telegram_id=message.from_user.id),
+            error_text="❌ Eski adminga xabar yuborishda xatolik", parse_mode=ParseMode.MARKDOWN
+        )
 
         # Foydalanuvchiga (adminga) login haqida hech qanday ma'lumot yuborilmaydi
         await message.reply(
@@ -539,14 +3154,15 @@ async def admin_login_get_password(message: types.Message, state: FSMContext):
         )
         await state.finish()
     else:
+        await login_guard.failure(keys)
         await message.reply("❌ Login yoki parol noto'g'ri. Iltimos, qayta urinib ko'ring.")
         await state.finish()
 
-@dp.message_handler(state=UserLoginState.username)
+@handlers.message_handler(state=UserLoginState.username)
 async def user_login_get_username(message: types.Message, state: FSMContext):
     """User username ni qabul qilish."""
     username = message.text.strip()
-    user = get_user_by_login(username)
+    user = await get_user_record_by_login_async(username)
     if not user:
         await message.reply("❌ Bu username mavjud emas. Iltimos, to'g'ri username kiriting.")
         await state.finish()
@@ -555,120 +3171,192 @@ async def user_login_get_username(message: types.Message, state: FSMContext):
         await message.reply("🔒 Parolingizni kiriting:")
         await UserLoginState.next()
 
-@dp.message_handler(state=UserLoginState.password)
+@handlers.message_handler(state=UserLoginState.password)
 async def user_login_get_password(message: types.Message, state: FSMContext):
     """Oddiy foydalanuvchi parolini qabul qilish va autentifikatsiya."""
     password = message.text.strip()
     data = await state.get_data()
     username = data.get('username')
-    user = authenticate_user_regular(username, password)
+    user = await authenticate_user_regular_async(username, password)
+    keys = login_keys(message.chat.id, username)
     if user:
+        await login_guard.success(keys)
         # Eski adminlarni olish (agar foydalanuvchi admin bo'lsa va oldingi Telegram ID mavjud bo'lsa)
         old_admins = []
         if user[5].lower() == 'admin' and user[6] and user[6] != message.from_user.id:
-            old_admins = get_admins_by_telegram_id(user[6])
+            old_admins = await get_admins_by_telegram_id_async(user[6])
 
         # Telegram ID va username ni yangilash
-        update_user_telegram_id(user[0], message.from_user.id, message.from_user.username)
+        await update_user_telegram_id_async(user[0], message.from_user.id, message.from_user.username)
 
         # Yangi login haqida adminlarga xabar yuborish
-        updated_user = get_user_by_telegram_id(message.from_user.id)
+        updated_user = await get_user_by_telegram_id_async(message.from_user.id)
         if updated_user:
             await notify_admins_of_login(updated_user)
 
         # Agar eski adminlar mavjud bo'lsa, ularga xabar yuborish
-        for admin in old_admins:
-            admin_telegram_id = admin[6]
-            if admin_telegram_id:
-                try:
-                    await bot.send_message(
-                        admin_telegram_id,
-                        f"🔔 **Diqqat!** Foydalanuvchi @{user[1]} tizimga yangi Telegram ID bilan kirildi: {message.from_user.id}"
-                    )
-                except Exception as e:
-                    logger.error(f"❌ Eski adminga xabar yuborishda xatolik: {e}")
+        notifier.broadcast(
+            [admin[6] for admin in old_admins],
+            LOGIN_NOTICE_TEMPLATE.render(account="Foydalanuvchi", login=user[1], telegram_id=message.from_user.id),
+            error_text="❌ Eski adminga xabar yuborishda xatolik", parse_mode=ParseMode.MARKDOWN
+        )
 
         # Foydalanuvchiga faqat kerakli tugmalarni ko'rsatish
-        user_buttons = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("📦 Buyurtma Qo'shish", "📄 Buyurtmalarni Ko'rish")
         await message.reply(
             "✅ Tizimga muvaffaqiyatli kirdingiz.\n📦 Buyurtmalarni ko'rish yoki yangi buyurtma qo'shish uchun quyidagi tugmalardan birini tanlang:",
-            reply_markup=user_buttons
+            reply_markup=MAIN_MENU_KEYBOARD
         )
         await state.finish()
     else:
+        await login_guard.failure(keys)
         await message.reply("❌ Parol noto'g'ri yoki siz ro'yxatdan o'tmagan. Iltimos, qayta urinib ko'ring yoki admin bilan bog'laning.")
         await state.finish()
 
-@dp.message_handler(commands=['my_orders'])
+@handlers.message_handler(commands=['my_orders'])
 @restricted_commands_only(['/my_orders'])
 async def my_orders_command(message: types.Message):
-    """Foydalanuvchining buyurtmalarini CSV fayli sifatida ko'rsatish."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    """Foydalanuvchining buyurtmalarini CSV fayli sifatida yuborish (/my_orders gz - siqilgan holda)."""
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if not user:
         await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
         return
-    orders = get_user_orders(user[0])
-    if not orders:
-        await message.reply("📭 Siz hali birorta ham buyurtma bermagansiz.")
-        return
-
-    # Create CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    # Write header
-    writer.writerow([
-        "Buyurtma ID", "Mahsulotlar", "Umumiy summa", "To'langan",
-        "Qoldiq", "Mijoz Ismi", "Mijoz Familiyasi",
-        "Telefon", "Manzil", "Yetkazib berish muddati", "Buyurtma sana"
-    ])
-    # Write order data
-    for order in orders:
-        writer.writerow(order)
-
-    output.seek(0)
-    file = io.BytesIO(output.read().encode())
-    file.name = "buyurtmalar.csv"
-
+    compress = 'gz' in (message.get_args() or "").split()
     try:
-        await bot.send_document(chat_id=message.chat.id, document=file, caption="📄 Sizning buyurtmalaringiz:")
+        total_rows = await send_export(message, export_user_orders, "📄 Sizning buyurtmalaringiz:",
+                                       user.user_id, compress=compress)
     except Exception as e:
         logger.error(f"❌ CSV faylini yuborishda xatolik: {e}")
         await message.reply("❌ Buyurtmalarni yuborishda xatolik yuz berdi.")
+        return
+    if not total_rows:
+        await message.reply("📭 Siz hali birorta ham buyurtma bermagansiz.")
 
-@dp.message_handler(commands=['admin'])
+@handlers.message_handler(commands=['price_list'])
+@restricted_commands_only(['/price_list'])
+async def price_list_command(message: types.Message):
+    """Barcha mahsulotlar va standart o'lchamlar narxlarini yuborish."""
+    user = await get_user_by_telegram_id_async(message.from_user.id)
+    if not user:
+        await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
+        return
+    for chunk in catalog.snapshot.price_list:
+        await message.answer(chunk)
+
+ORDER_SEARCH_SESSIONS = 1000
+order_search_sessions = OrderedDict()  # token -> (telegram_id, matn, so'rov, user_id yoki None)
+FIND_USAGE = "ℹ️ Foydalanish: /find matn\nMisol: /find Aliyev 90123"
+
+def render_search_page(rows, text, offset, show_seller, capped=False):
+    """Qidiruv natijalari sahifasini Markdown matniga aylantiradi."""
+    header = (f"🔍 *Qidiruv:* {escape_md(text)}\n"
+              f"*Natijalar:* {offset + 1}-{offset + len(rows)}\n")
+    if capped:
+        header += (f"⚠️ Mosliklar juda ko'p: faqat eng yangi {SEARCH_CANDIDATES} tasi orasidan eng moslari "
+                   f"ko'rsatilmoqda. Eskiroq buyurtmalar uchun so'rovni aniqlashtiring (masalan, telefon yoki familiya).\n")
+    header += "\n"
+    blocks = []
+    for order in rows:
+        login, full_name, role = order[:3]
+        values = dict(zip(ORDER_ROW_FIELDS, order[3:]))
+        if show_seller:
+            blocks.append(SELLER_HEADER_TEMPLATE.render(login=login, full_name=full_name, role=role.capitalize()))
+            blocks.append(ADMIN_ORDER_TEMPLATE.render(**values))
+        else:
+            blocks.append(USER_ORDER_TEMPLATE.render(**values))
+    return join_within_limit(header, blocks)
+
+def search_page_markup(token, offset, count, has_next):
+    """Oldingi/keyingi sahifa tugmalari."""
+    buttons = []
+    if offset:
+        buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"fd:{token}:{max(offset - ORDERS_PAGE_SIZE, 0)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"fd:{token}:{offset + count}"))
+    return InlineKeyboardMarkup(row_width=2).add(*buttons) if buttons else None
+
+@handlers.message_handler(commands=['find'])
+@restricted_commands_only(['/find'])
+async def find_command(message: types.Message):
+    """Buyurtmalarni mijoz, telefon, manzil, izoh va mahsulotlar bo'yicha qidirish (sotuvchi - faqat o'zinikini)."""
+    user = await get_user_by_telegram_id_async(message.from_user.id)
+    if not user:
+        await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
+        return
+    text = (message.get_args() or "").strip()
+    query = fts_query(text)
+    if not query:
+        await message.reply(FIND_USAGE)
+        return
+    scope = None if user.role.lower() == 'admin' else user.user_id
+    rows, has_next, capped = await search_orders_async(query, scope)
+    if not rows:
+        await message.reply("🔍 Hech narsa topilmadi.")
+        return
+    token = secrets.token_hex(4)
+    order_search_sessions[token] = (message.from_user.id, text, query, scope)
+    while len(order_search_sessions) > ORDER_SEARCH_SESSIONS:
+        order_search_sessions.popitem(last=False)
+    await message.reply(
+        render_search_page(rows, text, 0, show_seller=scope is None, capped=capped),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=search_page_markup(token, 0, len(rows), has_next)
+    )
+
+@handlers.callback_query_handler(lambda call: call.data and call.data.startswith('fd:'))
+async def find_page_callback(call: types.CallbackQuery):
+    """Qidiruv natijalari sahifasini almashtirish."""
+    _, token, offset = call.data.split(':')
+    session = order_search_sessions.get(token)
+    if session is None or session[0] != call.from_user.id:
+        await call.answer("⌛ Qidiruv eskirgan. Iltimos, /find ni qayta yuboring.", show_alert=True)
+        return
+    _, text, query, scope = session
+    offset = int(offset)
+    rows, has_next, capped = await search_orders_async(query, scope, offset=offset)
+    if not rows:
+        await call.answer("✅ Boshqa natijalar yo'q.")
+        return
+    await call.message.edit_text(
+        render_search_page(rows, text, offset, show_seller=scope is None, capped=capped),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=search_page_markup(token, offset, len(rows), has_next)
+    )
+    await call.answer()
+
+@handlers.message_handler(commands=['admin'])
 @restricted_commands_only(['/admin'])
 async def admin_login_command(message: types.Message, state: FSMContext):
     """Admin login jarayonini boshlash."""
-    await message.reply("👑 **Admin login**\nIltimos, admin login ni kiriting:")
+    await message.reply(ADMIN_LOGIN_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await AdminLoginState.login.set()
 
 # ----------------------------
 # 6. ADMIN FUNCTIONS
 # ----------------------------
 
-@dp.message_handler(commands=['add_user'])
+@handlers.message_handler(commands=['add_user'])
 @admin_only
 @restricted_commands_only(['/add_user'])
 async def add_user_command(message: types.Message):
     """Yangi foydalanuvchini qo'shish jarayonini boshlash (faqat admin uchun)."""
-    await message.reply("🆕 **Yangi foydalanuvchini qo'shish uchun login ni kiriting (Loginga uning Telegram usernamesini kiritishingiz tavsiya etiladi):")
+    await message.reply(NEW_USER_LOGIN_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await AdminAddUserState.login.set()
 
-@dp.message_handler(state=AdminAddUserState.login)
+@handlers.message_handler(state=AdminAddUserState.login)
 async def admin_add_user_login(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchi uchun login ni qabul qilish."""
     login = message.text.strip()
     if login.startswith('/'):
         await message.reply("❌ Login komanda sifatida qabul qilinmaydi. Iltimos, boshqa login tanlang.")
         return
-    if get_user_by_login(login):
+    if await get_user_record_by_login_async(login):
         await message.reply("❌ Bu login allaqachon olingan. Iltimos, boshqa login tanlang.")
     else:
         await state.update_data(login=login)
-        await message.reply("👤 **FIO** ni kiriting:")
+        await message.reply(NEW_USER_FULL_NAME_PROMPT, parse_mode=ParseMode.MARKDOWN)
         await AdminAddUserState.next()
 
-@dp.message_handler(state=AdminAddUserState.full_name)
+@handlers.message_handler(state=AdminAddUserState.full_name)
 async def admin_add_user_full_name(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchi uchun FIO ni qabul qilish."""
     full_name = message.text.strip()
@@ -676,10 +3364,10 @@ async def admin_add_user_full_name(message: types.Message, state: FSMContext):
         await message.reply("❌ FIO bo'sh bo'lishi mumkin emas. Iltimos, FIO ni kiriting.")
         return
     await state.update_data(full_name=full_name)
-    await message.reply("📱 **Telefon raqamini kiriting (9 raqam):**")
+    await message.reply(NEW_USER_PHONE_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await AdminAddUserState.next()
 
-@dp.message_handler(state=AdminAddUserState.phone_number)
+@handlers.message_handler(state=AdminAddUserState.phone_number)
 async def admin_add_user_phone_number(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchi uchun telefon raqamini qabul qilish."""
     phone_number = message.text.strip()
@@ -693,54 +3381,50 @@ async def admin_add_user_phone_number(message: types.Message, state: FSMContext)
         return
     await state.update_data(phone_number=phone_number)
     await message.reply(
-        "👑 **Rolni tanlang:**",
-        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("admin", "sotuvchi")
+        NEW_USER_ROLE_PROMPT,
+        reply_markup=ROLE_KEYBOARD,
+        parse_mode=ParseMode.MARKDOWN
     )
     await AdminAddUserState.next()
 
-@dp.message_handler(state=AdminAddUserState.role)
+@handlers.message_handler(state=AdminAddUserState.role)
 async def admin_add_user_role(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchi uchun rolni tanlash."""
     role = message.text.strip().lower()
     if role not in ["admin", "sotuvchi"]:
         await message.reply(
             "❌ Noto'g'ri rol. Iltimos, 'admin' yoki 'sotuvchi' ni tanlang.",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("admin", "sotuvchi")
+            reply_markup=ROLE_KEYBOARD
         )
         return
     await state.update_data(role=role)
-    await message.reply("🔒 **Parolni kiriting:**")
+    await message.reply(NEW_USER_PASSWORD_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await AdminAddUserState.next()
 
-@dp.message_handler(state=AdminAddUserState.password)
+@handlers.message_handler(state=AdminAddUserState.password)
 async def admin_add_user_password(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchi uchun parolni qabul qilish."""
     password = message.text.strip()
     if len(password) < 4:
         await message.reply("❌ Parol kamida 4 ta belgidan iborat bo‘lishi kerak. Iltimos, qayta kiriting.")
         return
-    hashed_password = hash_password(password)
+    hashed_password = await password_hasher.hash(password)
     await state.update_data(password=hashed_password)
-    confirm_markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("✅ Ha", "❌ Yo'q")
     data = await state.get_data()
     # Mapping 'sotuvchi' to 'Sotuvchi' for clarity
     account_type = "Admin" if data['role'].lower() == 'admin' else "Sotuvchi"
-    response = (
-        f"**Login:** {data['login']}\n"
-        f"**FIO:** {data['full_name']}\n"
-        f"**Telefon:** {data['phone_number']}\n"
-        f"**Rol:** {account_type}\n\n"
-        f"📜 **Ma'lumotlar to'g'rimi?**"
+    response = NEW_USER_CONFIRM_TEMPLATE.render(
+        login=data['login'], full_name=data['full_name'], phone_number=data['phone_number'], role=account_type
     )
-    await message.reply(response, reply_markup=confirm_markup, parse_mode=ParseMode.MARKDOWN)
+    await message.reply(response, reply_markup=YES_NO_KEYBOARD, parse_mode=ParseMode.MARKDOWN)
     await AdminAddUserState.confirmation.set()
 
-@dp.message_handler(state=AdminAddUserState.confirmation)
+@handlers.message_handler(state=AdminAddUserState.confirmation)
 async def admin_add_user_confirmation(message: types.Message, state: FSMContext):
     """Yangi foydalanuvchini tasdiqlash yoki bekor qilish."""
     data = await state.get_data()
     if message.text == "✅ Ha":
-        success = insert_user(
+        success = await insert_user_async(
             login=data['login'],
             full_name=data['full_name'],
             phone_number=data['phone_number'],
@@ -750,48 +3434,411 @@ async def admin_add_user_confirmation(message: types.Message, state: FSMContext)
             telegram_username=None
         )
         if success:
-            await message.reply("✅ Yangi foydalanuvchi muvaffaqiyatli qo'shildi.", reply_markup=ReplyKeyboardRemove())
+            await message.reply("✅ Yangi foydalanuvchi muvaffaqiyatli qo'shildi.", reply_markup=KEYBOARD_REMOVE)
         else:
             await message.reply("❌ Foydalanuvchini qo'shishda xatolik yuz berdi.")
     elif message.text == "❌ Yo'q":
-        await message.reply("❌ Yangi foydalanuvchi qo'shilmadi.", reply_markup=ReplyKeyboardRemove())
+        await message.reply("❌ Yangi foydalanuvchi qo'shilmadi.", reply_markup=KEYBOARD_REMOVE)
     else:
-        await message.reply("❌ Iltimos, tugmalardan birini tanlang.", reply_markup=ReplyKeyboardRemove())
+        await message.reply("❌ Iltimos, tugmalardan birini tanlang.", reply_markup=KEYBOARD_REMOVE)
         return
     await state.finish()
 
-@dp.message_handler(commands=['all_orders'])
+USER_ROLES = ('admin', 'sotuvchi')
+IMPORT_USERS_COLUMNS = ('login', 'full_name', 'phone', 'role', 'password')
+IMPORT_USERS_MAX_ROWS = 1000
+IMPORT_USERS_MAX_BYTES = 1024 * 1024
+IMPORT_USERS_SHOWN_ERRORS = 10
+ImportUserRow = namedtuple('ImportUserRow', 'line login full_name phone role password')
+
+def validate_new_user(login, full_name, phone, role, password):
+    """Yangi foydalanuvchi maydonlarini /add_user qoidalari bo'yicha tekshiradi; xato matnini yoki None qaytaradi."""
+    if not login:
+        return "login bo'sh"
+    if login.startswith('/'):
+        return "login '/' bilan boshlanmasligi kerak"
+    if not full_name:
+        return "FIO bo'sh"
+    if not phone:
+        return "telefon raqam bo'sh"
+    if role not in USER_ROLES:
+        return f"noto'g'ri rol '{role}' (admin yoki sotuvchi)"
+    if len(password) < 4:
+        return "parol kamida 4 ta belgidan iborat bo'lishi kerak"
+    return None
+
+def parse_users_csv(data):
+    """
+    Foydalanuvchilar CSV faylini o'qiydi va har bir qatorni oldindan tekshiradi.
+
+    Sarlavhada IMPORT_USERS_COLUMNS bo'lishi shart (tartibi ixtiyoriy), ajratuvchi ',' yoki ';' (Excel).
+    (to'g'ri qatorlar, [(qator, login, xato), ...]) qaytaradi; fayl umuman yaroqsiz bo'lsa ValueError.
+    """
+    text = data.decode('utf-8-sig')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(io.StringIO(text), dialect)
+    header = [column.strip().lower() for column in next(reader, [])]
+    missing = [column for column in IMPORT_USERS_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f"ustunlar topilmadi: {', '.join(missing)}")
+    positions = [header.index(column) for column in IMPORT_USERS_COLUMNS]
+    rows, errors, seen = [], [], {}
+    for values in reader:
+        if not any(value.strip() for value in values):
+            continue
+        if len(rows) + len(errors) >= IMPORT_USERS_MAX_ROWS:
+            raise ValueError(f"faylda {IMPORT_USERS_MAX_ROWS} tadan ortiq qator bor")
+        login, full_name, phone, role, password = (
+            values[position].strip() if position < len(values) else '' for position in positions)
+        role = role.lower()
+        error = validate_new_user(login, full_name, phone, role, password)
+        if error is None and login in seen:
+            error = f"login faylda takrorlangan ({seen[login]}-qator)"
+        if error:
+            errors.append((reader.line_num, login, error))
+        else:
+            seen[login] = reader.line_num
+            rows.append(ImportUserRow(reader.line_num, login, full_name, phone, role, password))
+    return rows, errors
+
+async def import_users(rows):
+    """
+    Tekshirilgan qatorlarni qo'shadi: mavjud loginlarni tashlab, parollarni jarayonlar pulida
+    parallel hashlaydi va hammasini bitta tranzaksiyada yozadi. [(qator, login, xato yoki None), ...] qaytaradi.
+    """
+    existing = await run_db(get_existing_logins, [row.login for row in rows])
+    results = [(row.line, row.login, "login allaqachon mavjud") for row in rows if row.login in existing]
+    fresh = [row for row in rows if row.login not in existing]
+    hashes = await password_hasher.hash_many([row.password for row in fresh])
+    inserted = await run_db(insert_users, [
+        (row.login, row.full_name, row.phone, hashed, row.role) for row, hashed in zip(fresh, hashes)
+    ])
+    results.extend((row.line, row.login, None if ok else "login allaqachon mavjud") for row, ok in zip(fresh, inserted))
+    return results
+
+def render_import_report(results):
+    """Import natijasini (qisqa xulosa, to'liq CSV hisobot baytlari) ko'rinishida tayyorlaydi."""
+    results = sorted(results)
+    failed = [(line, login, error) for line, login, error in results if error]
+    summary = f"✅ Qo'shildi: {len(results) - len(failed)} ta\n❌ O'tkazib yuborildi: {len(failed)} ta"
+    if failed:
+        summary += "\n\n" + "\n".join(f"{line}-qator ({login or '-'}): {error}"
+                                       for line, login, error in failed[:IMPORT_USERS_SHOWN_ERRORS])
+        if len(failed) > IMPORT_USERS_SHOWN_ERRORS:
+            summary += f"\n... va yana {len(failed) - IMPORT_USERS_SHOWN_ERRORS} ta (hisobot faylida)"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['qator', 'login', 'natija'])
+    writer.writerows((line, login, error or "qo'shildi") for line, login, error in results)
+    return summary, buffer.getvalue().encode('utf-8-sig')
+
+@handlers.message_handler(commands=['import_users'])
 @admin_only
-@restricted_commands_only(['/all_orders'])
-async def all_orders_command(message: types.Message):
-    """Barcha buyurtmalarni ko'rsatish (faqat admin uchun)."""
-    orders = get_all_orders()
-    if not orders:
-        await message.reply("✅ Hozircha buyurtmalar mavjud emas.")
+@restricted_commands_only(['/import_users'])
+async def import_users_command(message: types.Message):
+    """Foydalanuvchilarni CSV fayldan ommaviy qo'shishni boshlash (faqat admin uchun)."""
+    await message.reply(
+        "📥 Foydalanuvchilar ro'yxatini CSV fayl sifatida yuboring.\n"
+        f"Ustunlar: {', '.join(IMPORT_USERS_COLUMNS)}\n"
+        f"Rol: admin yoki sotuvchi. Ko'pi bilan {IMPORT_USERS_MAX_ROWS} ta qator."
+    )
+    await AdminImportUsersState.file.set()
+
+@handlers.message_handler(content_types=types.ContentType.DOCUMENT, state=AdminImportUsersState.file)
+async def import_users_file(message: types.Message, state: FSMContext):
+    """Yuborilgan CSV faylni tekshirib, foydalanuvchilarni qo'shish va hisobot yuborish."""
+    await state.finish()
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_USERS_MAX_BYTES:
+        await message.reply(f"❌ Fayl juda katta (ko'pi bilan {IMPORT_USERS_MAX_BYTES // 1024} KB).")
+        return
+    buffer = io.BytesIO()
+    await document.download(destination_file=buffer)
+    try:
+        rows, errors = parse_users_csv(buffer.getvalue())
+    except (ValueError, csv.Error) as e:
+        await message.reply(f"❌ CSV faylni o'qib bo'lmadi: {e}")
+        return
+    if not rows and not errors:
+        await message.reply("❌ Faylda foydalanuvchilar topilmadi.")
         return
-    response = "📦 **Barcha buyurtmalar:**\n\n"
+    started = time.perf_counter()
+    try:
+        results = await import_users(rows) + errors
+    except sqlite3.Error as e:
+        logger.error(f"❌ Foydalanuvchilarni import qilishda xatolik: {e}")
+        await message.reply("❌ Foydalanuvchilarni qo'shishda xatolik yuz berdi. Hech kim qo'shilmadi.")
+        return
+    summary, report = render_import_report(results)
+    logger.info(f"✅ CSV import: {len(results)} ta qator, {time.perf_counter() - started:.2f} s")
+    await message.reply(summary)
+    await message.reply_document(types.InputFile(io.BytesIO(report), filename="import_natijasi.csv"))
+
+@handlers.message_handler(content_types=types.ContentType.ANY, state=AdminImportUsersState.file)
+async def import_users_not_file(message: types.Message, state: FSMContext):
+    """CSV fayl o'rniga boshqa xabar kelsa, importni bekor qilish."""
+    await state.finish()
+    await message.reply("❌ CSV fayl kutilgan edi. Import bekor qilindi; qayta urinish uchun /import_users ni yuboring.")
+
+ORDER_BROWSER_SESSIONS = 1000
+order_browser_filters = OrderedDict()  # token -> filtrlar; callback_data 64 baytga sig'ishi uchun
+
+def parse_order_filters(text):
+    """'/all_orders seller=ali from=2024-01-01 to=2024-01-31 loc="Toshkent shahri"' dan filtrlarni ajratadi."""
+    keys = {'seller': 'seller', 'from': 'date_from', 'to': 'date_to', 'loc': 'location'}
+    filters = {}
+    for key, value in re.findall(r'(\w+)=("[^"]*"|\S+)', text):
+        if key not in keys:
+            raise ValueError(f"Noma'lum filtr: {key}")
+        value = value.strip('"')
+        if key in ('from', 'to'):
+            datetime.strptime(value, '%Y-%m-%d')
+        filters[keys[key]] = value
+    return filters
+
+def render_orders_page(rows, filters):
+    """Buyurtmalar sahifasini Markdown matniga aylantiradi."""
+    header = "📦 *Barcha buyurtmalar:*\n"
+    if filters:
+        header += "🔎 " + escape_md(", ".join(f"{key}: {value}" for key, value in filters.items())) + "\n"
+    header += "\n"
+    blocks = []
     current_user = ""
-    for order in orders:
-        login, full_name, phone_number, telegram_username, role, order_id, products, total_price, payment, remaining_payment, customer_name, customer_surname, order_phone_number, location, detailed_address, delivery_time, order_date = order
+    for order in rows:
+        login, full_name, phone_number, telegram_username, role = order[:5]
         if login != current_user:
             current_user = login
-            response += f"**Foydalanuvchi:** @{login} (**FIO:** {full_name}, **Rol:** {role.capitalize()})\n"
-        response += (
-            f"  **Buyurtma ID:** {order_id}\n"
-            f"  **Mahsulotlar:** {products}\n"
-            f"  **Umumiy summa:** {total_price:,.0f} so'm\n"
-            f"  **To'langan:** {payment:,.0f} so'm\n"
-            f"  **Qoldiq:** {remaining_payment:,.0f} so'm\n"
-            f"  **Mijoz:** {customer_name} {customer_surname}\n"
-            f"  **Telefon:** {order_phone_number}\n"
-            f"  **Manzil:** {location} - {detailed_address}\n"
-            f"  **Yetkazib berish muddati:** {delivery_time}\n"
-            f"  **Buyurtma qilingan sana:** {order_date}\n"
-            f"———————————\n"
+            blocks.append(SELLER_HEADER_TEMPLATE.render(login=login, full_name=full_name, role=role.capitalize()))
+        blocks.append(ADMIN_ORDER_TEMPLATE.render(**dict(zip(ORDER_ROW_FIELDS, order[5:]))))
+    return join_within_limit(header, blocks)
+
+def orders_page_markup(token, rows, has_prev, has_next):
+    """Oldingi/keyingi sahifa tugmalari."""
+    markup = InlineKeyboardMarkup(row_width=2)
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"ao:{token}:p:{rows[0][5]}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"ao:{token}:n:{rows[-1][5]}"))
+    return markup.add(*buttons) if buttons else None
+
+@handlers.message_handler(commands=['all_orders'])
+@admin_only
+@restricted_commands_only(['/all_orders'])
+async def all_orders_command(message: types.Message):
+    """Barcha buyurtmalarni sahifalab ko'rsatish (faqat admin uchun)."""
+    try:
+        filters = parse_order_filters(message.get_args() or "")
+    except ValueError as e:
+        await message.reply(
+            f"❌ {e}\nMisol: /all_orders seller=login from=2024-01-01 to=2024-01-31 loc=\"Toshkent shahri\""
         )
-    await message.reply(response, parse_mode=ParseMode.MARKDOWN)
+        return
+    rows, has_next = await get_orders_page_async(filters)
+    if not rows:
+        await message.reply("✅ Hozircha buyurtmalar mavjud emas.")
+        return
+    token = secrets.token_hex(4)
+    order_browser_filters[token] = filters
+    while len(order_browser_filters) > ORDER_BROWSER_SESSIONS:
+        order_browser_filters.popitem(last=False)
+    await message.reply(
+        render_orders_page(rows, filters),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=orders_page_markup(token, rows, has_prev=False, has_next=has_next)
+    )
+
+@handlers.callback_query_handler(lambda call: call.data and call.data.startswith('ao:'))
+async def all_orders_page_callback(call: types.CallbackQuery):
+    """Buyurtmalar sahifasini almashtirish (faqat admin uchun)."""
+    user = await get_user_by_telegram_id_async(call.from_user.id)
+    if not user or user.role.lower() != 'admin':
+        await call.answer("❌ Siz admin emas ekansiz.", show_alert=True)
+        return
+    _, token, direction, cursor_id = call.data.split(':')
+    filters = order_browser_filters.get(token)
+    if filters is None:
+        await call.answer("⌛ Sahifa eskirgan. Iltimos, /all_orders ni qayta yuboring.", show_alert=True)
+        return
+    if direction == 'n':
+        rows, has_more = await get_orders_page_async(filters, after_id=int(cursor_id))
+        has_prev, has_next = True, has_more
+    else:
+        rows, has_more = await get_orders_page_async(filters, before_id=int(cursor_id))
+        has_prev, has_next = has_more, True
+    if not rows:
+        await call.answer("✅ Boshqa buyurtmalar yo'q.")
+        return
+    await call.message.edit_text(
+        render_orders_page(rows, filters),
+        parse_mode=ParseMode.MARKDOWN,
+        reply_markup=orders_page_markup(token, rows, has_prev, has_next)
+    )
+    await call.answer()
+
+@handlers.message_handler(commands=['export_orders'])
+@admin_only
+@restricted_commands_only(['/export_orders'])
+async def export_orders_command(message: types.Message):
+    """Barcha buyurtmalarni CSV fayl sifatida yuborish (faqat admin uchun)."""
+    args = message.get_args() or ""
+    try:
+        filters = parse_order_filters(args)
+    except ValueError as e:
+        await message.reply(
+            f"❌ {e}\nMisol: /export_orders from=2024-01-01 to=2024-01-31 seller=login loc=\"Andijon\" gz"
+        )
+        return
+    try:
+        total_rows = await send_export(message, export_all_orders, "📄 Barcha buyurtmalar:",
+                                       filters, compress='gz' in args.split())
+    except Exception as e:
+        logger.error(f"❌ CSV faylini yuborishda xatolik: {e}")
+        await message.reply("❌ Buyurtmalarni yuborishda xatolik yuz berdi.")
+        return
+    if not total_rows:
+        await message.reply("✅ Ko'rsatilgan oraliqda buyurtmalar mavjud emas.")
+
+@handlers.message_handler(commands=['reconcile'])
+@admin_only
+@restricted_commands_only(['/reconcile'])
+async def reconcile_command(message: types.Message):
+    """Bazadagi buyurtmalarni Google Sheets dagi ID lar bilan darhol solishtirish (faqat admin uchun)."""
+    try:
+        if sheets_exporter.running:
+            result = await sheets_exporter.reconcile()
+        else:
+            # Sharded rejimda eksport front jarayonda: so'rov baza orqali yuboriladi
+            await message.reply("⏳ Solishtirish so'rovi eksport jarayoniga yuborildi...")
+            result = await sheets_exporter.request_reconcile()
+    except Exception as e:
+        logger.error(f"❌ Jadvalni solishtirishda xatolik: {e}")
+        await message.reply("❌ Google Sheets ni tekshirishda xatolik yuz berdi.")
+        return
+    if result is None:
+        await message.reply(f"⚠️ Eksport jarayoni {RECONCILE_WAIT_TIMEOUT:.0f} soniyada javob bermadi. Jurnalni tekshiring.")
+        return
+    text = (f"🔄 Tekshirildi: {result.checked} ta yangi buyurtma, jadvaldan {result.rows_read} ta qator o'qildi.\n"
+            f"❌ Jadvalda yo'q edi: {len(result.missing)} ta")
+    if result.missing:
+        text += f" (qayta yuborildi: {', '.join(map(str, result.missing[:20]))}{' ...' if len(result.missing) > 20 else ''})"
+    if result.duplicates:
+        text += f"\n⚠️ Takrorlangan ID lar: {', '.join(map(str, result.duplicates[:20]))}"
+    await message.reply(text)
+
+SALES_SECTIONS = (
+    ('day', "📅 *Kunlar bo'yicha:*\n", SALES_ROW_TEMPLATE),
+    ('seller', "👤 *Sotuvchilar bo'yicha:*\n", SALES_ROW_TEMPLATE),
+    ('product', "🛏 *Mahsulotlar bo'yicha:*\n", SALES_PRODUCT_ROW_TEMPLATE),
+    ('region', "📍 *Viloyatlar bo'yicha:*\n", SALES_ROW_TEMPLATE),
+)
+
+def render_sales_stats(stats, filters):
+    """get_sales_stats() natijasini Markdown matniga aylantiradi."""
+    period = " - ".join(filters.get(key, "...") for key in ('date_from', 'date_to')) if filters else ""
+    header = SALES_TOTAL_TEMPLATE.render(period=period, **stats['total']._asdict())
+    blocks = []
+    for dimension, title, template in SALES_SECTIONS:
+        if stats[dimension]:
+            blocks.append(Markdown("\n" + title))
+            blocks.extend(template.render(**row._asdict()) for row in stats[dimension])
+    return join_within_limit(header, blocks)
+
+@handlers.message_handler(commands=['stats'])
+@admin_only
+@restricted_commands_only(['/stats'])
+async def stats_command(message: types.Message):
+    """Kunlar, sotuvchilar, mahsulotlar va viloyatlar bo'yicha savdo statistikasi (faqat admin uchun)."""
+    try:
+        filters = parse_order_filters(message.get_args() or "")
+        if set(filters) - {'date_from', 'date_to'}:
+            raise ValueError("Faqat from= va to= filtrlari qo'llab-quvvatlanadi.")
+    except ValueError as e:
+        await message.reply(f"❌ {e}\nMisol: /stats from=2024-01-01 to=2024-01-31")
+        return
+    try:
+        stats = await run_db(get_sales_stats, filters.get('date_from'), filters.get('date_to'))
+    except sqlite3.Error as e:
+        logger.error(f"❌ Statistikani olishda xatolik: {e}")
+        await message.reply("❌ Statistikani olishda xatolik yuz berdi.")
+        return
+    if not stats['total'].orders:
+        await message.reply("✅ Ko'rsatilgan oraliqda buyurtmalar mavjud emas.")
+        return
+    await message.reply(render_sales_stats(stats, filters), parse_mode=ParseMode.MARKDOWN)
+
+CATALOG_USAGE = (
+    "ℹ️ Foydalanish:\n"
+    "/catalog - katalog holati\n"
+    "/catalog price NARX NOMI - o'lchamli mahsulot (1 m² narxi)\n"
+    "/catalog fixed NARX NOMI - o'lchami belgilangan mahsulot (dona narxi)\n"
+    "/catalog remove_product NOMI\n"
+    "/catalog add_size 200x140 | /catalog remove_size 200x140\n"
+    "/catalog add_region NOMI | /catalog remove_region NOMI"
+)
+
+@handlers.message_handler(commands=['catalog'])
+@admin_only
+@restricted_commands_only(['/catalog'])
+async def catalog_command(message: types.Message):
+    """Mahsulotlar katalogini ko'rish va tahrirlash (faqat admin uchun)."""
+    args = (message.get_args() or "").split(maxsplit=1)
+    if not args:
+        snapshot = catalog.snapshot
+        await message.reply(
+            f"📚 Katalog {snapshot.version}-versiya: {len(snapshot.products)} ta mahsulot, "
+            f"{len(snapshot.sizes)} ta o'lcham, {len(snapshot.regions)} ta viloyat.\n"
+            f"Narxlar: /price_list\n\n{CATALOG_USAGE}"
+        )
+        return
+    action, rest = args[0].lower(), (args[1].strip() if len(args) > 1 else "")
+    try:
+        if action in ('price', 'fixed'):
+            price_text, _, name = rest.partition(' ')
+            price_text = price_text.replace(',', '')
+            name = name.strip()
+            if not price_text.isdigit() or int(price_text) <= 0 or not name:
+                raise ValueError("Narx musbat son, nomi esa bo'sh bo'lmasligi kerak.")
+            await run_db(upsert_catalog_product, name, int(price_text), action == 'fixed')
+            result = f"✅ {name}: {int(price_text):,} so'm" + (" (dona)" if action == 'fixed' else " (1 m²)")
+        elif action == 'remove_product':
+            if not await run_db(delete_catalog_product, rest):
+                raise ValueError(f"'{rest}' mahsuloti topilmadi.")
+            result = f"✅ {rest} katalogdan olib tashlandi."
+        elif action in ('add_size', 'remove_size', 'add_region', 'remove_region'):
+            operation, kind = action.split('_')
+            name = rest
+            if kind == 'size' and operation == 'add':
+                name = normalize_size(rest)
+                if name is None:
+                    raise ValueError(f"O'lcham noto'g'ri. Shablon: 200x140 (har bir tomoni {MAX_SIZE_CM} sm gacha).")
+            if not name:
+                raise ValueError("Nomi bo'sh bo'lmasligi kerak.")
+            if operation == 'add':
+                if not await run_db(add_catalog_item, kind, name):
+                    raise ValueError(f"'{name}' allaqachon mavjud.")
+                result = f"✅ '{name}' qo'shildi."
+            else:
+                if not await run_db(delete_catalog_item, kind, name):
+                    raise ValueError(f"'{name}' topilmadi.")
+                result = f"✅ '{name}' olib tashlandi."
+        else:
+            await message.reply(CATALOG_USAGE)
+            return
+    except ValueError as e:
+        await message.reply(f"❌ {e}")
+        return
+    except sqlite3.Error as e:
+        logger.error(f"❌ Katalogni tahrirlashda xatolik: {e}")
+        await message.reply("❌ Katalogni tahrirlashda xatolik yuz berdi.")
+        return
+    snapshot = await catalog.refresh()
+    await message.reply(f"{result}\n📚 Katalog {snapshot.version}-versiya.")
 
-@dp.message_handler(commands=['kick_user'])
+@handlers.message_handler(commands=['kick_user'])
 @admin_only
 @restricted_commands_only(['/kick_user'])
 async def kick_user_command(message: types.Message):
@@ -807,18 +3854,46 @@ async def kick_user_command(message: types.Message):
         return
 
     telegram_id = int(telegram_id_str)
-    success = kick_user_by_telegram_id(telegram_id)
+    success = await kick_user_by_telegram_id_async(telegram_id)
     
     if success:
         await message.reply(f"✅ Telegram ID {telegram_id} bilan foydalanuvchi tizimdan chiqarildi.")
-        try:
-            await bot.send_message(telegram_id, "❌ Sizning akkauntingiz admin tomonidan tizimdan chiqarildi.")
-        except Exception as e:
-            logger.warning(f"Foydalanuvchiga xabar yuborishda xatolik: {e}")
+        notifier.send(telegram_id, "❌ Sizning akkauntingiz admin tomonidan tizimdan chiqarildi.",
+                      error_text="Foydalanuvchiga xabar yuborishda xatolik")
     else:
         await message.reply(f"❌ Telegram ID {telegram_id} bo‘yicha foydalanuvchi topilmadi yoki chiqarishda xatolik yuz berdi.")
 
-@dp.message_handler(commands=['zakaz'])
+@handlers.message_handler(commands=['profile'])
+@admin_only
+@restricted_commands_only(['/profile'])
+async def profile_command(message: types.Message):
+    """Berilgan soniya davomida profil olib, collapsed stacks va xulosani fayl sifatida yuborish (faqat admin uchun)."""
+    global active_profiler
+    args = (message.get_args() or "").strip() or str(PROFILE_DEFAULT_SECONDS)
+    if not args.isdigit() or not 1 <= int(args) <= PROFILE_MAX_SECONDS:
+        await message.reply(f"ℹ️ Foydalanish: /profile SONIYA (1-{PROFILE_MAX_SECONDS}, standart {PROFILE_DEFAULT_SECONDS})")
+        return
+    if active_profiler is not None:
+        await message.reply("⏳ Profil allaqachon olinmoqda. Iltimos, tugashini kuting.")
+        return
+    seconds = int(args)
+    profiler = active_profiler = SamplingProfiler()
+    await message.reply(f"⏱ {seconds} soniya davomida profil olinmoqda...")
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, profiler.run, seconds, threading.get_ident())
+    finally:
+        active_profiler = None
+    stamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+    await message.answer_document(
+        types.InputFile(io.BytesIO(profiler.collapsed().encode('utf-8')), filename=f"profile_{stamp}.folded"),
+        caption="🔥 Collapsed stacks (flamegraph.pl yoki speedscope.app uchun)"
+    )
+    await message.answer_document(
+        types.InputFile(io.BytesIO(profiler.summary().encode('utf-8')), filename=f"profile_{stamp}_top.txt"),
+        caption=f"📊 Eng issiq {PROFILE_TOP} ta funksiya"
+    )
+
+@handlers.message_handler(commands=['zakaz'])
 @restricted_commands_only(['/zakaz'])
 async def zakaz_command(message: types.Message, state: FSMContext):
     """Buyurtma qo'shish jarayonini boshlash."""
@@ -826,11 +3901,11 @@ async def zakaz_command(message: types.Message, state: FSMContext):
     await state.reset_data()  # Holat ma'lumotlarini tozalaydi
     await start_order(message, state=state)
 
-@dp.message_handler(commands=['help'])
+@handlers.message_handler(commands=['help'])
 @restricted_commands_only(['/help'])
 async def help_command_handler(message: types.Message, state: FSMContext):
     """/help komandasini qabul qilish va foydalanuvchidan xabar so'rash."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if not user:
         await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
         return
@@ -841,40 +3916,32 @@ async def help_command_handler(message: types.Message, state: FSMContext):
 # 7. HELP HANDLER
 # ----------------------------
 
-@dp.message_handler(state=HelpProcess.waiting_for_message)
+@handlers.message_handler(state=HelpProcess.waiting_for_message)
 async def process_help_message(message: types.Message, state: FSMContext):
     """Foydalanuvchi yuborgan yordam xabarini adminlarga yuborish."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if not user:
         await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
         await state.finish()
         return
 
-    user_full_name = user[2]
-    user_login = user[1]
+    user_full_name = user.full_name
+    user_login = user.login
     user_message = message.text.strip()
 
     # Adminlarni olish
-    admins = get_admins()
+    admins = await get_admins_async()
     if not admins:
         await message.reply("❌ Hozircha adminlar mavjud emas.")
         await state.finish()
         return
 
     # Adminlarga xabar yuborish
-    for admin in admins:
-        admin_telegram_id = admin[6]
-        if admin_telegram_id:
-            try:
-                await bot.send_message(
-                    admin_telegram_id,
-                    f"📣 **Foydalanuvchi Yordam So‘radi**\n\n"
-                    f"**Login:** @{user_login}\n"
-                    f"**FIO:** {user_full_name}\n"
-                    f"**Xabar:** {user_message}"
-                )
-            except Exception as e:
-                logger.error(f"❌ Adminga xabar yuborishda xatolik: {e}")
+    notifier.broadcast(
+        [admin[6] for admin in admins],
+        HELP_REQUEST_TEMPLATE.render(login=user_login, full_name=user_full_name, message=user_message),
+        error_text="❌ Adminga xabar yuborishda xatolik", parse_mode=ParseMode.MARKDOWN
+    )
 
     await message.reply("✅ Xabaringiz adminlarga yuborildi. Tez orada javob olasiz.")
     await state.finish()
@@ -885,7 +3952,7 @@ async def process_help_message(message: types.Message, state: FSMContext):
 
 async def start_order(message: types.Message, state: FSMContext):
     """Buyurtma jarayonini boshlash."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if not user:
         await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
         return
@@ -895,52 +3962,54 @@ async def start_order(message: types.Message, state: FSMContext):
         await state.update_data(products=[])
 
     await message.answer(
-        "📦 **Mahsulotni tanlang:**",
-        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True, row_width=4).add(*PRODUCT_PRICES.keys())
+        PRODUCT_PROMPT,
+        reply_markup=catalog.snapshot.product_keyboard,
+        parse_mode=ParseMode.MARKDOWN
     )
     await OrderProcess.product.set()
 
-@dp.message_handler(state=OrderProcess.product)
+@handlers.message_handler(state=OrderProcess.product)
 async def handle_product(message: types.Message, state: FSMContext):
     """Mahsulotni tanlash."""
     product = message.text.strip()
-    if product not in PRODUCT_PRICES:
+    snapshot = catalog.snapshot
+    if product not in snapshot.price_matrix.prices:
         await message.answer("❌ Iltimos, menyudan mavjud mahsulotni tanlang.")
         return
     # Get existing 'current_product' data
     data = await state.get_data()
     current_product = data.get('current_product', {})
     current_product['name'] = product
-    current_product['unit_price'] = PRODUCT_PRICES[product]  # Mahsulotning bir dona narxi
+    current_product['unit_price'] = snapshot.price_matrix.prices[product]  # Mahsulotning bir dona narxi
 
     # Agar mahsulot o'lchami oldindan belgilangan bo'lsa
-    if product in PRODUCTS_WITH_FIXED_SIZE:
+    if snapshot.price_matrix.has_fixed_size(product):
         current_product['size'] = 'N/A'  # O'lcham yo'q
         await state.update_data(current_product=current_product)
         await message.answer(
-            "🔢 **Nechta dona buyurtma bermoqchisiz?**",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(
-                "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"
-            )
+            QUANTITY_PROMPT,
+            reply_markup=QUANTITY_KEYBOARD,
+            parse_mode=ParseMode.MARKDOWN
         )
         await OrderProcess.quantity.set()
     else:
         # Agar mahsulot o'lchami kerak bo'lsa, o'lcham so'raladi
         await state.update_data(current_product=current_product)
         await message.answer(
-            "📐 **O'lchamni tanlang:**",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(*SIZES)
+            SIZE_PROMPT,
+            reply_markup=snapshot.size_keyboard,
+            parse_mode=ParseMode.MARKDOWN
         )
         await OrderProcess.size.set()
 
-@dp.message_handler(lambda message: message.text in SIZES, state=OrderProcess.size)
+@handlers.message_handler(lambda message: message.text in catalog.snapshot.size_buttons, state=OrderProcess.size)
 async def handle_size(message: types.Message, state: FSMContext):
     """Mahsulot o'lchamini tanlash."""
     size = message.text.strip()
-    if size == "Nestandart razmer":
+    if size == CUSTOM_SIZE_BUTTON:
         await message.answer(
             "❓ Nestandart o'lchamni shu shablon asosida kiriting: 200x500\nMisol uchun: 200x500 ✅",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=KEYBOARD_REMOVE
         )
         await OrderProcess.custom_size.set()
     else:
@@ -950,37 +4019,38 @@ async def handle_size(message: types.Message, state: FSMContext):
         current_product['size'] = size
         await state.update_data(current_product=current_product)
         await message.answer(
-            "🔢 **Nechta dona buyurtma bermoqchisiz?**",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(
-                "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"
-            )
+            QUANTITY_PROMPT,
+            reply_markup=QUANTITY_KEYBOARD,
+            parse_mode=ParseMode.MARKDOWN
         )
         await OrderProcess.quantity.set()
 
-@dp.message_handler(state=OrderProcess.custom_size)
+@handlers.message_handler(state=OrderProcess.custom_size)
 async def handle_custom_size(message: types.Message, state: FSMContext):
     """Nestandart razmerni qo'lda kiritish va to'g'rilash."""
     size_input = message.text.strip()
     if not size_input:
         await message.reply("❌ O'lcham bo'sh bo'lishi mumkin emas. Iltimos, o'lchamni kiriting.")
         return
-    # Optional: Perform additional validation if needed
-    # For simplicity, accept any non-empty string
-    size = size_input
+    size = normalize_size(size_input)
+    if size is None:
+        await message.reply(
+            f"❌ O'lcham noto'g'ri formatda. Shablon: 200x500 (har bir tomoni {MAX_SIZE_CM} sm gacha). Iltimos, qayta kiriting."
+        )
+        return
     # Update 'size' in 'current_product' without losing 'name'
     data = await state.get_data()
     current_product = data.get('current_product', {})
     current_product['size'] = size
     await state.update_data(current_product=current_product)
     await message.answer(
-        "🔢 **Nechta dona buyurtma bermoqchisiz?**",
-        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(
-            "1", "2", "3", "4", "5", "6", "7", "8", "9", "10"
-        )
+        QUANTITY_PROMPT,
+        reply_markup=QUANTITY_KEYBOARD,
+        parse_mode=ParseMode.MARKDOWN
     )
     await OrderProcess.quantity.set()
 
-@dp.message_handler(state=OrderProcess.quantity)
+@handlers.message_handler(state=OrderProcess.quantity)
 async def handle_quantity(message: types.Message, state: FSMContext):
     """Buyurtma miqdorini belgilash va summa hisoblash."""
     if message.text.isdigit():
@@ -996,42 +4066,33 @@ async def handle_quantity(message: types.Message, state: FSMContext):
             await message.reply("❌ Mahsulot tanlanmagan. Iltimos, buyurtma jarayonini qayta boshlang.")
             await state.finish()
             return
-        unit_price_per_sq_meter = PRODUCT_PRICES.get(product, 0)
-        # Mahsulot o'lchamli va nestandart razmer bo'lsa
-        if product not in PRODUCTS_WITH_FIXED_SIZE and size != 'N/A':
-            # O'lchamni olish
-            try:
-                width_cm, length_cm = map(int, re.findall(r'\d+', size))
-                # Maydonni hisoblash (kvadrat metrda)
-                area = (width_cm * length_cm) / 10000  # sm² ni m² ga aylantirish
-                # Umumiy narxni hisoblash
-                unit_price = unit_price_per_sq_meter * area
-                total_price = unit_price * quantity
-            except ValueError:
-                await message.answer("❌ O'lcham noto'g'ri formatda. Iltimos, qayta urinib ko'ring.")
-                return
-        else:
-            # Fiks o'lchamli mahsulotlar uchun
-            unit_price = unit_price_per_sq_meter
-            total_price = unit_price * quantity
+        price_matrix = catalog.snapshot.price_matrix
+        if product not in price_matrix.prices:
+            await message.reply("❌ Bu mahsulot katalogdan olib tashlangan. Iltimos, buyurtma jarayonini qayta boshlang.")
+            await state.finish()
+            return
+        try:
+            quote = price_matrix.quote(product, size, quantity)
+        except ValueError:
+            await message.answer("❌ O'lcham noto'g'ri formatda. Iltimos, qayta urinib ko'ring.")
+            return
+        unit_price, total_price = quote.unit_price, quote.total_price
         # Yangilash
         current_product['quantity'] = quantity
         current_product['unit_price'] = unit_price  # Bir dona mahsulotning narxi
         current_product['total_price'] = total_price
         await state.update_data(current_product=current_product)
         await message.answer(
-            f"💰 **Mahsulot:** {product}\n"
-            f"📐 **O'lcham:** {size}\n"
-            f"🔢 **Soni:** {quantity}\n"
-            f"💰 **Umumiy summa:** {total_price:,.0f} so'm\n\n"
-            f"✅ **Summa to'g'rimi?**",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("✅ Ha", "❌ Yo'q")
+            PRICE_CONFIRM_TEMPLATE.render(product=product, size=size, quantity=quantity,
+                                          total_label="Umumiy summa", total_price=total_price),
+            reply_markup=YES_NO_KEYBOARD,
+            parse_mode=ParseMode.MARKDOWN
         )
         await OrderProcess.confirm_sum.set()
     else:
-        await message.answer("❌ Iltimos, faqat raqam kiriting.", reply_markup=ReplyKeyboardRemove())
+        await message.answer("❌ Iltimos, faqat raqam kiriting.", reply_markup=KEYBOARD_REMOVE)
 
-@dp.message_handler(state=OrderProcess.confirm_sum)
+@handlers.message_handler(state=OrderProcess.confirm_sum)
 async def confirm_sum(message: types.Message, state: FSMContext):
     """Summa to'g'riligi haqida tasdiqlash."""
     data = await state.get_data()
@@ -1040,23 +4101,22 @@ async def confirm_sum(message: types.Message, state: FSMContext):
         current_product = data.get('current_product', {})
         products.append(current_product)
         await state.update_data(products=products, current_product={})
-        confirm_markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("📦 Buyurtma Qo'shish", "✅ Buyurtmani Yakunlash")
         await message.answer(
             "✅ Mahsulot qo'shildi.\n📦 Yana mahsulot qo'shish yoki buyurtmani yakunlashni tanlang:",
-            reply_markup=confirm_markup
+            reply_markup=ADD_MORE_KEYBOARD
         )
         await OrderProcess.add_more.set()
     elif message.text == "❌ Yo'q":
         # Yangi narxni kiritishni so'rash
         await message.answer(
             f"❌ {data['current_product']['name']} mahsuloti uchun hozirgi narxi: {data['current_product']['unit_price']:,.0f} so'm.\nO'zgartirish narxini kiriting:",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=KEYBOARD_REMOVE
         )
         await OrderProcess.adjust_price.set()
     else:
         await message.reply("❌ Iltimos, faqat '✅ Ha' yoki '❌ Yo'q' tugmalarini tanlang.")
 
-@dp.message_handler(state=OrderProcess.adjust_price)
+@handlers.message_handler(state=OrderProcess.adjust_price)
 async def adjust_price(message: types.Message, state: FSMContext):
     """Mahsulot narxini o'zgartirish."""
     new_price_text = message.text.strip().replace(',', '').replace(' ', '')
@@ -1074,18 +4134,17 @@ async def adjust_price(message: types.Message, state: FSMContext):
         current_product['total_price'] = total_price
         await state.update_data(current_product=current_product)
         await message.answer(
-            f"💰 **Mahsulot:** {current_product['name']}\n"
-            f"📐 **O'lcham:** {current_product['size']}\n"
-            f"🔢 **Soni:** {current_product['quantity']}\n"
-            f"💰 **Yangi umumiy summa:** {total_price:,.0f} so'm\n\n"
-            f"✅ **Summa to'g'rimi?**",
-            reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("✅ Ha", "❌ Yo'q")
+            PRICE_CONFIRM_TEMPLATE.render(product=current_product['name'], size=current_product['size'],
+                                          quantity=current_product['quantity'],
+                                          total_label="Yangi umumiy summa", total_price=total_price),
+            reply_markup=YES_NO_KEYBOARD,
+            parse_mode=ParseMode.MARKDOWN
         )
         await OrderProcess.confirm_adjusted_sum.set()
     else:
         await message.reply("❌ Iltimos, faqat raqam kiriting.")
 
-@dp.message_handler(state=OrderProcess.confirm_adjusted_sum)
+@handlers.message_handler(state=OrderProcess.confirm_adjusted_sum)
 async def confirm_adjusted_sum(message: types.Message, state: FSMContext):
     """O'zgartirilgan sumni tasdiqlash."""
     data = await state.get_data()
@@ -1094,67 +4153,54 @@ async def confirm_adjusted_sum(message: types.Message, state: FSMContext):
         current_product = data.get('current_product', {})
         products.append(current_product)
         await state.update_data(products=products, current_product={})
-        confirm_markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("📦 Buyurtma Qo'shish", "✅ Buyurtmani Yakunlash")
         await message.answer(
             "✅ Mahsulot qo'shildi.\n📦 Yana mahsulot qo'shish yoki buyurtmani yakunlashni tanlang:",
-            reply_markup=confirm_markup
+            reply_markup=ADD_MORE_KEYBOARD
         )
         await OrderProcess.add_more.set()
     elif message.text == "❌ Yo'q":
         # Yana narxni o'zgartirishni taklif qilish
         await message.answer(
             f"❌ {data['current_product']['name']} mahsuloti uchun hozirgi narxi: {data['current_product']['unit_price']:,.0f} so'm.\nO'zgartirish narxini kiriting:",
-            reply_markup=ReplyKeyboardRemove()
+            reply_markup=KEYBOARD_REMOVE
         )
         await OrderProcess.adjust_price.set()
     else:
         await message.reply("❌ Iltimos, faqat '✅ Ha' yoki '❌ Yo'q' tugmalarini tanlang.")
 
-@dp.message_handler(lambda message: message.text == "📦 Buyurtma Qo'shish", state="*")
+@handlers.message_handler(lambda message: message.text == "📦 Buyurtma Qo'shish", state="*")
 async def add_order_button(message: types.Message, state: FSMContext):
     """Buyurtma qo'shish tugmasini bosganda buyurtma jarayonini boshlash."""
     await start_order(message, state=state)
 
-@dp.message_handler(lambda message: message.text == "📄 Buyurtmalarni Ko'rish")
+@handlers.message_handler(lambda message: message.text == "📄 Buyurtmalarni Ko'rish")
 async def view_orders_button(message: types.Message):
     """Buyurtmalarni ko'rish tugmasini bosganda buyurtmalarni ko'rsatish."""
-    user = get_user_by_telegram_id(message.from_user.id)
+    user = await get_user_by_telegram_id_async(message.from_user.id)
     if not user:
         await message.reply("❌ Siz tizimga kirmagansiz. Iltimos, /start buyrug'ini yuboring.")
         return
-    orders = get_user_orders(user[0])
+    orders = await get_user_orders_async(user.user_id)
     if not orders:
         await message.reply("📭 Siz hali birorta ham buyurtma bermagansiz.")
         return
-    response = "📦 **Sizning buyurtmalaringiz:**\n\n"
-    for order in orders:
-        order_id, products, total_price, payment, remaining_payment, customer_name, customer_surname, phone_number, location, detailed_address, delivery_time, order_date = order
-        response += (
-            f"**Buyurtma ID:** {order_id}\n"
-            f"**Mahsulotlar:** {products}\n"
-            f"**Umumiy summa:** {total_price:,.0f} so'm\n"
-            f"**To'langan:** {payment:,.0f} so'm\n"
-            f"**Qoldiq:** {remaining_payment:,.0f} so'm\n"
-            f"**Mijoz:** {customer_name} {customer_surname}\n"
-            f"**Telefon:** {phone_number}\n"
-            f"**Manzil:** {location} - {detailed_address}\n"
-            f"**Yetkazib berish muddati:** {delivery_time}\n"
-            f"**Buyurtma qilingan sana:** {order_date}\n"
-            f"———————————\n"
-        )
+    response = join_within_limit(
+        "📦 *Sizning buyurtmalaringiz:*\n\n",
+        (USER_ORDER_TEMPLATE.render(**dict(zip(ORDER_ROW_FIELDS, order))) for order in orders)
+    )
     await message.reply(response, parse_mode=ParseMode.MARKDOWN)
 
 # ----------------------------
 # 9. FINALIZE ORDER HANDLER
 # ----------------------------
 
-@dp.message_handler(lambda message: message.text == "✅ Buyurtmani Yakunlash", state=OrderProcess.add_more)
+@handlers.message_handler(lambda message: message.text == "✅ Buyurtmani Yakunlash", state=OrderProcess.add_more)
 async def finalize_order_start(message: types.Message, state: FSMContext):
     """Buyurtmani yakunlash jarayonini boshlash."""
-    await message.answer("📛 **Mijozning ismini kiriting:**", reply_markup=ReplyKeyboardRemove())
+    await message.answer(CUSTOMER_NAME_PROMPT, reply_markup=KEYBOARD_REMOVE, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.customer_name.set()
 
-@dp.message_handler(state=OrderProcess.customer_name)
+@handlers.message_handler(state=OrderProcess.customer_name)
 async def get_customer_name(message: types.Message, state: FSMContext):
     """Mijoz ismini qabul qilish."""
     customer_name = message.text.strip()
@@ -1162,10 +4208,10 @@ async def get_customer_name(message: types.Message, state: FSMContext):
         await message.reply("❌ Mijoz ismi bo'sh bo'lishi mumkin emas. Iltimos, ismini kiriting.")
         return
     await state.update_data(customer_name=customer_name)
-    await message.answer("📛 **Mijozning familiyasini kiriting:**")
+    await message.answer(CUSTOMER_SURNAME_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.customer_surname.set()
 
-@dp.message_handler(state=OrderProcess.customer_surname)
+@handlers.message_handler(state=OrderProcess.customer_surname)
 async def get_customer_surname(message: types.Message, state: FSMContext):
     """Mijoz familiyasini qabul qilish."""
     customer_surname = message.text.strip()
@@ -1173,10 +4219,10 @@ async def get_customer_surname(message: types.Message, state: FSMContext):
         await message.reply("❌ Mijoz familiyasi bo'sh bo'lishi mumkin emas. Iltimos, familiyasini kiriting.")
         return
     await state.update_data(customer_surname=customer_surname)
-    await message.answer("📱 **Mijozning telefon raqamini kiriting (misol uchun 123456789 yoki 987654321):**")
+    await message.answer(CUSTOMER_PHONE_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.phone_number.set()
 
-@dp.message_handler(state=OrderProcess.phone_number)
+@handlers.message_handler(state=OrderProcess.phone_number)
 async def get_customer_phone_number(message: types.Message, state: FSMContext):
     """Mijoz telefon raqamini qabul qilish."""
     phone_number = message.text.strip()
@@ -1185,30 +4231,24 @@ async def get_customer_phone_number(message: types.Message, state: FSMContext):
         return
     await state.update_data(phone_number=phone_number)
     await message.answer(
-        "🏠 **Mijoz qaysi viloyat yoki shahardan buyurtma qildi?**",
-        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add(
-            "Toshkent shahri", "Toshkent viloyati", "Andijon", "Buxoro", "Jizzax", "Qashqadaryo",
-            "Navoiy", "Namangan", "Samarqand", "Surxondaryo", "Sirdaryo", "Farg'ona", "Xorazm", "Qoraqalpog'iston"
-        )
+        LOCATION_PROMPT,
+        reply_markup=catalog.snapshot.region_keyboard,
+        parse_mode=ParseMode.MARKDOWN
     )
     await OrderProcess.location.set()
 
-@dp.message_handler(state=OrderProcess.location)
+@handlers.message_handler(state=OrderProcess.location)
 async def get_location(message: types.Message, state: FSMContext):
     """Mijozning viloyati yoki shaharini qabul qilish."""
     location = message.text.strip()
-    available_locations = [
-        "Toshkent shahri", "Toshkent viloyati", "Andijon", "Buxoro", "Jizzax", "Qashqadaryo",
-        "Navoiy", "Namangan", "Samarqand", "Surxondaryo", "Sirdaryo", "Farg'ona", "Xorazm", "Qoraqalpog'iston"
-    ]
-    if location not in available_locations:
+    if location not in catalog.snapshot.region_set:
         await message.reply("❌ Iltimos, mavjud variantlardan birini tanlang.")
         return
     await state.update_data(location=location)
-    await message.answer("🏡 **Manzilni batafsil kiriting:**")
+    await message.answer(ADDRESS_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.detailed_address.set()
 
-@dp.message_handler(state=OrderProcess.detailed_address)
+@handlers.message_handler(state=OrderProcess.detailed_address)
 async def get_detailed_address(message: types.Message, state: FSMContext):
     """Mijozning manzilini qabul qilish."""
     detailed_address = message.text.strip()
@@ -1217,27 +4257,28 @@ async def get_detailed_address(message: types.Message, state: FSMContext):
         return
     await state.update_data(detailed_address=detailed_address)
     await message.answer(
-        "⏰ **Yetkazib berish muddati qachon?** Tanlang yoki kiriting.\n[Bugun] [Ertaga] [Boshqa sana kiritmoqchiman]",
-        reply_markup=ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("Bugun", "Ertaga", "Boshqa sana kiritmoqchiman")
+        DELIVERY_TIME_PROMPT,
+        reply_markup=DELIVERY_TIME_KEYBOARD,
+        parse_mode=ParseMode.MARKDOWN
     )
     await OrderProcess.delivery_time.set()
 
-@dp.message_handler(state=OrderProcess.delivery_time)
+@handlers.message_handler(state=OrderProcess.delivery_time)
 async def get_delivery_time(message: types.Message, state: FSMContext):
     """Yetkazib berish muddatini qabul qilish."""
     delivery_time = message.text.strip()
     if delivery_time == "Boshqa sana kiritmoqchiman":
-        await message.reply("📅 **Yetkazib berish sanasini kiriting (har qanday matn):**", reply_markup=ReplyKeyboardRemove())
+        await message.reply(DELIVERY_DATE_PROMPT, reply_markup=KEYBOARD_REMOVE, parse_mode=ParseMode.MARKDOWN)
         await OrderProcess.custom_delivery_date.set()
     elif delivery_time in ["Bugun", "Ertaga"]:
         await state.update_data(delivery_time=delivery_time)
         # Oldindan to'lov miqdorini so'rash
-        await message.answer("💵 **Mijoz qancha oldindan to'lov qildi? (so'mda kiriting):**")
+        await message.answer(PREPAYMENT_PROMPT, parse_mode=ParseMode.MARKDOWN)
         await OrderProcess.prepayment.set()
     else:
         await message.reply("❌ Iltimos, mavjud variantlardan birini tanlang yoki 'Boshqa sana kiritmoqchiman' ni tanlang.")
 
-@dp.message_handler(state=OrderProcess.custom_delivery_date)
+@handlers.message_handler(state=OrderProcess.custom_delivery_date)
 async def get_custom_delivery_date(message: types.Message, state: FSMContext):
     """Foydalanuvchi kiritgan matnni qabul qilish va saqlash."""
     delivery_input = message.text.strip()
@@ -1247,10 +4288,10 @@ async def get_custom_delivery_date(message: types.Message, state: FSMContext):
     await state.update_data(delivery_time=delivery_input)
     await message.reply(f"✅ Kiritingiz qabul qilindi va saqlandi: '{delivery_input}'")
     # Oldindan to'lov miqdorini so'rash
-    await message.answer("💵 **Mijoz qancha oldindan to'lov qildi? (so'mda kiriting):**")
+    await message.answer(PREPAYMENT_PROMPT, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.prepayment.set()
 
-@dp.message_handler(state=OrderProcess.prepayment)
+@handlers.message_handler(state=OrderProcess.prepayment)
 async def get_prepayment(message: types.Message, state: FSMContext):
     """Oldindan to'lov miqdorini qabul qilish."""
     prepayment_text = message.text.strip().replace(',', '').replace(' ', '')
@@ -1261,12 +4302,12 @@ async def get_prepayment(message: types.Message, state: FSMContext):
             return
         await state.update_data(prepayment=prepayment)
         # Qo'shimcha izohlarni so'rash
-        await message.answer("📝 **Qo'shimcha izohlaringiz bo'lsa, yozib qoldiring. Agar izoh yo'q bo'lsa, 'Yo'q' deb yozing:**")
+        await message.answer(COMMENTS_PROMPT, parse_mode=ParseMode.MARKDOWN)
         await OrderProcess.additional_comments.set()
     else:
         await message.reply("❌ Iltimos, to'lov miqdorini faqat raqamlarda kiriting.")
 
-@dp.message_handler(state=OrderProcess.additional_comments)
+@handlers.message_handler(state=OrderProcess.additional_comments)
 async def get_additional_comments(message: types.Message, state: FSMContext):
     """Qo'shimcha izohlarni qabul qilish."""
     comments = message.text.strip()
@@ -1279,116 +4320,20 @@ async def get_additional_comments(message: types.Message, state: FSMContext):
 async def show_order_summary(message: types.Message, state: FSMContext):
     """Buyurtma ma'lumotlarini ko'rsatish va tasdiqlash."""
     data = await state.get_data()
-    products = data.get('products', [])
-    total_price = sum([p['total_price'] for p in products])
-    prepayment = data.get('prepayment', 0)
-    remaining_payment = total_price - prepayment
-    customer_name = data.get('customer_name', '')
-    customer_surname = data.get('customer_surname', '')
-    phone_number = data.get('phone_number', '')
-    location = data.get('location', '')
-    detailed_address = data.get('detailed_address', '')
-    delivery_time = data.get('delivery_time', '')
-    additional_comments = data.get('additional_comments', '')
-
-    # Format products
-    products_formatted = "\n".join([f"{idx}. {p['name']} ({p['size']}) - {p['quantity']} ta - {p['unit_price']:,.0f} so'm" for idx, p in enumerate(products, start=1)])
-
-    order_summary = (
-        f"📦 **Sizning buyurtmangiz:**\n\n"
-        f"**Mahsulotlar:**\n{products_formatted}\n\n"
-        f"💰 **Umumiy summa:** {total_price:,.0f} so'm\n"
-        f"💵 **Oldindan to'lov:** {prepayment:,.0f} so'm\n"
-        f"💳 **Qoldiq to'lov:** {remaining_payment:,.0f} so'm\n"
-        f"👤 **Mijoz:** {customer_name} {customer_surname}\n"
-        f"📱 **Telefon:** {phone_number}\n"
-        f"🏠 **Manzil:** {location} - {detailed_address}\n"
-        f"⏰ **Yetkazib berish muddati:** {delivery_time}\n"
+    order_summary = ORDER_SUMMARY_TEMPLATE.render(
+        products=render_order_items(data.get('products', []), "\n", numbered=True),
+        **render_order_totals(data)
     )
-    if additional_comments:
-        order_summary += f"📝 **Qo'shimcha izohlar:** {additional_comments}\n"
-    order_summary += f"\n📜 **Ma'lumotlar to'g'rimi?**"
 
-    confirm_markup = ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True).add("✅ Ha", "❌ Yo'q")
-    await message.answer(order_summary, reply_markup=confirm_markup, parse_mode=ParseMode.MARKDOWN)
+    await message.answer(order_summary, reply_markup=YES_NO_KEYBOARD, parse_mode=ParseMode.MARKDOWN)
     await OrderProcess.confirm_order.set()
 
-def send_order_to_google_sheets(user, data):
-    """
-    Google Sheets-ga foydalanuvchi buyurtmasini yuborish funksiyasi.
-    
-    :param user: tuple - Foydalanuvchi haqida ma'lumot: (id, login, full_name, phone_number, ...)
-    :param data: dict - Buyurtma tafsilotlari:
-        {
-            "products": [
-                {"name": "Mahsulot nomi", "size": "O'lchami", "quantity": 2, "unit_price": 50000, "total_price": 100000}
-            ],
-            "prepayment": 50000,
-            "remaining_payment": 50000,
-            "customer_name": "Ism",
-            "customer_surname": "Familiya",
-            "phone_number": "+998901234567",
-            "location": "Manzil",
-            "detailed_address": "Ko'cha va uy raqami",
-            "delivery_time": "2024-12-04",
-            "additional_comments": "Izohlar",
-            "order_date": "2024-12-04"
-        }
-    """
-    try:
-        # Google Sheets API ulanishi
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = Credentials.from_service_account_file(GOOGLE_SHEETS_CREDENTIALS_JSON, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        # Google Sheets faylini ochish
-        spreadsheet = client.open(GOOGLE_SHEETS_SPREADSHEET_NAME)
-        worksheet = spreadsheet.sheet1  # Birinchi qatlamni olish
-
-        # Buyurtma tafsilotlarini qayta ishlash
-        products = data.get("products", [])
-        total_price = sum([p["total_price"] for p in products])
-        products_str = "; ".join(
-            [f"{p['name']} ({p['size']}) - {p['quantity']} ta - {p['unit_price']:,.0f} so'm" for p in products]
-        )
-
-        # Google Sheets-ga yuboriladigan ma'lumotlar
-        row = [
-            user[1],  # login
-            user[2],  # full_name
-            user[3],  # phone_number
-            products_str,  # mahsulotlar
-            total_price,  # umumiy narx
-            data.get("prepayment", 0),  # oldindan to'lov
-            data.get("remaining_payment", 0),  # qolgan to'lov
-            data.get("customer_name", ""),  # mijoz ismi
-            data.get("customer_surname", ""),  # mijoz familiyasi
-            data.get("phone_number", ""),  # mijoz telefon raqami
-            data.get("location", ""),  # joylashuv
-            data.get("detailed_address", ""),  # batafsil manzil
-            data.get("delivery_time", ""),  # yetkazib berish vaqti
-            data.get("additional_comments", ""),  # izohlar
-            data.get("order_date", "")  # buyurtma sanasi
-        ]
-
-        # Ma'lumotni Google Sheets-ga qo'shish
-        worksheet.append_row(row)
-        logger.info("✅ Buyurtma muvaffaqiyatli saqlandi!")
-    except APIError as api_error:
-        logger.error(f"❌ Google Sheets API xatosi: {api_error}")
-    except FileNotFoundError:
-        logger.error("❌ JSON kalit fayli topilmadi. Iltimos, fayl yo'lini tekshiring.")
-    except SpreadsheetNotFound:
-        logger.error("❌ Google Sheets fayli topilmadi. Fayl nomini tekshiring.")
-    except Exception as e:
-        logger.error(f"❌ Noma'lum xatolik yuz berdi: {e}")
-
-@dp.message_handler(state=OrderProcess.confirm_order)
+@handlers.message_handler(state=OrderProcess.confirm_order)
 async def confirm_order(message: types.Message, state: FSMContext):
     """Buyurtma ma'lumotlarini tasdiqlash."""
     if message.text == "✅ Ha":
         data = await state.get_data()
-        user = get_user_by_telegram_id(message.from_user.id)
+        user = await get_user_by_telegram_id_async(message.from_user.id)
         if not user:
             await message.reply("❌ Foydalanuvchi topilmadi. Iltimos, /start buyrug'ini yuboring.")
             await state.finish()
@@ -1396,10 +4341,9 @@ async def confirm_order(message: types.Message, state: FSMContext):
 
         total_price = sum([p['total_price'] for p in data.get('products', [])])
         prepayment = data.get('prepayment', 0)
-        remaining_payment = total_price - prepayment
 
-        success = save_order(
-            user_id=user[0],
+        success = await save_order_async(
+            user_id=user.user_id,
             products=data.get('products', []),
             total_price=total_price,
             payment=prepayment,
@@ -1414,56 +4358,32 @@ async def confirm_order(message: types.Message, state: FSMContext):
         )
         if success:
             await message.answer("✅ Buyurtma muvaffaqiyatli saqlandi! 😊")
+            # Google Sheets ga yuborish fonda (sheets_outbox orqali) bajariladi
+            sheets_exporter.notify()
 
             # Adminlarga buyurtma haqida xabar yuborish
-            admins = get_admins()
-            products_list = "; ".join([
-                f"{p['name']} ({p['size']}) - {p['quantity']} ta - {p['unit_price']:,.0f} so'm" 
-                for p in data.get('products', [])
-            ])
-            order_details = (
-                f"📦 **Yangi buyurtma keldi:**\n\n"
-                f"**Foydalanuvchi:** @{user[1]} (ID: {user[0]})\n"
-                f"**Mahsulotlar:**\n{products_list}\n"
-                f"💰 **Umumiy summa:** {total_price:,.0f} so'm\n"
-                f"💵 **Oldindan to'lov:** {prepayment:,.0f} so'm\n"
-                f"💳 **Qoldiq to'lov:** {remaining_payment:,.0f} so'm\n"
-                f"👤 **Mijoz:** {data.get('customer_name', '')} {data.get('customer_surname', '')}\n"
-                f"📱 **Telefon:** {data.get('phone_number', '')}\n"
-                f"🏠 **Manzil:** {data.get('location', '')} - {data.get('detailed_address', '')}\n"
-                f"⏰ **Yetkazib berish muddati:** {data.get('delivery_time', '')}\n"
+            admins = await get_admins_async()
+            order_details = NEW_ORDER_TEMPLATE.render(
+                login=user.login,
+                user_id=user.user_id,
+                products=render_order_items(data.get('products', []), "; "),
+                order_date=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                **render_order_totals(data)
             )
-            if data.get('additional_comments', ''):
-                order_details += f"📝 **Qo'shimcha izohlar:** {data.get('additional_comments', '')}\n"
-            order_details += f"📅 **Buyurtma qilingan sana:** {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}"
-
-            # Adminlarga xabar yuborish
-            for admin in admins:
-                admin_telegram_id = admin[6]
-                if admin_telegram_id:
-                    try:
-                        await bot.send_message(admin_telegram_id, order_details, parse_mode=ParseMode.MARKDOWN)
-                    except Exception as e:
-                        logger.error(f"❌ Adminga buyurtma yuborishda xatolik: {e}")
-            # Guruhga xabar yuborish
-            if GROUP_CHAT_ID:
-                try:
-                    await bot.send_message(int(GROUP_CHAT_ID), order_details, parse_mode=ParseMode.MARKDOWN)
-                except Exception as e:
-                    logger.error(f"❌ Guruhga buyurtma yuborishda xatolik: {e}")
 
-            # Buyurtma ma'lumotlarini Google Sheets ga yuborish
-            send_order_to_google_sheets(user, data)  # Removed 'await'
+            # Adminlarga va guruhga xabar fonda yuboriladi; sotuvchi javobni kutmaydi
+            notifier.broadcast([admin[6] for admin in admins], order_details,
+                               error_text="❌ Adminga buyurtma yuborishda xatolik", parse_mode=ParseMode.MARKDOWN)
+            if GROUP_CHAT_ID:
+                notifier.send(GROUP_CHAT_ID, order_details,
+                              error_text="❌ Guruhga buyurtma yuborishda xatolik", parse_mode=ParseMode.MARKDOWN)
 
             # Foydalanuvchiga asosiy tugmalarni qayta ko'rsatish
-            user_buttons = ReplyKeyboardMarkup(
-                resize_keyboard=True, 
-                one_time_keyboard=True
-            ).add("📦 Buyurtma Qo'shish", "📄 Buyurtmalarni Ko'rish")
 
             await message.answer(
-                "📦 **Yana buyurtma qo'shish yoki buyurtmalarni ko'rishni tanlang:**",
-                reply_markup=user_buttons
+                ADD_MORE_PROMPT,
+                reply_markup=MAIN_MENU_KEYBOARD,
+                parse_mode=ParseMode.MARKDOWN
             )
             await state.finish()
         else:
@@ -1471,20 +4391,16 @@ async def confirm_order(message: types.Message, state: FSMContext):
             await state.finish()
     elif message.text == "❌ Yo'q":
         # Buyurtma saqlanmaydi
-        user_buttons = ReplyKeyboardMarkup(
-            resize_keyboard=True, 
-            one_time_keyboard=True
-        ).add("📦 Buyurtma Qo'shish", "📄 Buyurtmalarni Ko'rish")
 
         await message.answer(
             "❌ Buyurtma saqlanmadi.\n📦 Yana buyurtma qo'shishni yoki buyurtmalarni ko'rishni tanlang:",
-            reply_markup=user_buttons
+            reply_markup=MAIN_MENU_KEYBOARD
         )
         await state.finish()
     else:
         await message.reply("❌ Iltimos, faqat '✅ Ha' yoki '❌ Yo'q' tugmalarini tanlang.")
 
-@dp.message_handler(state=OrderProcess.add_more)
+@handlers.message_handler(state=OrderProcess.add_more)
 async def ask_add_more(message: types.Message, state: FSMContext):
     """Yana buyurtma qo'shish yoki yakunlashni so'rash."""
     if message.text == "📦 Buyurtma Qo'shish":
@@ -1498,7 +4414,7 @@ async def ask_add_more(message: types.Message, state: FSMContext):
 # 10. UNKNOWN COMMAND HANDLER
 # ----------------------------
 
-@dp.message_handler(lambda message: message.text.startswith('/') and message.text.split()[0] not in ['/start', '/admin', '/my_orders', '/add_user', '/all_orders', '/kick_user', '/zakaz', '/help'])
+@handlers.message_handler(lambda message: message.text.startswith('/') and message.text.split()[0] not in ['/start', '/admin', '/my_orders', '/add_user', '/all_orders', '/export_orders', '/kick_user', '/zakaz', '/help', '/price_list', '/catalog', '/stats', '/find', '/profile', '/import_users', '/reconcile'])
 async def unknown_command(message: types.Message):
     """Noma'lum komandalarni javoblash."""
     await message.reply("❌ Bu komanda ruxsat etilmagan yoki mavjud emas.")
@@ -1512,10 +4428,18 @@ async def set_default_commands():
     user_commands = [
         types.BotCommand(command="/start", description="Botni boshlash"),
         types.BotCommand(command="/zakaz", description="Yangi buyurtma qo'shish"),
+        types.BotCommand(command="/price_list", description="Narxlar jadvali"),
         types.BotCommand(command="/my_orders", description="O'z buyurtmalarini ko'rish"),
+        types.BotCommand(command="/find", description="Buyurtmalarni qidirish"),
         types.BotCommand(command="/admin", description="Admin sifatida kirish"),
         types.BotCommand(command="/add_user", description="Yangi foydalanuvchi qo'shish (Admin)"),
+        types.BotCommand(command="/import_users", description="Foydalanuvchilarni CSV dan qo'shish (Admin)"),
         types.BotCommand(command="/all_orders", description="Barcha buyurtmalarni ko'rish (Admin)"),
+        types.BotCommand(command="/export_orders", description="Buyurtmalarni CSV da yuklab olish (Admin)"),
+        types.BotCommand(command="/catalog", description="Katalogni tahrirlash (Admin)"),
+        types.BotCommand(command="/stats", description="Savdo statistikasi (Admin)"),
+        types.BotCommand(command="/profile", description="Profil olish (Admin)"),
+        types.BotCommand(command="/reconcile", description="Jadvalni bazaga solishtirish (Admin)"),
         types.BotCommand(command="/kick_user", description="Foydalanuvchini chiqarish (Admin)"),
         types.BotCommand(command="/help", description="Adminlarga yordam so'rash")
     ]
@@ -1527,11 +4451,11 @@ async def set_default_commands():
 # 12. NOTIFY ADMINS OF LOGIN
 # ----------------------------
 
-async def notify_admins_of_login(user: tuple):
+async def notify_admins_of_login(user: UserRecord):
     """Har qanday foydalanuvchi tizimga kirganda barcha adminlarga xabar yuboradi."""
-    role = user[5].capitalize()  # 'admin' yoki 'sotuvchi'
-    telegram_id = user[6]
-    telegram_username = user[7] if user[7] else "N/A"
+    role = user.role.capitalize()  # 'admin' yoki 'sotuvchi'
+    telegram_id = user.telegram_id
+    telegram_username = user.telegram_username if user.telegram_username else "N/A"
 
     # Mapping 'sotuvchi' to 'Sotuvchi' for clarity
     account_type = "Admin" if role.lower() == 'admin' else "Sotuvchi"
@@ -1542,31 +4466,22 @@ async def notify_admins_of_login(user: tuple):
     else:
         telegram_username_display = "N/A"
 
-    message_text = (
-        f"📢 **YANGI LOGIN:**\n\n"
-        f"**AKKAUNT:** {account_type}\n"
-        f"**Telegram ID:** {telegram_id}\n"
-        f"**Telegram Username:** {telegram_username_display}"
-    )
+    message_text = NEW_LOGIN_TEMPLATE.render(account_type=account_type, telegram_id=telegram_id,
+                                             telegram_username=telegram_username_display)
 
-    admins = get_admins()
+    admins = await get_admins_async()
     if not admins:
         logger.warning("❌ Adminlar topilmadi. Xabar yuborilmadi.")
         return
 
-    for admin in admins:
-        admin_telegram_id = admin[6]
-        if admin_telegram_id:
-            try:
-                await bot.send_message(admin_telegram_id, message_text)
-            except Exception as e:
-                logger.error(f"❌ Adminga login haqida xabar yuborishda xatolik: {e}")
+    notifier.broadcast([admin[6] for admin in admins], message_text,
+                       error_text="❌ Adminga login haqida xabar yuborishda xatolik", parse_mode=ParseMode.MARKDOWN)
 
 # ----------------------------
 # 13. ERROR HANDLING
 # ----------------------------
 
-@dp.errors_handler()
+@handlers.errors_handler()
 async def global_error_handler(update, exception):
     """Global error handler to catch unexpected errors."""
     logger.exception(f"Xatolik yuz berdi: {exception}")
@@ -1574,21 +4489,459 @@ async def global_error_handler(update, exception):
         await update.reply("❌ Xatolik yuz berdi. Iltimos, keyinroq qayta urinib ko'ring.")
     return True  # Xatolik boshqa handlerlarga yetkazilmasligi uchun
 
+# ----------------------------
+# 13.1 WEBHOOK MODE
+# ----------------------------
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # masalan https://bot.example.com; bo'sh bo'lsa Telegramda webhook o'rnatilmaydi (lokal test)
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+WEBHOOK_RECORD_FILE = os.getenv("WEBHOOK_RECORD_FILE")  # kelgan yangilanishlarni JSONL ga yozib borish (replay_updates uchun)
+WEBHOOK_DRAIN_TIMEOUT = 30
+WEBHOOK_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def update_chat_id(data):
+    """Xom yangilanishdan chat ID sini oladi (FSM shu chat bo'yicha yuritiladi)."""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post', 'callback_query'):
+        obj = data.get(key)
+        if not obj:
+            continue
+        chat = obj.get('chat') or (obj.get('message') or {}).get('chat') or obj.get('from') or {}
+        return chat.get('id')
+    return None
+
+class UpdateGate:
+    """
+    Yangilanishlarni qayta ishlashni boshqaradi (webhook va shard workerlarida).
+
+    Turli chatlarning yangilanishlari parallel, bitta chatnikilari esa kelgan
+    tartibda qayta ishlanadi (OrderProcess qadamlari aralashib ketmasligi uchun).
+    To'xtashda yangi webhook so'rovlari 503 bilan qaytariladi (Telegram ularni keyin
+    qayta yuboradi) va boshlangan so'rovlar tugashi kutiladi.
+    """
+
+    def __init__(self, secret=None):
+        self.secret = secret
+        self.draining = False
+        self._locks = {}  # chat_id -> [Lock, kutayotganlar soni]
+        self._inflight = set()
+
+    def check_secret(self, request):
+        if not self.secret:
+            return True
+        return hmac.compare_digest(request.headers.get(WEBHOOK_SECRET_HEADER, ""), self.secret)
+
+    @asynccontextmanager
+    async def enter(self, chat_id):
+        task = asyncio.current_task()
+        self._inflight.add(task)
+        slot = self._locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        slot[1] += 1
+        try:
+            async with slot[0]:
+                yield
+        finally:
+            slot[1] -= 1
+            if not slot[1]:
+                del self._locks[chat_id]
+            self._inflight.discard(task)
+
+    @property
+    def pending(self):
+        return len(self._inflight)
+
+    async def drain(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Yangi so'rovlarni qabul qilishni to'xtatadi va boshlanganlarini kutadi."""
+        self.draining = True
+        if self._inflight:
+            logger.info(f"⏳ {len(self._inflight)} ta webhook so'rovi tugashi kutilmoqda...")
+            await asyncio.wait(set(self._inflight), timeout=timeout)
+
+update_gate = UpdateGate()
+
+class BotWebhookHandler(WebhookRequestHandler):
+    """Maxfiy token tekshiruvi va chat bo'yicha tartib bilan webhook handler."""
+
+    async def post(self):
+        if not update_gate.check_secret(self.request):
+            logger.warning(f"⚠️ Noto'g'ri webhook maxfiy tokeni: {self.request.remote}")
+            raise web.HTTPUnauthorized()
+        if update_gate.draining:
+            raise web.HTTPServiceUnavailable(headers={'Retry-After': '5'})
+        return await super().post()
+
+    async def parse_update(self, bot):
+        data = await self.request.json()
+        if WEBHOOK_RECORD_FILE:
+            with open(WEBHOOK_RECORD_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False) + "\n")
+        self.chat_id = update_chat_id(data)
+        return types.Update(**data)
+
+    async def process_update(self, update):
+        async with update_gate.enter(self.chat_id):
+            return await super().process_update(update)
+
+def _percentile(values, percent):
+    """Saralangan ro'yxatdan percentil qiymatini oladi."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+    return values[index]
+
+async def replay_updates(path, url=None, concurrency=1):
+    """Yozib olingan yangilanishlarni (JSONL) lokal webhook serveriga POST qiladi (python bot.py replay_updates fayl [url] [parallel])."""
+    url = url or f"http://127.0.0.1:{WEBAPP_PORT}{WEBHOOK_PATH}"
+    headers = {'Content-Type': 'application/json'}
+    if WEBHOOK_SECRET:
+        headers[WEBHOOK_SECRET_HEADER] = WEBHOOK_SECRET
+    with open(path, encoding='utf-8') as f:
+        updates = [line.strip() for line in f if line.strip()]
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses, latencies = {}, []
+
+    async def post(session, body):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(url, data=body.encode('utf-8'), headers=headers) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, body) for body in updates))
+    elapsed = time.perf_counter() - started
+    print(f"{len(updates)} ta yangilanish {elapsed:.2f} s da yuborildi ({len(updates) / elapsed:.0f} ta/s), "
+          f"javoblar: {statuses}")
+    print(f"Kechikish: p50={_percentile(latencies, 50) * 1000:.1f} ms  p99={_percentile(latencies, 99) * 1000:.1f} ms")
+
+# ----------------------------
+# 13.2 SHARDED RUNTIME
+# ----------------------------
+# Front jarayon yangilanishlarni long polling bilan oladi va chat ID bo'yicha N ta
+# worker jarayonga taqsimlaydi. Bitta chat doim bitta workerga tushadi, shuning uchun
+# FSM qadamlari tartibi va SQLiteStorage keshi buzilmaydi. Workerlar umumiy SQLite
+# bazasi (WAL) va fsm_states jadvalidan foydalanadi. Google Sheets eksporti faqat
+# front jarayonda ishlaydi.
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2)))
+SHARD_QUEUE_SIZE = 1000
+SHARD_MAX_INFLIGHT = 32  # bitta workerda bir vaqtda qayta ishlanayotgan yangilanishlar
+SHARD_CHECK_INTERVAL = 1.0
+SHARD_REPORT_INTERVAL = 30.0
+
+def shard_for(chat_id, shards):
+    """Chat ID ni shard raqamiga aylantiradi (barcha jarayonlarda bir xil)."""
+    return chat_id % shards if chat_id is not None else 0
+
+def shard_worker(index, shards, updates, processed, parent_pid):
+    """Worker jarayon: o'z navbatidagi yangilanishlarni qayta ishlaydi."""
+    # Ctrl+C ni front jarayon boshqaradi: u navbat oxiriga to'xtash belgisini qo'yadi
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_shard_worker_main(index, shards, updates, processed, parent_pid))
+
+def _next_shard_update(updates, parent_pid):
+    """Navbatdan keyingi yangilanishni oladi; front jarayon o'lgan bo'lsa None qaytaradi."""
+    while True:
+        try:
+            return updates.get(timeout=1.0)
+        except queue.Empty:
+            if os.getppid() != parent_pid:
+                return None
+
+async def _process_shard_update(data, processed, index):
+    update = types.Update(**data)
+    async with update_gate.enter(update_chat_id(data)):
+        await dp.process_update(update)
+    processed[index] += 1
+
+async def _shard_worker_main(index, shards, updates, processed, parent_pid):
+    global notifier
+    # Telegramning umumiy cheklovi workerlar orasida bo'linadi
+    notifier = NotificationDispatcher(global_rate=TELEGRAM_GLOBAL_RATE / shards)
+    build_dispatcher()
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    loop = asyncio.get_running_loop()
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"shard{index}")
+    slots = asyncio.Semaphore(SHARD_MAX_INFLIGHT)
+    tasks = set()
+    catalog.load()
+    catalog.start()
+    user_cache_sync.start()
+    # Har bir worker o'z portida: METRICS_PORT + 1 + index
+    if METRICS_PORT:
+        metrics_server.port = METRICS_PORT + 1 + index
+        await metrics_server.start()
+    logger.info(f"✅ {index}-shard worker ishga tushdi (pid {os.getpid()}).")
+    try:
+        while True:
+            await slots.acquire()
+            data = await loop.run_in_executor(reader, _next_shard_update, updates, parent_pid)
+            if data is None:
+                slots.release()
+                break
+            task = asyncio.create_task(_process_shard_update(data, processed, index))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=WEBHOOK_DRAIN_TIMEOUT)
+        reader.shutdown(wait=True)
+        await metrics_server.stop()
+        await catalog.stop()
+        await user_cache_sync.stop()
+        await notifier.drain()
+        await storage.close()
+        password_hasher.shutdown()
+        export_executor.shutdown(wait=True)
+        db_executor.shutdown(wait=True)
+        db_pool.close()
+        await (await bot.get_session()).close()
+        logger.info(f"✅ {index}-shard worker to'xtadi.")
+
+class ShardSupervisor:
+    """
+    Worker jarayonlarni ishga tushiradi, yangilanishlarni ularga taqsimlaydi,
+    yiqilgan workerni qayta ishga tushiradi va navbat uzunligini jurnalga yozadi.
+    """
+
+    def __init__(self, shards=SHARD_WORKERS, queue_size=SHARD_QUEUE_SIZE):
+        self.shards = shards
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(queue_size) for _ in range(shards)]
+        self.processed = self._context.Array('q', shards, lock=False)
+        self.routed = [0] * shards
+        self.restarts = [0] * shards
+        self.processes = [None] * shards
+        self._last_report = 0.0
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=shard_worker, args=(index, self.shards, self.queues[index], self.processed, os.getpid()),
+            name=f"shard-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(self.shards):
+            self._spawn(index)
+
+    async def route(self, data):
+        """Yangilanishni chat ID si bo'yicha workerga yuboradi; navbat to'lsa bo'shashini kutadi."""
+        index = shard_for(update_chat_id(data), self.shards)
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            await asyncio.get_running_loop().run_in_executor(None, self.queues[index].put, data)
+        self.routed[index] += 1
+
+    def depth(self, index):
+        try:
+            return self.queues[index].qsize()
+        except NotImplementedError:  # macOS
+            return self.routed[index] - self.processed[index]
+
+    def check(self):
+        """Yiqilgan workerlarni qayta ishga tushiradi; vaqti-vaqti bilan holatni jurnalga yozadi."""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                self.restarts[index] += 1
+                logger.error(f"❌ {index}-shard worker to'xtab qoldi (exit code {process.exitcode}), "
+                             f"qayta ishga tushirilmoqda ({self.restarts[index]}-marta).")
+                self._spawn(index)
+        if time.monotonic() - self._last_report >= SHARD_REPORT_INTERVAL:
+            self._last_report = time.monotonic()
+            logger.info("📊 Shardlar: " + "; ".join(
+                f"#{index} navbat={self.depth(index)} qayta ishlandi={self.processed[index]} qayta ishga tushdi={self.restarts[index]}"
+                for index in range(self.shards)
+            ))
+
+    async def watch(self):
+        while True:
+            self.check()
+            await asyncio.sleep(SHARD_CHECK_INTERVAL)
+
+    def stop(self, timeout=WEBHOOK_DRAIN_TIMEOUT):
+        """Workerlarga to'xtash belgisini yuboradi va navbatdagilarni tugatishini kutadi."""
+        for index in range(self.shards):
+            self.queues[index].put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"⚠️ {process.name} o'z vaqtida to'xtamadi, majburan to'xtatilmoqda.")
+                process.terminate()
+
+async def run_sharded_polling(shards=SHARD_WORKERS):
+    """Front jarayon: long polling va workerlar nazorati."""
+    build_dispatcher()
+    supervisor = ShardSupervisor(shards)
+    supervisor.start()
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+    await bot.delete_webhook()
+    await set_default_commands()
+    sheets_exporter.start()
+    await metrics_server.start()  # front: Bot API, Sheets eksporti; handlerlar esa workerlar portlarida
+    watcher = asyncio.create_task(supervisor.watch())
+    logger.info(f"✅ Bot {shards} ta shard worker bilan ishga tushdi.")
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=20)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Yangilanishlarni olishda xatolik: {e}")
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                await supervisor.route(update.to_python())
+                offset = update.update_id + 1
+    except asyncio.CancelledError:
+        pass
+    finally:
+        watcher.cancel()
+        if offset is not None:
+            # Navbatga qo'yilgan yangilanishlarni Telegramda tasdiqlaymiz
+            try:
+                await bot.get_updates(offset=offset, timeout=0, limit=1)
+            except Exception as e:
+                logger.error(f"❌ Yangilanishlarni tasdiqlashda xatolik: {e}")
+        await loop.run_in_executor(None, supervisor.stop)
+        await metrics_server.stop()
+        await sheets_exporter.stop()
+        await (await bot.get_session()).close()
+        logger.info("✅ Bot to'xtadi.")
+
+# ----------------------------
+# 13.3 METRICS ENDPOINT
+# ----------------------------
+
+class MetricsServer:
+    """1.1 bo'limidagi metrikalarni alohida aiohttp serverida /metrics orqali beradi."""
+
+    def __init__(self, host=METRICS_HOST, port=METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def start(self):
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"📈 Metrikalar: http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request):
+        # So'rov paytidagi holat ko'rsatkichlari
+        try:
+            SHEETS_OUTBOX_DEPTH.set(await run_db(count_outbox))
+        except sqlite3.Error as e:
+            logger.error(f"❌ Outbox hajmini olishda xatolik: {e}")
+        NOTIFICATIONS_PENDING.set(notifier.pending)
+        return web.Response(body=render_metrics().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+metrics_server = MetricsServer()
+
 # ----------------------------
 # 14. MAIN
 # ----------------------------
 
+def build_dispatcher(token=None):
+    """Bot va Dispatcher ni yaratadi, middleware va handlerlarni ulaydi (faqat ishga tushirish buyruqlarida)."""
+    global bot, dp
+    token = token or API_TOKEN
+    if not token:
+        logger.error("❌ BOT_API_TOKEN o'zgaruvchisi topilmadi. Iltimos, .env faylini tekshiring.")
+        sys.exit(1)
+    bot = MeteredBot(token=token)
+    dp = Dispatcher(bot, storage=storage)
+    dp.middleware.setup(LoggingMiddleware())
+    dp.middleware.setup(MetricsMiddleware())
+    dp.middleware.setup(throttling)
+    handlers.register(dp)
+    return dp
+
+async def on_startup(dispatcher: Dispatcher):
+    catalog.load()
+    catalog.start()
+    user_cache_sync.start()
+    await set_default_commands()
+    sheets_exporter.start()
+    await metrics_server.start()
+    logger.info("✅ Bot ishga tushdi va komandalar belgilandi.")
+
+async def on_shutdown(dispatcher: Dispatcher):
+    await update_gate.drain()
+    await metrics_server.stop()
+    await catalog.stop()
+    await user_cache_sync.stop()
+    await notifier.drain()
+    await storage.close()
+    await sheets_exporter.stop()
+    password_hasher.shutdown()
+    export_executor.shutdown(wait=True)
+    db_executor.shutdown(wait=True)
+    db_pool.close()
+
+async def on_startup_webhook(dispatcher: Dispatcher):
+    await on_startup(dispatcher)
+    if WEBHOOK_URL:
+        # Webhook o'chirilmaydi: qayta ishga tushish vaqtida kelgan yangilanishlarni Telegram saqlab turadi
+        await bot.set_webhook(WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=update_gate.secret,
+                              max_connections=WEBHOOK_MAX_CONNECTIONS)
+        logger.info(f"✅ Webhook o'rnatildi: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        logger.info(f"ℹ️ WEBHOOK_URL berilmagan, webhook faqat lokal: http://{WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    if not update_gate.secret:
+        logger.warning("⚠️ WEBHOOK_SECRET berilmagan, so'rovlar maxfiy token bilan tekshirilmaydi.")
+
+def run_webhook():
+    """Botni webhook rejimida ishga tushiradi (python bot.py run_webhook)."""
+    # WEBHOOK_SECRET berilmagan bo'lsa, Telegramga yangi tasodifiy token beriladi
+    update_gate.secret = WEBHOOK_SECRET or (secrets.token_urlsafe(32) if WEBHOOK_URL else None)
+    runner = executor.Executor(build_dispatcher(), skip_updates=False)
+    runner.on_startup(on_startup_webhook, polling=False)
+    runner.on_shutdown(on_shutdown, polling=False)
+    runner.start_webhook(webhook_path=WEBHOOK_PATH, request_handler=BotWebhookHandler,
+                         host=WEBAPP_HOST, port=WEBAPP_PORT, shutdown_timeout=WEBHOOK_DRAIN_TIMEOUT)
+
 if __name__ == "__main__":
     init_db()
     if len(sys.argv) > 1:
         if sys.argv[1] == 'run_create_admin':
             create_admin()
         elif sys.argv[1] == 'run':
-            async def on_startup(dispatcher: Dispatcher):
-                await set_default_commands()
-                logger.info("✅ Bot ishga tushdi va komandalar belgilandi.")
-            executor.start_polling(dp, skip_updates=True, on_startup=on_startup)
+            executor.start_polling(build_dispatcher(), skip_updates=True, on_startup=on_startup, on_shutdown=on_shutdown)
+        elif sys.argv[1] == 'run_webhook':
+            run_webhook()
+        elif sys.argv[1] == 'run_sharded':
+            try:
+                asyncio.run(run_sharded_polling(*(int(arg) for arg in sys.argv[2:3])))
+            except KeyboardInterrupt:
+                pass
+        elif sys.argv[1] == 'replay_updates':
+            asyncio.run(replay_updates(sys.argv[2], *sys.argv[3:4], *(int(arg) for arg in sys.argv[4:5])))
         else:
-            print("❌ Noto'g'ri argument. Botni ishga tushirish uchun 'python bot.py run' yoki admin yaratish uchun 'python bot.py run_create_admin' ni kiriting.")
+            print("❌ Noto'g'ri argument. Botni ishga tushirish uchun 'python bot.py run' (yoki 'run_webhook') yoki admin yaratish uchun 'python bot.py run_create_admin' ni kiriting.")
     else:
-        print("❌ Argument kiritilmagan. Botni ishga tushirish uchun 'python bot.py run' yoki admin yaratish uchun 'python bot.py run_create_admin' ni kiriting.")
+        print("❌ Argument kiritilmagan. Botni ishga tushirish uchun 'python bot.py run' (yoki 'run_webhook') yoki admin yaratish uchun 'python bot.py run_create_admin' ni kiriting.")
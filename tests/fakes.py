@@ -0,0 +1,35 @@
+# Testlar va bench.py uchun tashqi xizmatlarning oflayn o'rinbosarlari.
+
+import re
+import time
+
+from bot import SHEET_ROW_LENGTH
+
+
+class FakeWorksheet:
+    """Google Sheets worksheet ning oflayn o'rinbosari: kechikish va nosozliklarni taqlid qiladi."""
+
+    def __init__(self, latency=0.0, failures=0):
+        self.latency = latency
+        self.failures = failures
+        self.rows = []
+        self.calls = 0
+        self.cells_read = 0
+
+    def append_rows(self, rows, value_input_option=None):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.failures > 0:
+            self.failures -= 1
+            raise ConnectionError("soxta tarmoq xatosi")
+        self.rows.extend(rows)
+
+    def get(self, range_name):
+        self.calls += 1
+        time.sleep(self.latency)
+        start_row = int(re.match(r"[A-Z]+(\d+)", range_name)[1])
+        values = [[row[SHEET_ROW_LENGTH - 1]] if len(row) >= SHEET_ROW_LENGTH else [] for row in self.rows[start_row - 1:]]
+        while values and not values[-1]:
+            values.pop()
+        self.cells_read += len(values)
+        return values
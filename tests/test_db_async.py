@@ -0,0 +1,47 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import bot
+from bench import BENCH_PRODUCTS, _measure_loop_lag, _percentile, bench_database
+
+LOCK_HOLD = 0.25  # Boshqa ulanish yozish lockini shuncha soniya ushlab turadi
+ORDERS = 50
+LAG_P99_LIMIT = 0.05  # Sinxron save_order bilan p99 kechikish LOCK_HOLD ga yaqin bo'ladi
+
+
+def test_save_order_async_keeps_event_loop_responsive_under_write_lock():
+    """Yozish lockini kutayotgan save_order_async event loopni to'xtatib qo'ymasligi kerak."""
+    with bench_database() as db_file:
+        locked = threading.Event()
+
+        def hold_write_lock():
+            conn = sqlite3.connect(db_file, isolation_level=None)
+            conn.execute("BEGIN IMMEDIATE")
+            locked.set()
+            time.sleep(LOCK_HOLD)
+            conn.execute("COMMIT")
+            conn.close()
+
+        saved = []
+
+        async def workload():
+            locker = threading.Thread(target=hold_write_lock)
+            locker.start()
+            await asyncio.to_thread(locked.wait)
+            saved.extend(await asyncio.gather(*(
+                bot.save_order_async(1 + i % 100, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                                     'Andijon', 'Manzil', 'Bugun', '')
+                for i in range(ORDERS)
+            )))
+            await asyncio.to_thread(locker.join)
+
+        elapsed, lags = asyncio.run(_measure_loop_lag(workload))
+        with bot.db_pool.reader() as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    assert all(saved) and stored == ORDERS
+    # Buyurtmalar haqiqatan ham lockni kutgan: aks holda o'lchov hech narsani tekshirmaydi
+    assert elapsed >= LOCK_HOLD * 0.8
+    assert _percentile(lags, 99) < LAG_P99_LIMIT, f"p99={_percentile(lags, 99) * 1000:.1f} ms"
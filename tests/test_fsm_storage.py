@@ -0,0 +1,52 @@
+import asyncio
+
+import bot
+from bench import bench_database
+
+
+def test_saved_state_survives_restart_and_new_chats_skip_database(monkeypatch):
+    """Saqlangan holat qayta ishga tushgandan keyin tiklanadi; yangi chat uchun bazaga murojaat qilinmaydi."""
+    with bench_database(sellers=0):
+        async def first_run():
+            storage = bot.SQLiteStorage()
+            await storage.set_state(chat=1, user=1, state='OrderProcess:step3')
+            await storage.update_data(chat=1, user=1, data={'mahsulot': 'olma'})
+            await storage.close()
+
+        asyncio.run(first_run())
+
+        loads = []
+        load_fsm_state = bot.load_fsm_state
+
+        def counting_load(chat, user, cutoff):
+            loads.append((chat, user))
+            return load_fsm_state(chat, user, cutoff)
+
+        monkeypatch.setattr(bot, 'load_fsm_state', counting_load)
+
+        async def second_run():
+            storage = bot.SQLiteStorage()
+            try:
+                restored = (await storage.get_state(chat=1, user=1), await storage.get_data(chat=1, user=1))
+                fresh = (await storage.get_state(chat=2, user=2), await storage.get_data(chat=2, user=2))
+                await storage.set_state(chat=2, user=2, state='OrderProcess:step1')
+                return restored, fresh
+            finally:
+                await storage.close()
+
+        restored, fresh = asyncio.run(second_run())
+
+        async def third_run():
+            storage = bot.SQLiteStorage()
+            try:
+                return await storage.get_state(chat=2, user=2)
+            finally:
+                await storage.close()
+
+        saved_later = asyncio.run(third_run())
+
+    assert restored == ('OrderProcess:step3', {'mahsulot': 'olma'})
+    assert fresh == (None, {})
+    # Faqat bazada yozuvi bor manzillar o'qiladi
+    assert loads == [('1', '1'), ('2', '2')]
+    assert saved_later == 'OrderProcess:step1'
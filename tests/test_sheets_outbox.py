@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import bot
+from bench import BENCH_PRODUCTS, bench_database
+from tests.fakes import FakeWorksheet
+
+
+def save_orders(count):
+    return [bot.save_order(1, BENCH_PRODUCTS, 1620000, 0, 'Ism', 'Familiya', '901234567',
+                           'Andijon', 'Manzil', 'Bugun', '') for _ in range(count)]
+
+
+def outbox_rows():
+    with bot.db_pool.reader() as conn:
+        return conn.execute("SELECT order_id, attempts, next_attempt_at, last_error FROM sheets_outbox ORDER BY id").fetchall()
+
+
+def run_exporter(worksheet, scenario):
+    """scenario(exporter) ni yangi event loopda bajaradi va eksportchining oqimini yopadi."""
+    exporter = bot.SheetsExporter(worksheet_factory=lambda: worksheet)
+
+    async def run():
+        try:
+            return await scenario(exporter)
+        finally:
+            await exporter.stop()
+
+    return asyncio.run(run())
+
+
+def test_successful_flush_removes_rows_from_outbox():
+    with bench_database(sellers=1):
+        order_ids = save_orders(3)
+        assert len(outbox_rows()) == 3
+        worksheet = FakeWorksheet()
+
+        sent = run_exporter(worksheet, lambda exporter: exporter.flush())
+
+        assert sent == 3
+        assert outbox_rows() == []
+        assert [row[-1] for row in worksheet.rows] == order_ids
+
+
+def test_append_error_keeps_rows_and_backs_off():
+    with bench_database(sellers=1):
+        order_ids = save_orders(2)
+        worksheet = FakeWorksheet(failures=1)
+        started = time.time()
+
+        sent = run_exporter(worksheet, lambda exporter: exporter.flush())
+
+        assert sent == 0 and worksheet.rows == []
+        rows = outbox_rows()
+        assert [row[0] for row in rows] == order_ids
+        for _, attempts, next_attempt_at, last_error in rows:
+            assert attempts == 1
+            assert next_attempt_at >= started + 2  # 2 ** attempts soniya pauza
+            assert "soxta tarmoq xatosi" in last_error
+
+
+def test_rows_are_not_sent_twice_after_retry():
+    with bench_database(sellers=1):
+        order_ids = save_orders(3)
+        worksheet = FakeWorksheet(failures=1)
+
+        async def scenario(exporter):
+            first = await exporter.flush()
+            # Pauzani kutmaslik uchun qayta urinish vaqtini hozirga suramiz
+            with bot.db_pool.writer() as conn:
+                conn.execute("UPDATE sheets_outbox SET next_attempt_at = 0")
+            retried = await exporter.flush()
+            again = await exporter.flush()
+            return first, retried, again, await exporter.reconcile()
+
+        first, retried, again, result = run_exporter(worksheet, scenario)
+
+        assert (first, retried, again) == (0, 3, 0)
+        assert [row[-1] for row in worksheet.rows] == order_ids
+        assert outbox_rows() == []
+        assert result.duplicates == [] and result.missing == []
@@ -0,0 +1,45 @@
+import asyncio
+
+import bot
+from bench import bench_database
+from tests.fakes import FakeWorksheet
+from tests.test_sheets_outbox import save_orders
+
+
+def test_order_pending_during_reconcile_is_checked_later():
+    """Reconcile vaqtida outbox da kutayotgan buyurtma kursordan o'tib ketmasligi kerak."""
+    with bench_database(sellers=1):
+        worksheet = FakeWorksheet()
+        exporter = bot.SheetsExporter(worksheet_factory=lambda: worksheet, reconcile_interval=0)
+
+        async def scenario():
+            try:
+                flushed = save_orders(3)
+                await exporter.flush()
+                # Navbatdagi buyurtma yuborilmay qoladi (pauza bilan outbox da kutadi), keyingisi yuboriladi
+                [pending] = save_orders(1)
+                worksheet.failures = 1
+                await exporter.flush()
+                [later] = save_orders(1)
+                await exporter.flush()
+                first = await exporter.reconcile()
+
+                # Kutayotgan qator endi yuboriladi, lekin jadvaldan yo'qoladi (masalan, qo'lda o'chirilgan)
+                with bot.db_pool.writer() as conn:
+                    conn.execute("UPDATE sheets_outbox SET next_attempt_at = 0")
+                await exporter.flush()
+                worksheet.rows = [row for row in worksheet.rows if row[-1] != pending]
+                second = await exporter.reconcile()
+                return flushed, pending, later, first, second
+            finally:
+                await exporter.stop()
+
+        flushed, pending, later, first, second = asyncio.run(scenario())
+        order_cursor, _ = bot.get_reconcile_cursor()
+
+    # Birinchi tekshiruv kutayotgan buyurtmadan oldin to'xtaydi
+    assert first.checked == len(flushed) and first.missing == []
+    # Ikkinchisi kutgan va undan keyingi buyurtmani tekshiradi va yo'qolganini qayta yuboradi
+    assert second.checked == 2 and second.missing == [pending]
+    assert order_cursor == later
+    assert sorted(row[-1] for row in worksheet.rows) == flushed + [pending, later]
@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+import bot
+from bench import LAZY_MODULES, STARTUP_BUDGET_MS, _import_profile, _percentile
+
+ROOT = os.path.dirname(os.path.abspath(bot.__file__))
+ENV = dict(os.environ, BOT_API_TOKEN='')  # CLI buyruqlari kabi tokensiz import
+
+
+def test_import_does_not_load_heavy_modules():
+    result = subprocess.run(
+        [sys.executable, '-c', 'import json, sys, bot; print(json.dumps(sorted(sys.modules)))'],
+        cwd=ROOT, env=ENV, capture_output=True, text=True, check=True,
+    )
+    modules = json.loads(result.stdout.splitlines()[-1])
+    loaded = [name for name in modules if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES)]
+    # 'google' nomlar fazosining o'zi .pth orqali interpretator ishga tushishida yuklanadi; uning modullari emas
+    loaded += [name for name in modules if name.startswith('google.')]
+    assert not loaded, f"import bot og'ir modullarni yukladi: {sorted(set(loaded))}"
+
+
+def test_import_time_within_budget():
+    _import_profile(bot.__name__, ROOT, ENV)  # isitish: .pyc keshlari yoziladi
+    totals = [_import_profile(bot.__name__, ROOT, ENV)[1][1] / 1000 for _ in range(3)]
+    assert _percentile(totals, 50) <= STARTUP_BUDGET_MS, (
+        f"import bot median {_percentile(totals, 50):.0f} ms > {STARTUP_BUDGET_MS:.0f} ms (STARTUP_BUDGET_MS)"
+    )
@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from aiogram.bot.api import TelegramAPIServer
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+
+import bot
+from bench import BENCH_BOT_TOKEN, FakeBotAPI, bench_database
+
+SECRET = "test-secret"
+CHAT_ID = 555
+
+
+def start_update(update_id):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': int(time.time()), 'text': '/start',
+            'chat': {'id': CHAT_ID, 'type': 'private'},
+            'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'Test'},
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+def test_webhook_checks_secret_records_and_replays_updates(tmp_path, monkeypatch, capsys):
+    """To'g'ri maxfiy token bilan kelgan yangilanish qayta ishlanib yoziladi, replay_updates uni qayta yuboradi."""
+    record_file = tmp_path / "updates.jsonl"
+    monkeypatch.setattr(bot.update_gate, 'secret', SECRET)
+    monkeypatch.setattr(bot, 'WEBHOOK_SECRET', SECRET)
+    monkeypatch.setattr(bot, 'WEBHOOK_RECORD_FILE', str(record_file))
+
+    with bench_database(sellers=0):
+        api = FakeBotAPI().start()
+        monkeypatch.setattr(bot, 'storage', bot.SQLiteStorage())
+        dp = bot.build_dispatcher(BENCH_BOT_TOKEN)
+        bot.bot.server = TelegramAPIServer.from_base(api.url)
+
+        async def scenario():
+            app = web.Application()
+            app[BOT_DISPATCHER_KEY] = dp
+            app.router.add_route('*', bot.WEBHOOK_PATH, bot.BotWebhookHandler)
+            statuses = {}
+            try:
+                async with TestServer(app) as server:
+                    url = str(server.make_url(bot.WEBHOOK_PATH))
+                    async with aiohttp.ClientSession() as session:
+                        for label, headers in (("accepted", {bot.WEBHOOK_SECRET_HEADER: SECRET}),
+                                               ("wrong", {bot.WEBHOOK_SECRET_HEADER: "noto'g'ri"}),
+                                               ("missing", {})):
+                            async with session.post(url, json=start_update(len(statuses) + 1), headers=headers) as response:
+                                statuses[label] = response.status
+                    statuses['sent_before_replay'] = api.requests['sendmessage']
+                    await bot.replay_updates(str(record_file), url)
+            finally:
+                await bot.storage.close()
+                await (await bot.bot.get_session()).close()
+            return statuses
+
+        try:
+            statuses = asyncio.run(scenario())
+        finally:
+            api.stop()
+
+    assert statuses['accepted'] == 200
+    assert statuses['wrong'] == 401 and statuses['missing'] == 401
+    # Faqat qabul qilingan yangilanish qayta ishlangan va yozib olingan
+    assert statuses['sent_before_replay'] == 1
+    assert len(record_file.read_text(encoding='utf-8').splitlines()) == 2  # asl so'rov + replay
+    assert "javoblar: {200: 1}" in capsys.readouterr().out
+    assert api.requests['sendmessage'] == 2